@@ -9,6 +9,8 @@ from pwnagotchi._version import __version__
 
 _name = None
 config = None
+# the configuration as it was last loaded from the files, before the AI or anything else changed it at runtime
+loaded_config = None
 
 
 def set_name(new_name):
@@ -116,6 +118,13 @@ def shutdown():
 
     logging.warning("syncing...")
 
+    from pwnagotchi.ai import checkpoint
+    checkpoint.flush()
+
+    from pwnagotchi import log, journal
+    log.flush()
+    journal.flush(sync=True)
+
     from pwnagotchi import fs
     for m in fs.mounts:
         m.sync()
@@ -127,6 +136,9 @@ def shutdown():
 def restart(mode):
     logging.warning("restarting in %s mode ...", mode)
 
+    from pwnagotchi.ai import checkpoint
+    checkpoint.flush()
+
     if mode == 'AUTO':
         os.system("touch /root/.pwnagotchi-auto")
     else:
@@ -136,6 +148,83 @@ def restart(mode):
     os.system("service pwnagotchi restart")
 
 
+# configuration keys only read at startup, changing them (or anything below them) needs a restart
+RESTART_KEYS = ('main.iface', 'main.mon_start_cmd', 'main.mon_stop_cmd', 'main.no_restart', 'main.name', 'main.lang',
+                'main.custom_plugins', 'main.log', 'main.connectivity', 'personality.advertise', 'ui', 'bettercap',
+                'ai', 'fs')
+
+
+def needs_restart(key):
+    return any(key == prefix or key.startswith(prefix + '.') for prefix in RESTART_KEYS)
+
+
+def reload_config(mode='AUTO', default_config='/etc/pwnagotchi/default.toml',
+                  user_config='/etc/pwnagotchi/config.toml'):
+    """
+    Loads the configuration files again and applies the changes to the running unit, restarting it only
+    if one of the changed keys is read at startup. Returns the changed keys and whether it's restarting.
+    """
+    import copy
+    import argparse
+    import _thread
+    from pwnagotchi import utils, plugins
+    from pwnagotchi.ui import view
+
+    try:
+        new_config = utils.load_config(argparse.Namespace(config=default_config, user_config=user_config))
+    except SystemExit:
+        raise ValueError("the configuration can't be loaded")
+
+    global loaded_config
+
+    # compare files with files, the live configuration also holds the personality tuned by the AI
+    changed = utils.diff_config(loaded_config if loaded_config is not None else config, new_config)
+    if not changed:
+        logging.info("configuration reloaded, nothing changed")
+        return changed, False
+
+    restart_keys = [key for key in changed if needs_restart(key)]
+    if restart_keys:
+        logging.info("configuration reloaded, restart needed for %s", ', '.join(restart_keys))
+        _thread.start_new_thread(restart, (mode,))
+        return changed, True
+
+    logging.info("configuration reloaded, applying %s", ', '.join(changed))
+
+    prefix = 'main.plugins.'
+    affected = sorted(set(key[len(prefix):].split('.')[0] for key in changed if key.startswith(prefix)))
+    toggled = {}
+    for name in affected:
+        was_enabled = config['main']['plugins'].get(name, {}).get('enabled', False)
+        enabled = new_config['main']['plugins'].get(name, {}).get('enabled', False)
+        if enabled != was_enabled:
+            toggled[name] = enabled
+
+    # keep the values the AI changed at runtime unless the user edited them
+    missing = object()
+    live, pristine = utils.flatten_config(config), utils.flatten_config(loaded_config or {})
+    tuned = dict((key, value) for key, value in live.items()
+                 if key.startswith('personality.') and key not in changed and pristine.get(key, missing) != value)
+
+    utils.update_config(config, new_config)
+    for key, value in tuned.items():
+        config['personality'][key.split('.', 1)[1]] = value
+    loaded_config = copy.deepcopy(new_config)
+
+    agent = view.ROOT._agent if view.ROOT else None
+    if agent is not None:
+        agent.apply_config(changed)
+
+    for name in affected:
+        if name in toggled:
+            plugins.toggle_plugin(name, toggled[name])
+        elif name in plugins.loaded and name in config['main']['plugins']:
+            plugins.loaded[name].options = config['main']['plugins'][name]
+            plugins.one(name, 'config_changed', config)
+
+    return changed, False
+
+
 def reboot(mode=None):
     if mode is not None:
         mode = mode.upper()
@@ -156,6 +245,13 @@ def reboot(mode=None):
 
     logging.warning("syncing...")
 
+    from pwnagotchi.ai import checkpoint
+    checkpoint.flush()
+
+    from pwnagotchi import log, journal
+    log.flush()
+    journal.flush(sync=True)
+
     from pwnagotchi import fs
     for m in fs.mounts:
         m.sync()
@@ -9,6 +9,8 @@ import _thread
 import pwnagotchi
 import pwnagotchi.utils as utils
 import pwnagotchi.plugins as plugins
+import pwnagotchi.journal as journal
+import pwnagotchi.profiler as profiler
 from pwnagotchi.ui.web.server import Server
 from pwnagotchi.automata import Automata
 from pwnagotchi.log import LastSession
@@ -18,6 +20,13 @@ from pwnagotchi.ai.train import AsyncTrainer
 
 RECOVERY_DATA_FILE = '/root/.pwnagotchi-recovery'
 
+# personality parameters that are settings of the bettercap wifi module
+WIFI_PERSONALITY = {
+    'ap_ttl': 'wifi.ap.ttl',
+    'sta_ttl': 'wifi.sta.ttl',
+    'min_rssi': 'wifi.rssi.min',
+}
+
 
 class Agent(Client, Automata, AsyncAdvertiser, AsyncTrainer):
     def __init__(self, view, config, keypair):
@@ -35,7 +44,8 @@ class Agent(Client, Automata, AsyncAdvertiser, AsyncTrainer):
         self._current_channel = 0
         self._tot_aps = 0
         self._aps_on_channel = 0
-        self._supported_channels = utils.iface_channels(config['main']['iface'])
+        with profiler.phase('iface_channels'):
+            self._supported_channels = utils.iface_channels(config['main']['iface'])
         self._view = view
         self._view.set_agent(self)
         self._web_ui = Server(self, config['ui'])
@@ -65,6 +75,8 @@ class Agent(Client, Automata, AsyncAdvertiser, AsyncTrainer):
 
     def setup_events(self):
         logging.info("connecting to %s ...", self.url)
+        journal.record(journal.SESSION, name=pwnagotchi.name(), identity=self.fingerprint(),
+                       version=pwnagotchi.__version__, mode=self.mode)
 
         for tag in self._config['bettercap']['silence']:
             try:
@@ -75,12 +87,29 @@ class Agent(Client, Automata, AsyncAdvertiser, AsyncTrainer):
     def _reset_wifi_settings(self):
         mon_iface = self._config['main']['iface']
         self.run('set wifi.interface %s' % mon_iface)
-        self.run('set wifi.ap.ttl %d' % self._config['personality']['ap_ttl'])
-        self.run('set wifi.sta.ttl %d' % self._config['personality']['sta_ttl'])
-        self.run('set wifi.rssi.min %d' % self._config['personality']['min_rssi'])
+        for name in WIFI_PERSONALITY:
+            self._set_wifi_personality(name)
         self.run('set wifi.handshakes.file %s' % self._config['bettercap']['handshakes'])
         self.run('set wifi.handshakes.aggregate false')
 
+    def _set_wifi_personality(self, name):
+        self.run('set %s %d' % (WIFI_PERSONALITY[name], self._config['personality'][name]))
+
+    def apply_config(self, changed):
+        """
+        Applies the keys changed by pwnagotchi.reload_config, the configuration has been updated in place already
+        and everything else is read from it when needed
+        """
+        if 'main.filter' in changed:
+            self._filter = None if not self._config['main']['filter'] else re.compile(self._config['main']['filter'])
+
+        for name in WIFI_PERSONALITY:
+            if 'personality.%s' % name in changed:
+                try:
+                    self._set_wifi_personality(name)
+                except Exception as e:
+                    logging.error("error while setting personality.%s: %s" % (name, e))
+
     def start_monitor_mode(self):
         mon_iface = self._config['main']['iface']
         mon_start_cmd = self._config['main']['mon_start_cmd']
@@ -333,6 +362,7 @@ class Agent(Client, Automata, AsyncAdvertiser, AsyncTrainer):
                 self._handshakes[key] = jmsg
                 s = self.session()
                 ap_and_station = self._find_ap_sta_in(sta_mac, ap_mac, s)
+                journal.record(journal.HANDSHAKE, ap=ap_mac, sta=sta_mac, file=filename)
                 if ap_and_station is None:
                     logging.warning("!!! captured new handshake: %s !!!", key)
                     self._last_pwnd = ap_mac
@@ -413,6 +443,8 @@ class Agent(Client, Automata, AsyncAdvertiser, AsyncTrainer):
                     ap['hostname'], ap['mac'], ap['vendor'], ap['channel'], len(ap['clients']), ap['rssi'])
                 self.run('wifi.assoc %s' % ap['mac'])
                 self._epoch.track(assoc=True)
+                journal.record(journal.ASSOCIATION, ap=ap['mac'], hostname=ap['hostname'], channel=ap['channel'],
+                               rssi=ap['rssi'], clients=len(ap['clients']))
             except Exception as e:
                 self._on_error(ap['mac'], e)
 
@@ -434,6 +466,7 @@ class Agent(Client, Automata, AsyncAdvertiser, AsyncTrainer):
                     sta['mac'], sta['vendor'], ap['hostname'], ap['mac'], ap['vendor'], ap['channel'], ap['rssi'])
                 self.run('wifi.deauth %s' % sta['mac'])
                 self._epoch.track(deauth=True)
+                journal.record(journal.DEAUTH, ap=ap['mac'], sta=sta['mac'], channel=ap['channel'], rssi=ap['rssi'])
             except Exception as e:
                 self._on_error(sta['mac'], e)
 
@@ -1,58 +1,87 @@
 import os
 import time
 import logging
+import contextlib
+import collections
+
+from pwnagotchi.ai import checkpoint
 
 # https://stackoverflow.com/questions/40426502/is-there-a-way-to-suppress-the-messages-tensorflow-prints/40426709
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # or any {'0', '1', '2'}
 
 
+# seconds spent in every phase of the last load(), filled while loading
+metrics = collections.OrderedDict()
+
+
+@contextlib.contextmanager
+def _phase(name, what):
+    start = time.time()
+    yield
+    metrics[name] = time.time() - start
+    logging.debug("[ai] %s in %.2fs" % (what, metrics[name]))
+
+
 def load(config, agent, epoch, from_disk=True):
     config = config['ai']
     if not config['enabled']:
         logging.info("ai disabled")
         return False
 
-    try:
-        begin = time.time()
+    metrics.clear()
+    begin = time.time()
+
+    if config['numpy_inference'] and from_disk:
+        from pwnagotchi.ai import inference
+        with _phase('numpy', "numpy model loaded"):
+            model = inference.load(config, agent, epoch)
+        if model is not None:
+            metrics['total'] = time.time() - begin
+            return model
 
+    try:
         logging.info("[ai] bootstrapping dependencies ...")
 
-        start = time.time()
-        from stable_baselines import A2C
-        logging.debug("[ai] A2C imported in %.2fs" % (time.time() - start))
+        with _phase('import_a2c', "A2C imported"):
+            from stable_baselines import A2C
 
-        start = time.time()
-        from stable_baselines.common.policies import MlpLstmPolicy
-        logging.debug("[ai] MlpLstmPolicy imported in %.2fs" % (time.time() - start))
+        with _phase('import_policy', "MlpLstmPolicy imported"):
+            from stable_baselines.common.policies import MlpLstmPolicy
 
-        start = time.time()
-        from stable_baselines.common.vec_env import DummyVecEnv
-        logging.debug("[ai] DummyVecEnv imported in %.2fs" % (time.time() - start))
+        with _phase('import_vec_env', "DummyVecEnv imported"):
+            from stable_baselines.common.vec_env import DummyVecEnv
 
-        start = time.time()
-        import pwnagotchi.ai.gym as wrappers
-        logging.debug("[ai] gym wrapper imported in %.2fs" % (time.time() - start))
+        with _phase('import_gym', "gym wrapper imported"):
+            import pwnagotchi.ai.gym as wrappers
 
         env = wrappers.Environment(agent, epoch)
         env = DummyVecEnv([lambda: env])
 
         logging.info("[ai] creating model ...")
 
-        start = time.time()
-        a2c = A2C(MlpLstmPolicy, env, **config['params'])
-        logging.debug("[ai] A2C created in %.2fs" % (time.time() - start))
-
-        if from_disk and os.path.exists(config['path']):
-            logging.info("[ai] loading %s ..." % config['path'])
-            start = time.time()
-            a2c.load(config['path'], env)
-            logging.debug("[ai] A2C loaded in %.2fs" % (time.time() - start))
-        else:
+        # the graph is built once, the checkpoint weights are loaded into it
+        with _phase('create', "A2C created"):
+            a2c = A2C(MlpLstmPolicy, env, **config['params'])
+
+        # fall back to the previous checkpoints if the last one can't be loaded
+        candidates = [path for path in checkpoint.backups(config['path'], config['checkpoint']['keep'])
+                      if from_disk and os.path.exists(path)]
+        for path in candidates:
+            logging.info("[ai] loading %s ..." % path)
+            try:
+                with _phase('load', "A2C loaded"):
+                    a2c.load_parameters(path)
+                break
+            except Exception as e:
+                logging.error("[ai] can't load %s: %s" % (path, e))
+
+        if not candidates:
             logging.info("[ai] model created:")
             for key, value in config['params'].items():
                 logging.info("      %s: %s" % (key, value))
 
-        logging.debug("[ai] total loading time is %.2fs" % (time.time() - begin))
+        metrics['total'] = time.time() - begin
+        logging.debug("[ai] total loading time is %.2fs" % metrics['total'])
 
         return a2c
     except Exception as e:
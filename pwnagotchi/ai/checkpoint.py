@@ -0,0 +1,165 @@
+import os
+import time
+import shutil
+import zipfile
+import logging
+import threading
+
+_on_shutdown = []
+# snapshots patch the model instance, the ai thread and the shutdown one can take one at the same time
+_snapshot_lock = threading.Lock()
+
+
+def snapshot(model):
+    """
+    Returns a copy of what model.save() would write, without writing it
+    """
+    captured = {}
+
+    def capture(save_path, data=None, params=None, cloudpickle=False):
+        captured.update(data=data, params=params, cloudpickle=cloudpickle)
+
+    with _snapshot_lock:
+        # the instance attribute shadows the static method used by save()
+        model._save_to_file = capture
+        try:
+            model.save(None)
+        finally:
+            del model._save_to_file
+
+    return type(model), captured
+
+
+def is_valid(path):
+    if not zipfile.is_zipfile(path):
+        # old cloudpickle format, nothing to check
+        return os.path.getsize(path) > 0
+    with zipfile.ZipFile(path) as zf:
+        return zf.testzip() is None
+
+
+class Checkpointer(object):
+    """
+    Saves the model every `steps` training steps, every `interval` seconds and on request (best reward, shutdown).
+
+    The weights are copied out of the tensorflow session when the checkpoint is taken and written to disk by a
+    background thread; if a new checkpoint is taken while the previous one is still being written only the latest
+    one is kept. The model file is only replaced by a checkpoint that can be read back, and the `keep` - 1 previous
+    ones are kept as path.1, path.2, ...
+    """
+
+    def __init__(self, path, steps=10, interval=1800, keep=3):
+        self.path = path
+        self.steps = steps
+        self.interval = interval
+        self.keep = keep
+        self.saves = 0
+        self._steps = 0
+        self._saved_at = time.time()
+        self._pending = None
+        self._busy = False
+        self._cond = threading.Condition()
+        self._writer = None
+
+    def on_step(self, model, best=False):
+        self._steps += 1
+        if best or self._steps >= self.steps or time.time() - self._saved_at >= self.interval:
+            self.save(model)
+
+    def save(self, model, sync=False):
+        start = time.time()
+        model_cls, data = snapshot(model)
+        logging.debug("[ai] model snapshot taken in %.2fs" % (time.time() - start))
+        self._steps = 0
+        self._saved_at = time.time()
+
+        with self._cond:
+            if not sync:
+                self._pending = (model_cls, data)
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._worker, daemon=True)
+                    self._writer.start()
+                self._cond.notify_all()
+                return
+            # the one being written is older
+            self._pending = None
+            while self._busy:
+                self._cond.wait()
+            self._busy = True
+
+        try:
+            self._write(model_cls, data)
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._pending is None or self._busy:
+                    self._cond.wait()
+                model_cls, data = self._pending
+                self._pending = None
+                self._busy = True
+            try:
+                self._write(model_cls, data)
+            except Exception as e:
+                logging.exception("[ai] error while saving the model (%s)", e)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _rotate(self):
+        for i in range(self.keep - 1, 1, -1):
+            older = "%s.%d" % (self.path, i - 1)
+            if os.path.exists(older):
+                os.replace(older, "%s.%d" % (self.path, i))
+
+        if self.keep > 1 and os.path.exists(self.path):
+            last = "%s.1" % self.path
+            if os.path.exists(last):
+                os.remove(last)
+            try:
+                os.link(self.path, last)
+            except OSError:
+                shutil.copyfile(self.path, last)
+
+    def _write(self, model_cls, data):
+        start = time.time()
+        temp = "%s.tmp" % self.path
+        model_cls._save_to_file(temp, **data)
+
+        if not is_valid(temp):
+            logging.error("[ai] checkpoint %s is corrupted, keeping the previous model" % temp)
+            os.remove(temp)
+            return
+
+        self._rotate()
+        os.replace(temp, self.path)
+        self.saves += 1
+        logging.info("[ai] model saved to %s in %.2fs" % (self.path, time.time() - start))
+
+
+def backups(path, keep):
+    return [path] + ["%s.%d" % (path, i) for i in range(1, keep)]
+
+
+def on_shutdown(callback):
+    _on_shutdown.append(callback)
+
+
+def flush():
+    """
+    Saves the models and the stats before shutting down
+    """
+    for callback in _on_shutdown:
+        try:
+            callback()
+        except Exception as e:
+            logging.error("[ai] error while saving before shutdown: %s" % e)
@@ -0,0 +1,83 @@
+# Handles the commandline stuff
+
+import os
+import logging
+
+
+def add_parsers(parser, subparsers):
+    """
+    Adds the ai subcommand to a given argparse.ArgumentParser
+    """
+    ## pwnagotchi ai
+    parser_ai = subparsers.add_parser('ai')
+    ai_subparsers = parser_ai.add_subparsers(dest='aicmd')
+
+    ## pwnagotchi ai export
+    parser_ai_export = ai_subparsers.add_parser('export', help='Export the model weights for the numpy inference')
+    parser_ai_export.add_argument('-o', '--output', type=str, default=None,
+                                  help='Path of the .npz file (default: next to the model)')
+
+    ## pwnagotchi ai train
+    parser_ai_train = ai_subparsers.add_parser('train', help='Train the model')
+    parser_ai_train.add_argument('--offline', action='store_true', default=False,
+                                 help='Train on the recorded replay buffer (better with the agent stopped)')
+    parser_ai_train.add_argument('-e', '--epochs', type=int, default=1, help='Passes over the replay buffer')
+    parser_ai_train.add_argument('-b', '--batch-size', dest='batch_size', type=int, default=64,
+                                 help='Transitions per update')
+
+    return parser
+
+
+def used_ai_cmd(args):
+    """
+    Checks if the ai subcommand was used
+    """
+    return hasattr(args, 'aicmd')
+
+
+def handle_cmd(args, config):
+    """
+    Parses the arguments and does the thing the user wants
+    """
+    if args.aicmd == 'export':
+        return export(args, config)
+    elif args.aicmd == 'train':
+        return train(args, config)
+
+    raise NotImplementedError()
+
+
+def export(args, config):
+    """
+    Dumps the policy weights of the trained model to a numpy archive
+    """
+    from pwnagotchi.ai import inference
+
+    nn_path = config['ai']['path']
+    if not os.path.exists(nn_path):
+        logging.error("%s not found", nn_path)
+        return 1
+
+    path = args.output or inference.npz_path(nn_path)
+    try:
+        inference.export(inference.read_params(nn_path), path)
+    except ValueError as e:
+        logging.error("can't export %s: %s", nn_path, e)
+        return 1
+
+    logging.info("exported %s to %s", nn_path, path)
+    return 0
+
+
+def train(args, config):
+    """
+    Trains the model from the replay buffer
+    """
+    if not args.offline:
+        logging.error("only --offline training can be started from the command line")
+        return 1
+
+    from pwnagotchi.ai import replay
+
+    updates = replay.train(config, epochs=args.epochs, batch_size=args.batch_size)
+    return 0 if updates > 0 else 1
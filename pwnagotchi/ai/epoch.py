@@ -2,8 +2,11 @@ import time
 import threading
 import logging
 
+import numpy as np
+
 import pwnagotchi
 import pwnagotchi.utils as utils
+import pwnagotchi.journal as journal
 import pwnagotchi.mesh.wifi as wifi
 
 from pwnagotchi.ai.reward import RewardFunction
@@ -55,17 +58,34 @@ class Epoch(object):
         self.epoch_duration = 0
         # https://www.metageek.com/training/resources/why-channels-1-6-11.html
         self.non_overlapping_channels = {1: 0, 6: 0, 11: 0}
-        # observation vectors
-        self._observation = {
-            'aps_histogram': [0.0] * wifi.NumChannels,
-            'sta_histogram': [0.0] * wifi.NumChannels,
-            'peers_histogram': [0.0] * wifi.NumChannels
-        }
+        # observation vectors, observe() fills one set while the other one can still be read
+        self._observations = [self._histograms(), self._histograms()]
+        self._observation = self._observations[0]
         self._observation_ready = threading.Event()
         self._epoch_data = {}
         self._epoch_data_ready = threading.Event()
         self._reward = RewardFunction()
 
+    @staticmethod
+    def _histograms():
+        return {
+            'aps_histogram': np.zeros(wifi.NumChannels, dtype=np.float32),
+            'sta_histogram': np.zeros(wifi.NumChannels, dtype=np.float32),
+            'peers_histogram': np.zeros(wifi.NumChannels, dtype=np.float32)
+        }
+
+    @staticmethod
+    def _histogram(channels, out, total, what, weights=None):
+        valid = (channels >= 0) & (channels < wifi.NumChannels)
+        if not valid.all():
+            for channel in channels[~valid] + 1:
+                logging.error("got %s on channel %d, we can store %d channels" % (what, channel, wifi.NumChannels))
+            channels = channels[valid]
+            weights = weights[valid] if weights is not None else None
+
+        counts = np.bincount(channels, weights=weights, minlength=wifi.NumChannels)
+        np.divide(counts, total, out=out)
+
     def wait_for_epoch_data(self, with_observation=True, timeout=None):
         # if with_observation:
         #    self._observation_ready.wait(timeout)
@@ -92,37 +112,19 @@ class Epoch(object):
         self.tot_bond_factor = sum((peer.encounters for peer in peers)) / bond_unit_scale
         self.avg_bond_factor = self.tot_bond_factor / num_peers
 
+        ap_channels = np.fromiter((ap['channel'] - 1 for ap in aps), dtype=np.intp, count=len(aps))
+        ap_clients = np.fromiter((len(ap['clients']) for ap in aps), dtype=np.float64, count=len(aps))
+        peer_channels = np.fromiter((peer.last_channel - 1 for peer in peers), dtype=np.intp, count=len(peers))
+
         num_aps = len(aps) + 1e-10
-        num_sta = sum(len(ap['clients']) for ap in aps) + 1e-10
-        aps_per_chan = [0.0] * wifi.NumChannels
-        sta_per_chan = [0.0] * wifi.NumChannels
-        peers_per_chan = [0.0] * wifi.NumChannels
-
-        for ap in aps:
-            ch_idx = ap['channel'] - 1
-            try:
-                aps_per_chan[ch_idx] += 1.0
-                sta_per_chan[ch_idx] += len(ap['clients'])
-            except IndexError:
-                logging.error("got data on channel %d, we can store %d channels" % (ap['channel'], wifi.NumChannels))
-
-        for peer in peers:
-            try:
-                peers_per_chan[peer.last_channel - 1] += 1.0
-            except IndexError:
-                logging.error(
-                    "got peer data on channel %d, we can store %d channels" % (peer.last_channel, wifi.NumChannels))
-
-        # normalize
-        aps_per_chan = [e / num_aps for e in aps_per_chan]
-        sta_per_chan = [e / num_sta for e in sta_per_chan]
-        peers_per_chan = [e / num_peers for e in peers_per_chan]
-
-        self._observation = {
-            'aps_histogram': aps_per_chan,
-            'sta_histogram': sta_per_chan,
-            'peers_histogram': peers_per_chan
-        }
+        num_sta = ap_clients.sum() + 1e-10
+
+        observation = self._observations[1] if self._observation is self._observations[0] else self._observations[0]
+        self._histogram(ap_channels, observation['aps_histogram'], num_aps, 'data')
+        self._histogram(ap_channels, observation['sta_histogram'], num_sta, 'data', weights=ap_clients)
+        self._histogram(peer_channels, observation['peers_histogram'], num_peers, 'peer data')
+
+        self._observation = observation
         self._observation_ready.set()
 
     def track(self, deauth=False, assoc=False, handshake=False, hop=False, sleep=False, miss=False, inc=1):
@@ -208,6 +210,8 @@ class Epoch(object):
         self._epoch_data['reward'] = self._reward(self.epoch + 1, self._epoch_data)
         self._epoch_data_ready.set()
 
+        journal.record(journal.EPOCH, epoch=self.epoch, **self._epoch_data)
+
         logging.info("[epoch %d] duration=%s slept_for=%s blind=%d sad=%d bored=%d inactive=%d active=%d peers=%d tot_bond=%.2f "
                      "avg_bond=%.2f hops=%d missed=%d deauths=%d assocs=%d handshakes=%d cpu=%d%% mem=%d%% "
                      "temperature=%dC reward=%s" % (
@@ -37,30 +37,38 @@ def describe(extended=False):
                             1)
 
 
-def featurize(state, step):
+def featurize(state, step, out=None):
+    """
+    Builds the observation vector of state, writing it into out if it has the right size
+    """
+    size = len(state['aps_histogram'])
+    if out is None or len(out) != 3 * size + 8:
+        out = np.empty(3 * size + 8, dtype=np.float32)
+
     tot_epochs = step + 1e-10
     tot_interactions = (state['num_deauths'] + state['num_associations']) + 1e-10
-    return np.concatenate((
-        # aps per channel
-        state['aps_histogram'],
-        # clients per channel
-        state['sta_histogram'],
-        # peers per channel
-        state['peers_histogram'],
+    # aps per channel
+    out[:size] = state['aps_histogram']
+    # clients per channel
+    out[size:2 * size] = state['sta_histogram']
+    # peers per channel
+    out[2 * size:3 * size] = state['peers_histogram']
+    out[3 * size:] = (
         # duration
-        [np.clip(state['duration_secs'] / MAX_EPOCH_DURATION, 0.0, 1.0)],
+        min(max(state['duration_secs'] / MAX_EPOCH_DURATION, 0.0), 1.0),
         # inactive
-        [state['inactive_for_epochs'] / tot_epochs],
+        state['inactive_for_epochs'] / tot_epochs,
         # active
-        [state['active_for_epochs'] / tot_epochs],
+        state['active_for_epochs'] / tot_epochs,
         # missed
-        [state['missed_interactions'] / tot_interactions],
+        state['missed_interactions'] / tot_interactions,
         # hops
-        [state['num_hops'] / wifi.NumChannels],
+        state['num_hops'] / wifi.NumChannels,
         # deauths
-        [state['num_deauths'] / tot_interactions],
+        state['num_deauths'] / tot_interactions,
         # assocs
-        [state['num_associations'] / tot_interactions],
+        state['num_associations'] / tot_interactions,
         # handshakes
-        [state['num_handshakes'] / tot_interactions],
-    ))
+        state['num_handshakes'] / tot_interactions,
+    )
+    return out
@@ -3,6 +3,7 @@ import gym
 from gym import spaces
 import numpy as np
 
+import pwnagotchi.journal as journal
 import pwnagotchi.ai.featurizer as featurizer
 import pwnagotchi.ai.reward as reward
 from pwnagotchi.ai.parameter import Parameter
@@ -39,7 +40,8 @@ class Environment(gym.Env):
         self._extended_spectrum = any(ch > 140 for ch in self._supported_channels)
         self._histogram_size, self._observation_shape = featurizer.describe(self._extended_spectrum)
 
-        Environment.params += [
+        # the environment can be created more than once (numpy inference falling back to tensorflow)
+        Environment.params = [p for p in Environment.params if p.meta is None] + [
             Parameter('_channel_%d' % ch, min_value=0, max_value=1, meta=ch + 1) for ch in
             range(self._histogram_size) if ch + 1 in self._supported_channels
         ]
@@ -105,20 +107,24 @@ class Environment(gym.Env):
         # wait for the algorithm to run with the new parameters
         state = self._next_epoch()
 
+        done = not self._agent.is_training()
+        # state_v is still the observation the policy was computed on, it's reused for the new one below
+        self._agent.on_ai_transition(self.last['state_v'], policy, state['reward'], done, self.action_space.nvec)
+
         self.last['reward'] = state['reward']
         self.last['state'] = state
-        self.last['state_v'] = featurizer.featurize(state, self._epoch_num)
+        self.last['state_v'] = featurizer.featurize(state, self._epoch_num, out=self.last['state_v'])
 
         self._agent.on_ai_step()
 
-        return self.last['state_v'], self.last['reward'], not self._agent.is_training(), {}
+        return self.last['state_v'], self.last['reward'], done, {}
 
     def reset(self):
         # logging.info("[ai] resetting environment ...")
         self._epoch_num = 0
         state = self._next_epoch()
         self.last['state'] = state
-        self.last['state_v'] = featurizer.featurize(state, 1)
+        self.last['state_v'] = featurizer.featurize(state, 1, out=self.last['state_v'])
         return self.last['state_v']
 
     def _render_histogram(self, hist):
@@ -139,6 +145,8 @@ class Environment(gym.Env):
 
         logging.info("[ai] --- training epoch %d/%d ---" % (self._epoch_num, self._agent.training_epochs()))
         logging.info("[ai] REWARD: %f" % self.last['reward'])
+        journal.record(journal.TRAINING, epoch=self._epoch_num, of=self._agent.training_epochs(),
+                       reward=self.last['reward'])
 
         logging.debug("[ai] policy: %s" % ', '.join("%s:%s" % (name, value) for name, value in self.last['params'].items()))
 
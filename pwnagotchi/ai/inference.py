@@ -0,0 +1,175 @@
+import io
+import os
+import time
+import logging
+import zipfile
+
+import numpy as np
+
+# MlpLstmPolicy variables of the stable-baselines model and the names they're exported with
+PARAMS = {
+    'model/pi_fc0/w:0': 'fc0_w',
+    'model/pi_fc0/b:0': 'fc0_b',
+    'model/pi_fc1/w:0': 'fc1_w',
+    'model/pi_fc1/b:0': 'fc1_b',
+    'model/lstm1/wx:0': 'lstm_wx',
+    'model/lstm1/wh:0': 'lstm_wh',
+    'model/lstm1/b:0': 'lstm_b',
+    'model/pi/w:0': 'pi_w',
+    'model/pi/b:0': 'pi_b',
+}
+
+
+def npz_path(nn_path):
+    return "%s.npz" % os.path.splitext(nn_path)[0]
+
+
+def read_params(nn_path):
+    """
+    Reads the parameters of a model saved by stable-baselines (zip format) without loading tensorflow
+    """
+    try:
+        with zipfile.ZipFile(nn_path) as zf:
+            data = zf.read('parameters')
+    except (zipfile.BadZipFile, KeyError):
+        raise ValueError("%s is not a zip archive with model parameters" % nn_path)
+
+    with np.load(io.BytesIO(data)) as params:
+        return {name: params[name] for name in params.files}
+
+
+def export(params, path):
+    """
+    Saves the policy weights found in params (by stable-baselines variable name) to the numpy archive at path
+    """
+    missing = [name for name in PARAMS if name not in params]
+    if missing:
+        raise ValueError("not a MlpLstmPolicy model, missing %s" % ', '.join(missing))
+
+    temp = "%s.tmp.npz" % os.path.splitext(path)[0]
+    np.savez(temp, **{short: np.asarray(params[name], dtype=np.float32) for name, short in PARAMS.items()})
+    os.replace(temp, path)
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class NumpyPolicy(object):
+    """
+    Forward pass of the A2C MlpLstmPolicy: two tanh layers, one lstm and the logits of the
+    multi discrete action space, sampled with the gumbel max trick like stable-baselines does
+    """
+
+    def __init__(self, weights, nvec):
+        self.fc = [(weights['fc0_w'], weights['fc0_b']), (weights['fc1_w'], weights['fc1_b'])]
+        self.lstm_wx = weights['lstm_wx']
+        self.lstm_wh = weights['lstm_wh']
+        self.lstm_b = weights['lstm_b']
+        self.pi_w = weights['pi_w']
+        self.pi_b = weights['pi_b']
+        self.n_lstm = self.lstm_wh.shape[0]
+        self.nvec = np.asarray(nvec)
+        self._splits = np.cumsum(self.nvec)[:-1]
+
+        if self.pi_w.shape[1] != self.nvec.sum():
+            raise ValueError("the model has %d logits, the action space needs %d" % (self.pi_w.shape[1], self.nvec.sum()))
+
+    @staticmethod
+    def load(path, nvec):
+        with np.load(path) as weights:
+            return NumpyPolicy({name: weights[name] for name in weights.files}, nvec)
+
+    def initial_state(self, n_env=1):
+        return np.zeros((n_env, 2 * self.n_lstm), dtype=np.float32)
+
+    def step(self, obs, state, mask):
+        x = np.asarray(obs, dtype=np.float32).reshape(len(obs), -1)
+        for w, b in self.fc:
+            x = np.tanh(x @ w + b)
+
+        keep = 1.0 - np.asarray(mask, dtype=np.float32).reshape(-1, 1)
+        cell, hidden = state[:, :self.n_lstm] * keep, state[:, self.n_lstm:] * keep
+        gates = x @ self.lstm_wx + hidden @ self.lstm_wh + self.lstm_b
+        in_gate, forget_gate, out_gate, candidate = np.split(gates, 4, axis=1)
+        cell = sigmoid(forget_gate) * cell + sigmoid(in_gate) * np.tanh(candidate)
+        hidden = sigmoid(out_gate) * np.tanh(cell)
+
+        return hidden @ self.pi_w + self.pi_b, np.concatenate((cell, hidden), axis=1)
+
+    def predict(self, obs, state=None, mask=None, deterministic=False):
+        if state is None:
+            state = self.initial_state(len(obs))
+        if mask is None:
+            mask = [False] * len(obs)
+
+        logits, state = self.step(obs, state, mask)
+        actions = []
+        for part in np.split(logits, self._splits, axis=1):
+            if not deterministic:
+                part = part - np.log(-np.log(np.random.uniform(size=part.shape)))
+            actions.append(np.argmax(part, axis=1))
+        return np.stack(actions, axis=1), state
+
+
+class VecEnv(object):
+    """
+    Single environment with the interface (and the reset on done) of the stable-baselines DummyVecEnv
+    """
+
+    def __init__(self, env):
+        self.envs = [env]
+
+    def reset(self):
+        return np.asarray([self.envs[0].reset()])
+
+    def step(self, actions):
+        obs, reward, done, info = self.envs[0].step(actions[0])
+        if done:
+            obs = self.envs[0].reset()
+        return np.asarray([obs]), np.asarray([reward]), np.asarray([done]), [info]
+
+    def render(self, *args, **kwargs):
+        return self.envs[0].render(*args, **kwargs)
+
+
+class NumpyModel(object):
+    """
+    Inference only replacement of the A2C model, running the policy exported from it with numpy
+    """
+    trainable = False
+
+    def __init__(self, env, policy):
+        self.env = env
+        self.policy = policy
+
+    def predict(self, observation, state=None, mask=None, deterministic=False):
+        return self.policy.predict(observation, state, mask, deterministic)
+
+
+def load(config, agent, epoch):
+    """
+    Returns a NumpyModel for the model at config['path'], exporting its weights first if needed, or None
+    """
+    nn_path = config['path']
+    path = npz_path(nn_path)
+    if not os.path.exists(nn_path) and not os.path.exists(path):
+        logging.info("[ai] no trained model to run with numpy")
+        return None
+
+    try:
+        if os.path.exists(nn_path) and (not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(nn_path)):
+            start = time.time()
+            export(read_params(nn_path), path)
+            logging.info("[ai] exported %s to %s in %.2fs" % (nn_path, path, time.time() - start))
+
+        import pwnagotchi.ai.gym as wrappers
+
+        env = VecEnv(wrappers.Environment(agent, epoch))
+        policy = NumpyPolicy.load(path, env.envs[0].action_space.nvec)
+        logging.info("[ai] running %s with numpy (inference only)" % path)
+        return NumpyModel(env, policy)
+    except Exception as e:
+        logging.warning("[ai] can't run the model with numpy: %s" % e)
+
+    return None
@@ -0,0 +1,170 @@
+import os
+import re
+import glob
+import time
+import logging
+import threading
+
+import numpy as np
+
+import pwnagotchi.ai.utils as utils
+
+
+class ReplayBuffer(object):
+    """
+    On disk buffer of (observation, action, reward, done) transitions.
+
+    Transitions are kept in memory and written as compressed numpy chunks of chunk_size transitions,
+    the oldest chunks are deleted when there are more than max_size transitions on disk.
+    """
+    CHUNK_NAME = re.compile(r'^\d+\.npz$')
+
+    def __init__(self, path, chunk_size=64, max_size=50000):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pending = []
+        self._nvec = None
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        # chunks that were being written when the unit lost power (older versions named them <ms>.tmp.npz)
+        for temp in glob.glob(os.path.join(path, '.tmp-*.npz')) + glob.glob(os.path.join(path, '[0-9]*.tmp.npz')):
+            logging.debug("[ai] removing incomplete replay chunk %s" % temp)
+            os.remove(temp)
+
+    def add(self, observation, action, reward, done, nvec):
+        with self._lock:
+            self._nvec = nvec
+            # copies, the environment reuses its observation buffer
+            self._pending.append((np.array(observation, dtype=np.float32).ravel(),
+                                  np.array(action, dtype=np.int16).ravel(), reward, done))
+            must_flush = len(self._pending) >= self.chunk_size
+
+        if must_flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+
+            obs, actions, rewards, dones = zip(*pending)
+            stamp = int(time.time() * 1000)
+            name = os.path.join(self.path, "%d.npz" % stamp)
+            # must not look like a chunk, it's left behind if the unit loses power while saving
+            temp = os.path.join(self.path, ".tmp-%d.npz" % stamp)
+            np.savez_compressed(temp, observations=np.stack(obs), actions=np.stack(actions),
+                                rewards=np.asarray(rewards, dtype=np.float32), dones=np.asarray(dones, dtype=bool),
+                                nvec=np.asarray(self._nvec, dtype=np.int16))
+            os.replace(temp, name)
+            self._trim()
+
+    def chunks(self):
+        names = [name for name in os.listdir(self.path) if ReplayBuffer.CHUNK_NAME.match(name)]
+        return [os.path.join(self.path, name) for name in sorted(names, key=lambda name: int(name[:-4]))]
+
+    def _trim(self):
+        chunks = self.chunks()
+        while len(chunks) * self.chunk_size > self.max_size:
+            os.remove(chunks.pop(0))
+
+    def load(self):
+        """
+        Returns (observations, actions, rewards, dones, nvec) for every transition on disk with the same shapes as
+        the most recent ones (the action space changes with the supported channels)
+        """
+        parts = []
+        nvec = None
+        for chunk in reversed(self.chunks()):
+            try:
+                with np.load(chunk) as data:
+                    part = {name: data[name] for name in data.files}
+            except (OSError, ValueError) as e:
+                logging.warning("[ai] skipping corrupted replay chunk %s: %s" % (chunk, e))
+                continue
+
+            if nvec is None:
+                nvec = part['nvec']
+            elif not np.array_equal(nvec, part['nvec']):
+                break
+            parts.insert(0, part)
+
+        if not parts:
+            return None
+
+        return (np.concatenate([p['observations'] for p in parts]),
+                np.concatenate([p['actions'] for p in parts]),
+                np.concatenate([p['rewards'] for p in parts]),
+                np.concatenate([p['dones'] for p in parts]),
+                nvec)
+
+
+def train(config, epochs=1, batch_size=64):
+    """
+    Trains the model at config['ai']['path'] on the transitions of the replay buffer, returns the number of updates
+    """
+    ai_cfg = config['ai']
+    replay_cfg = ai_cfg['replay']
+    data = ReplayBuffer(replay_cfg['path'], replay_cfg['chunk_size'], replay_cfg['max_size']).load()
+    if data is None:
+        logging.info("[ai] the replay buffer is empty")
+        return 0
+
+    obs, actions, rewards, dones, nvec = data
+    if len(obs) < batch_size:
+        logging.info("[ai] only %d transitions recorded, need at least %d" % (len(obs), batch_size))
+        return 0
+
+    logging.info("[ai] training on %d transitions for %d epochs (batch size %d) ..." % (len(obs), epochs, batch_size))
+
+    import gym
+    from gym import spaces
+    from stable_baselines import A2C
+    from stable_baselines.a2c.utils import Scheduler, discount_with_dones
+    from stable_baselines.common.policies import MlpLstmPolicy
+    from stable_baselines.common.vec_env import DummyVecEnv
+    from pwnagotchi.ai.checkpoint import Checkpointer
+
+    obs_shape = (1, obs.shape[1])
+
+    class ReplayEnv(gym.Env):
+        observation_space = spaces.Box(low=0, high=1, shape=obs_shape, dtype=np.float32)
+        action_space = spaces.MultiDiscrete(nvec)
+
+    # the policy graph is built for batches of n_steps transitions
+    params = dict(ai_cfg['params'], n_steps=batch_size)
+    model = A2C(MlpLstmPolicy, DummyVecEnv([ReplayEnv]), **params)
+    if os.path.exists(ai_cfg['path']):
+        model.load_parameters(ai_cfg['path'])
+
+    returns = np.asarray(discount_with_dones(rewards.tolist(), dones.tolist(), model.gamma), dtype=np.float32)
+    # the lstm state is reset on every step, like when predicting
+    masks = np.ones(batch_size, dtype=np.float32)
+    states = model.initial_state
+    train_model = model.train_model
+
+    num_batches = len(obs) // batch_size
+    model.learning_rate_schedule = Scheduler(initial_value=model.learning_rate, n_values=epochs * len(obs),
+                                             schedule=model.lr_schedule)
+    update = 1
+    for epoch in range(epochs):
+        start = time.time()
+        losses = []
+        for batch_obs, idx in utils.as_batches(obs, np.arange(len(obs)), batch_size):
+            batch_obs = batch_obs.reshape((batch_size,) + obs_shape)
+            values = model.sess.run(train_model.value_flat, {train_model.obs_ph: batch_obs,
+                                                             train_model.states_ph: states,
+                                                             train_model.dones_ph: masks})
+            losses.append(model._train_step(batch_obs, states, returns[idx], masks, actions[idx], values, update))
+            update += 1
+
+        policy_loss, value_loss, entropy = np.mean(losses, axis=0)
+        logging.info("[ai] epoch %d/%d: %d batches in %.2fs policy_loss=%f value_loss=%f entropy=%f" % (
+            epoch + 1, epochs, num_batches, time.time() - start, policy_loss, value_loss, entropy))
+
+    Checkpointer(ai_cfg['path'], keep=ai_cfg['checkpoint']['keep']).save(model, sync=True)
+    return update - 1
@@ -8,14 +8,20 @@ import logging
 
 import pwnagotchi.plugins as plugins
 import pwnagotchi.ai as ai
+from pwnagotchi.ai import checkpoint
+from pwnagotchi.ai.replay import ReplayBuffer
 
 
 class Stats(object):
-    def __init__(self, path, events_receiver):
+    def __init__(self, path, events_receiver, save_interval=0):
         self._lock = threading.Lock()
         self._receiver = events_receiver
+        self._saved_at = time.time()
+        self._dirty = False
 
         self.path = path
+        # seconds between two saves, new best and worst rewards are always saved
+        self.save_interval = save_interval
         self.born_at = time.time()
         # total epochs lived (trained + just eval)
         self.epochs_lived = 0
@@ -24,6 +30,8 @@ class Stats(object):
 
         self.worst_reward = 0.0
         self.best_reward = 0.0
+        # last policy parameters, applied at startup while the model loads
+        self.policy = None
 
         self.load()
 
@@ -44,13 +52,23 @@ class Stats(object):
             if training:
                 self.epochs_trained += 1
 
-        self.save()
+            self._dirty = True
+            must_save = best_r or worst_r or time.time() - self._saved_at >= self.save_interval
+
+        if must_save:
+            self.save()
 
         if best_r:
             self._receiver.on_ai_best_reward(reward)
         elif worst_r:
             self._receiver.on_ai_worst_reward(reward)
 
+        return best_r
+
+    def flush(self):
+        if self._dirty:
+            self.save()
+
     def load(self):
         with self._lock:
             if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
@@ -61,6 +79,12 @@ class Stats(object):
                 self.born_at = obj['born_at']
                 self.epochs_lived, self.epochs_trained = obj['epochs_lived'], obj['epochs_trained']
                 self.best_reward, self.worst_reward = obj['rewards']['best'], obj['rewards']['worst']
+                self.policy = obj.get('policy')
+
+    def set_policy(self, policy):
+        with self._lock:
+            self.policy = policy
+            self._dirty = True
 
     def save(self):
         with self._lock:
@@ -73,7 +97,8 @@ class Stats(object):
                 'rewards': {
                     'best': self.best_reward,
                     'worst': self.worst_reward
-                }
+                },
+                'policy': self.policy
             })
 
             temp = "%s.tmp" % self.path
@@ -81,16 +106,28 @@ class Stats(object):
                 fp.write(data)
 
             os.replace(temp, self.path)
+            self._saved_at = time.time()
+            self._dirty = False
 
 
 class AsyncTrainer(object):
     def __init__(self, config):
         self._config = config
         self._model = None
+        self._worker = None
         self._is_training = False
         self._training_epochs = 0
         self._nn_path = self._config['ai']['path']
-        self._stats = Stats("%s.json" % os.path.splitext(self._nn_path)[0], self)
+        cp_cfg = self._config['ai']['checkpoint']
+        self._checkpoint = checkpoint.Checkpointer(self._nn_path, steps=cp_cfg['steps'],
+                                                   interval=cp_cfg['interval'] * 60, keep=cp_cfg['keep'])
+        self._stats = Stats("%s.json" % os.path.splitext(self._nn_path)[0], self,
+                            save_interval=cp_cfg['interval'] * 60)
+        self._replay = self._replay_buffer(self._config)
+        self._ai_ready = threading.Event()
+        self._ai_phase = 'loading'
+        self._ai_metrics = None
+        checkpoint.on_shutdown(self._on_ai_shutdown)
 
     def set_training(self, training, for_epochs=0):
         self._is_training = training
@@ -107,22 +144,80 @@ class AsyncTrainer(object):
     def training_epochs(self):
         return self._training_epochs
 
-    def start_ai(self):
-        _thread.start_new_thread(self._ai_worker, ())
+    def is_ai_ready(self):
+        return self._ai_ready.is_set()
+
+    def wait_for_ai(self, timeout=None):
+        return self._ai_ready.wait(timeout)
+
+    def ai_status(self):
+        """
+        Returns the loading phase of the model ('disabled', 'loading', 'ready' or 'failed') and how long
+        every step of the loading took in seconds
+        """
+        return {
+            'phase': self._ai_phase,
+            'ready': self.is_ai_ready(),
+            'training': self._is_training,
+            'metrics': self._ai_metrics if self._ai_metrics is not None else dict(ai.metrics),
+        }
+
+    def _restore_policy(self):
+        policy = self._stats.policy
+        if policy:
+            logging.info("[ai] restoring the last policy while the model loads ...")
+            self._set_personality(policy)
 
-    def _save_ai(self):
-        logging.info("[ai] saving model to %s ..." % self._nn_path)
-        temp = "%s.tmp" % self._nn_path
-        self._model.save(temp)
-        os.replace(temp, self._nn_path)
+    def start_ai(self):
+        if not self._config['ai']['enabled']:
+            self._ai_phase = 'disabled'
+            return
+
+        # the agent doesn't have to wait for the model to use what it learned
+        self._restore_policy()
+        self.on_ai_loading()
+
+        worker_cfg = self._config['ai']['worker']
+        if worker_cfg['enabled']:
+            from pwnagotchi.ai.worker import WorkerProcess
+            self._worker = WorkerProcess(self._config, self, self._epoch, stall_timeout=worker_cfg['stall_timeout'],
+                                         min_backoff=worker_cfg['min_backoff'], max_backoff=worker_cfg['max_backoff'])
+            self._worker.start()
+        else:
+            _thread.start_new_thread(self._ai_worker, ())
+
+    @staticmethod
+    def _replay_buffer(config):
+        replay_cfg = config['ai']['replay']
+        if not replay_cfg['enabled']:
+            return None
+        return ReplayBuffer(replay_cfg['path'], chunk_size=replay_cfg['chunk_size'], max_size=replay_cfg['max_size'])
+
+    def _on_ai_shutdown(self):
+        if self._worker is not None:
+            self._worker.checkpoint()
+        elif self._model and getattr(self._model, 'trainable', True):
+            logging.info("[ai] saving model to %s ..." % self._nn_path)
+            self._checkpoint.save(self._model, sync=True)
+        if self._replay is not None:
+            self._replay.flush()
+        self._stats.flush()
+
+    def on_ai_transition(self, observation, policy, reward, done, nvec):
+        if self._replay is not None:
+            self._replay.add(observation, policy, reward, done, nvec)
 
     def on_ai_step(self):
         self._model.env.render()
 
+        best = self._stats.on_epoch(self._epoch.data(), self._is_training)
+
         if self._is_training:
-            self._save_ai()
+            self._checkpoint.on_step(self._model, best=best)
 
-        self._stats.on_epoch(self._epoch.data(), self._is_training)
+    def on_ai_worker_step(self, training):
+        # the model lives in the worker process which already rendered and saved it
+        self._stats.on_epoch(self._epoch.data(), training)
 
     def on_ai_training_step(self, _locals, _globals):
         self._model.env.render()
@@ -131,6 +226,14 @@ class AsyncTrainer(object):
     def on_ai_policy(self, new_params):
         plugins.on('ai_policy', self, new_params)
         logging.info("[ai] setting new policy:")
+        self._set_personality(new_params)
+        self._stats.set_policy(new_params)
+
+        self.run('set wifi.ap.ttl %d' % self._config['personality']['ap_ttl'])
+        self.run('set wifi.sta.ttl %d' % self._config['personality']['sta_ttl'])
+        self.run('set wifi.rssi.min %d' % self._config['personality']['min_rssi'])
+
+    def _set_personality(self, new_params):
         for name, value in new_params.items():
             if name in self._config['personality']:
                 curr_value = self._config['personality'][name]
@@ -140,14 +243,23 @@ class AsyncTrainer(object):
             else:
                 logging.error("[ai] param %s not in personality configuration!" % name)
 
-        self.run('set wifi.ap.ttl %d' % self._config['personality']['ap_ttl'])
-        self.run('set wifi.sta.ttl %d' % self._config['personality']['sta_ttl'])
-        self.run('set wifi.rssi.min %d' % self._config['personality']['min_rssi'])
+    def on_ai_loading(self):
+        self._ai_ready.clear()
+        self._ai_phase = 'loading'
+        self._ai_metrics = None
 
-    def on_ai_ready(self):
+    def on_ai_ready(self, metrics=None):
+        self._ai_metrics = metrics if metrics is not None else dict(ai.metrics)
+        self._ai_phase = 'ready'
+        self._ai_ready.set()
+        logging.info("[ai] ready, loaded in %.2fs" % self._ai_metrics.get('total', 0.0))
         self._view.on_ai_ready()
         plugins.on('ai_ready', self)
 
+    def on_ai_failed(self):
+        self._ai_metrics = dict(ai.metrics)
+        self._ai_phase = 'failed'
+
     def on_ai_best_reward(self, r):
         logging.info("[ai] best reward so far: %s" % r)
         self._view.on_motivated(r)
@@ -161,7 +273,9 @@ class AsyncTrainer(object):
     def _ai_worker(self):
         self._model = ai.load(self._config, self, self._epoch)
 
-        if self._model:
+        if not self._model:
+            self.on_ai_failed()
+        else:
             self.on_ai_ready()
 
             epochs_per_episode = self._config['ai']['epochs_per_episode']
@@ -169,8 +283,8 @@ class AsyncTrainer(object):
             obs = None
             while True:
                 self._model.env.render()
-                # enter in training mode?
-                if random.random() > self._config['ai']['laziness']:
+                # enter in training mode? (models running with numpy can't learn)
+                if getattr(self._model, 'trainable', True) and random.random() > self._config['ai']['laziness']:
                     logging.info("[ai] learning for %d epochs ..." % epochs_per_episode)
                     try:
                         self.set_training(True, epochs_per_episode)
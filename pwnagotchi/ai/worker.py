@@ -0,0 +1,330 @@
+import os
+import time
+import logging
+import threading
+import logging.handlers
+import multiprocessing
+
+import pwnagotchi.journal as journal
+import pwnagotchi.plugins as plugins
+
+# the agent process has plenty of threads by the time the ai starts, forking it is not safe
+_context = multiprocessing.get_context('spawn')
+
+
+class _Channel(object):
+    """
+    Thread safe sending end of a multiprocessing pipe
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    def send(self, *msg):
+        with self._lock:
+            self.conn.send(msg)
+
+
+class RemoteJournal(object):
+    """
+    Forwards the journal records of the worker to the agent process
+    """
+
+    def __init__(self, channel):
+        self._channel = channel
+
+    def record(self, type, **fields):
+        self._channel.send('journal', type, fields)
+
+    def flush(self, sync=False):
+        pass
+
+
+class RemoteEpoch(object):
+    """
+    Worker side of the agent Epoch: only the latest epoch data sent by the agent is kept,
+    exactly like Epoch.wait_for_epoch_data does in the agent process
+    """
+
+    def __init__(self, channel):
+        self._channel = channel
+        self._data = {}
+        self._ready = threading.Event()
+
+    def on_epoch(self, data):
+        self._data = data
+        self._ready.set()
+
+    def wait_for_epoch_data(self, with_observation=True, timeout=None):
+        self._ready.wait(timeout)
+        self._ready.clear()
+        self._channel.send('consumed')
+        return self._data
+
+    def data(self):
+        return self._data
+
+
+def _worker_main(conn, log_queue, log_level, config, supported_channels):
+    # everything logged here ends up in the agent log handlers
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(log_level)
+
+    import pwnagotchi.ai as ai
+    from pwnagotchi.ai.train import AsyncTrainer, Stats
+    from pwnagotchi.ai.checkpoint import Checkpointer
+
+    channel = _Channel(conn)
+    journal._journal = RemoteJournal(channel)
+
+    class WorkerTrainer(AsyncTrainer):
+        """
+        AsyncTrainer hosting the model, the agent side effects are sent back through the pipe
+        """
+
+        def __init__(self):
+            self._config = config
+            self._model = None
+            self._is_training = False
+            self._training_epochs = 0
+            self._nn_path = config['ai']['path']
+            self._epoch = RemoteEpoch(channel)
+            cp_cfg = config['ai']['checkpoint']
+            self._checkpoint = Checkpointer(self._nn_path, steps=cp_cfg['steps'], interval=cp_cfg['interval'] * 60,
+                                            keep=cp_cfg['keep'])
+            self._replay = self._replay_buffer(config)
+            # the stats are kept by the agent, this is only needed to checkpoint on new best rewards
+            self._best_reward = Stats("%s.json" % os.path.splitext(self._nn_path)[0], self).best_reward
+
+        def supported_channels(self):
+            return supported_channels
+
+        def set_training(self, training, for_epochs=0):
+            self._is_training = training
+            self._training_epochs = for_epochs
+            channel.send('training', training, for_epochs)
+
+        def on_ai_step(self):
+            self._model.env.render()
+            if self._is_training:
+                reward = self._epoch.data().get('reward', 0.0)
+                best = reward > self._best_reward
+                if best:
+                    self._best_reward = reward
+                self._checkpoint.on_step(self._model, best=best)
+            channel.send('step', self._is_training)
+
+        def on_checkpoint(self):
+            if self._model and getattr(self._model, 'trainable', True):
+                self._checkpoint.save(self._model, sync=True)
+            if self._replay is not None:
+                self._replay.flush()
+
+        def on_ai_training_step(self, _locals, _globals):
+            self._model.env.render()
+            # the model locals can't cross the process boundary
+            channel.send('training_step')
+
+        def on_ai_policy(self, new_params):
+            channel.send('policy', new_params)
+
+        def on_ai_ready(self, metrics=None):
+            channel.send('ready', dict(ai.metrics))
+
+        def on_ai_failed(self):
+            pass
+
+    trainer = WorkerTrainer()
+
+    def reader():
+        try:
+            while True:
+                msg = conn.recv()
+                if msg[0] == 'epoch':
+                    trainer._epoch.on_epoch(msg[1])
+                elif msg[0] == 'checkpoint':
+                    try:
+                        trainer.on_checkpoint()
+                    finally:
+                        channel.send('checkpointed')
+                elif msg[0] == 'stop':
+                    break
+        except (EOFError, OSError):
+            pass
+        # the agent is gone or wants us to stop
+        os._exit(0)
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    trainer._ai_worker()
+    # ai.load failed, nothing else to do
+    channel.send('failed')
+
+
+class WorkerProcess(object):
+    """
+    Agent side of the AI worker: hosts the model in a separate process so that tensorflow doesn't
+    hold the GIL of the agent and its crashes can't take the agent down.
+
+    The latest epoch data is sent to the worker, the worker sends back policies, steps and training
+    state which are applied to the agent through the usual AsyncTrainer callbacks. The worker is
+    restarted with exponential backoff if it dies or if it doesn't consume the epochs for stall_timeout
+    seconds once the model is ready.
+    """
+
+    def __init__(self, config, agent, epoch, stall_timeout=900.0, min_backoff=30.0, max_backoff=1800.0):
+        self._config = config
+        self._agent = agent
+        self._epoch = epoch
+        self.stall_timeout = stall_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.restarts = 0
+        self._backoff = min_backoff
+        self._process = None
+        self._channel = None
+        self._ready = False
+        self._pending_since = None
+        self._checkpointed = threading.Event()
+        self._lock = threading.Lock()
+        self._log_queue = _context.Queue()
+        self._log_listener = threading.Thread(target=self._log_forwarder, daemon=True)
+
+    def start(self):
+        self._log_listener.start()
+        threading.Thread(target=self._feeder, daemon=True).start()
+        threading.Thread(target=self._watchdog, daemon=True).start()
+
+    def _log_forwarder(self):
+        while True:
+            record = self._log_queue.get()
+            logging.getLogger(record.name).handle(record)
+
+    def _spawn(self):
+        parent_conn, child_conn = _context.Pipe()
+        process = _context.Process(target=_worker_main, name='pwnagotchi-ai', daemon=True,
+                                   args=(child_conn, self._log_queue, logging.getLogger().level, self._config,
+                                         self._agent.supported_channels()))
+        process.start()
+        child_conn.close()
+        logging.info("[ai] worker process started (pid %d)" % process.pid)
+
+        with self._lock:
+            self._process = process
+            self._channel = _Channel(parent_conn)
+            self._ready = False
+            self._pending_since = None
+        return parent_conn
+
+    def _feeder(self):
+        while True:
+            data = self._epoch.wait_for_epoch_data()
+            with self._lock:
+                channel = self._channel
+                if channel is not None and self._pending_since is None:
+                    self._pending_since = time.time()
+            if channel is not None:
+                try:
+                    channel.send('epoch', data)
+                except (OSError, ValueError) as e:
+                    logging.debug("[ai] can't send epoch to worker: %s" % e)
+
+    def _stalled(self):
+        with self._lock:
+            return self._ready and self._pending_since is not None and \
+                   time.time() - self._pending_since > self.stall_timeout
+
+    def _dispatch(self, msg):
+        what = msg[0]
+        if what == 'consumed':
+            with self._lock:
+                self._pending_since = None
+        elif what == 'policy':
+            self._agent.on_ai_policy(msg[1])
+        elif what == 'step':
+            self._agent.on_ai_worker_step(msg[1])
+        elif what == 'training':
+            self._agent.set_training(msg[1], msg[2])
+        elif what == 'training_step':
+            plugins.on('ai_training_step', self._agent, {}, {})
+        elif what == 'journal':
+            journal.record(msg[1], **msg[2])
+        elif what == 'ready':
+            with self._lock:
+                self._ready = True
+            self._backoff = self.min_backoff
+            self._agent.on_ai_ready(msg[1])
+        elif what == 'checkpointed':
+            self._checkpointed.set()
+        elif what == 'failed':
+            return False
+        return True
+
+    def _watchdog(self):
+        while True:
+            conn = self._spawn()
+            try:
+                while self._process.is_alive() and not self._stalled():
+                    if conn.poll(1.0) and not self._dispatch(conn.recv()):
+                        # same as the in process trainer, if the model can't be loaded there's no point in retrying
+                        with self._lock:
+                            self._channel = None
+                        self.stop(conn)
+                        self._agent.on_ai_failed()
+                        return
+                reason = "stalled" if self._process.is_alive() else "exited (%s)" % self._process.exitcode
+            except (EOFError, OSError):
+                reason = None
+            except Exception as e:
+                logging.exception("[ai] error while handling worker message (%s)", e)
+                reason = str(e)
+
+            with self._lock:
+                self._channel = None
+            self.stop(conn)
+            if reason is None:
+                reason = "exited (%s)" % self._process.exitcode
+
+            if self._agent.is_training():
+                self._agent.set_training(False)
+
+            self.restarts += 1
+            self._agent.on_ai_loading()
+            logging.warning("[ai] worker process %s, restarting in %ds ..." % (reason, self._backoff))
+            time.sleep(self._backoff)
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+
+    def checkpoint(self, timeout=60.0):
+        """
+        Makes the worker save the model and waits for it
+        """
+        with self._lock:
+            channel = self._channel
+            ready = self._ready
+        if channel is None or not ready:
+            return False
+
+        self._checkpointed.clear()
+        try:
+            channel.send('checkpoint')
+        except (OSError, ValueError):
+            return False
+        return self._checkpointed.wait(timeout)
+
+    def stop(self, conn=None):
+        process = self._process
+        if process is None:
+            return
+        try:
+            if conn is not None:
+                conn.send(('stop',))
+        except (OSError, ValueError):
+            pass
+        process.join(5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        if conn is not None:
+            conn.close()
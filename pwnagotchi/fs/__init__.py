@@ -4,9 +4,10 @@ import tempfile
 import contextlib
 import shutil
 import _thread
+import threading
 import logging
 
-from time import sleep
+from time import sleep, time
 from distutils.dir_util import copy_tree
 
 mounts = list()
@@ -36,6 +37,83 @@ def size_of(path):
     return total
 
 
+# kinds of entries returned by scan()
+FILE = 'f'
+DIR = 'd'
+LINK = 'l'
+
+
+def scan(path):
+    """
+    Returns relative path -> (mtime_ns, size, inode, kind) for every file, directory and symlink in path
+    """
+    found = dict()
+    pending = [path]
+    while pending:
+        current = pending.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError:
+            continue
+
+        for entry in entries:
+            try:
+                if entry.is_symlink():
+                    kind = LINK
+                elif entry.is_dir(follow_symlinks=False):
+                    kind = DIR
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    kind = FILE
+                else:
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                found[os.path.relpath(entry.path, path)] = (st.st_mtime_ns, st.st_size, st.st_ino, kind)
+            except OSError:
+                # removed while scanning
+                continue
+    return found
+
+
+def copy_metadata(src, dst):
+    """
+    Copies owner, permissions, times and extended attributes of src to dst, like rsync -aX does
+    """
+    st = os.lstat(src)
+    try:
+        os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+    except OSError as e:
+        logging.debug("[FS] can't change the owner of %s: %s", dst, e)
+    # on linux this copies the extended attributes too
+    shutil.copystat(src, dst, follow_symlinks=False)
+
+
+def same_prefix(src, dst, length, window=64 * 1024):
+    """
+    Checks if the last `window` bytes before `length` are the same in both files
+    """
+    start = max(0, length - window)
+    with open(src, 'rb') as fp_src, open(dst, 'rb') as fp_dst:
+        fp_src.seek(start)
+        fp_dst.seek(start)
+        return fp_src.read(length - start) == fp_dst.read(length - start)
+
+
+def remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def is_mountpoint(path):
     """
     Checks if path is mountpoint
@@ -120,6 +198,10 @@ class MemoryFS:
         self.zram_fs_type = zram_fs_type
         self.zdev = None
         self.rsync = True
+        # state of the files in ram as of the last sync to disk
+        self._synced = None
+        self._lock = threading.Lock()
+        self.last_sync = None
         self._setup()
 
 
@@ -151,7 +233,10 @@ class MemoryFS:
 
 
     def sync(self, to_ram=False):
-        source, dest = (self.disk, self.mountpoint) if to_ram else (self.mountpoint, self.disk)
+        if not to_ram:
+            return self.sync_changes()
+
+        source, dest = self.disk, self.mountpoint
         needed, actually_free = size_of(source), shutil.disk_usage(dest)[2]
         if actually_free >= needed:
             logging.debug("[FS] Syncing %s -> %s", source,dest)
@@ -160,9 +245,146 @@ class MemoryFS:
             else:
                 copy_tree(source, dest, preserve_symlinks=True)
             os.system("sync")
+            with self._lock:
+                self._synced = scan(self.mountpoint)
             return True
         return False
 
+    def _copy(self, name, now, before):
+        """
+        Copies a single changed file or symlink to disk, returns the number of bytes written
+        """
+        src = os.path.join(self.mountpoint, name)
+        dst = os.path.join(self.disk, name)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            # was a directory
+            shutil.rmtree(dst)
+
+        if now[3] == LINK:
+            tmp = os.path.join(os.path.dirname(dst), ".%s.pwnagotchi-link" % os.path.basename(dst))
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            os.symlink(os.readlink(src), tmp)
+            copy_metadata(src, tmp)
+            os.replace(tmp, dst)
+            return 0
+
+        # same file that only grew (logs) and whose old content is what we have on disk: just append the
+        # new part, anything else (rewritten in place, truncated, replaced) gets copied entirely
+        if before is not None and before[2] == now[2] and now[1] > before[1] and \
+                os.path.isfile(dst) and not os.path.islink(dst) and os.path.getsize(dst) == before[1] and \
+                same_prefix(src, dst, before[1]):
+            with open(src, 'rb') as fp_src, open(dst, 'ab') as fp_dst:
+                fp_src.seek(before[1])
+                written = 0
+                for chunk in iter(lambda: fp_src.read(64 * 1024), b''):
+                    fp_dst.write(chunk)
+                    written += len(chunk)
+                fp_dst.flush()
+                os.fsync(fp_dst.fileno())
+            copy_metadata(src, dst)
+            return written
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst))
+        try:
+            with os.fdopen(fd, 'wb') as fp_dst, open(src, 'rb') as fp_src:
+                shutil.copyfileobj(fp_src, fp_dst, 64 * 1024)
+                fp_dst.flush()
+                os.fsync(fp_dst.fileno())
+            copy_metadata(src, tmp)
+            os.replace(tmp, dst)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return now[1]
+
+    def sync_changes(self):
+        """
+        Writes to disk only the files that changed in ram since the last sync
+        """
+        with self._lock:
+            started = time()
+            if self._synced is None:
+                # we didn't populate the ram copy ourselves, compare against what's on disk
+                self._synced = {name: st[:2] + (None,) + st[3:] for name, st in scan(self.disk).items()}
+
+            current = scan(self.mountpoint)
+            # parents sort before their children
+            dirty = sorted(name for name, st in current.items()
+                           if name not in self._synced or self._synced[name][:2] != st[:2] or
+                           self._synced[name][3] != st[3])
+            deleted = sorted((name for name in self._synced if name not in current), reverse=True)
+
+            if not dirty and not deleted:
+                logging.debug("[FS] %s is clean, skipping sync", self.mountpoint)
+                self.last_sync = {'at': started, 'duration': time() - started, 'files': 0, 'bytes': 0}
+                return True
+
+            needed = sum(current[name][1] for name in dirty if current[name][3] == FILE)
+            if shutil.disk_usage(self.disk)[2] < needed:
+                logging.warning("[FS] not enough space to sync %s (%d bytes needed)", self.mountpoint, needed)
+                return False
+
+            written = 0
+            touched = set()
+
+            # children first, so that a directory is empty by the time it's removed
+            for name in deleted:
+                try:
+                    remove(os.path.join(self.disk, name))
+                    touched.add(os.path.dirname(os.path.join(self.disk, name)))
+                except OSError as e:
+                    logging.warning("[FS] error while removing %s: %s", name, e)
+                del self._synced[name]
+
+            dirs = [name for name in dirty if current[name][3] == DIR]
+            for name in dirs:
+                path = os.path.join(self.disk, name)
+                try:
+                    if os.path.lexists(path) and (os.path.islink(path) or not os.path.isdir(path)):
+                        # was a file or a symlink
+                        os.remove(path)
+                    os.makedirs(path, exist_ok=True)
+                except OSError as e:
+                    logging.warning("[FS] error while syncing %s: %s", name, e)
+
+            for name in dirty:
+                if current[name][3] == DIR:
+                    continue
+                try:
+                    written += self._copy(name, current[name], self._synced.get(name))
+                    self._synced[name] = current[name]
+                    touched.add(os.path.dirname(os.path.join(self.disk, name)))
+                except OSError as e:
+                    logging.warning("[FS] error while syncing %s: %s", name, e)
+
+            # the directories' times are only final once their content has been written
+            for name in reversed(dirs):
+                try:
+                    copy_metadata(os.path.join(self.mountpoint, name), os.path.join(self.disk, name))
+                    self._synced[name] = current[name]
+                except OSError as e:
+                    logging.warning("[FS] error while syncing %s: %s", name, e)
+
+            # only flush the directories we touched instead of a global sync
+            for path in touched:
+                try:
+                    fsync_dir(path)
+                except OSError:
+                    pass
+
+            self.last_sync = {
+                'at': started,
+                'duration': time() - started,
+                'files': len(dirty) + len(deleted),
+                'bytes': written
+            }
+            logging.debug("[FS] Synced %s -> %s: %d changed, %d deleted, %d bytes in %.2fs",
+                          self.mountpoint, self.disk, len(dirty), len(deleted), written, self.last_sync['duration'])
+            return True
+
 
     def mount(self):
         if os.system(f"mount --bind {self.mountpoint} {self.disk}"):
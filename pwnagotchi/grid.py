@@ -1,48 +1,243 @@
+import os
+import re
 import subprocess
+import threading
 import socket
+import time
 import requests
 import json
 import logging
 
 import pwnagotchi
+from pwnagotchi.utils import WifiInfo, extract_from_pcap
 
 # pwngrid-peer is running on port 8666
 API_ADDRESS = "http://127.0.0.1:8666/api/v1"
 
 
-def is_connected():
+def check_connectivity(host='api.pwnagotchi.ai', port=443, timeout=30):
     try:
         # check DNS
-        host = socket.gethostbyname('api.pwnagotchi.ai')
-        if host:
+        address = socket.gethostbyname(host)
+        if address:
             # check connectivity itself
-            socket.create_connection((host, 443), timeout=30)
+            socket.create_connection((address, port), timeout=timeout).close()
             return True
     except:
         pass
     return False
 
 
-def call(path, obj=None):
-    url = '%s%s' % (API_ADDRESS, path)
-    if obj is None:
-        r = requests.get(url, headers=None, timeout=(30.0, 60.0))
-    elif isinstance(obj, dict):
-        r = requests.post(url, headers=None, json=obj, timeout=(30.0, 60.0))
-    else:
-        r = requests.post(url, headers=None, data=obj, timeout=(30.0, 60.0))
+class ConnectivityMonitor(object):
+    """
+    Probes internet connectivity in background and caches the result.
+
+    While online the probe runs every interval seconds, while offline it backs off exponentially
+    from min_backoff up to max_backoff seconds. Listeners are called after every probe with
+    (connected, changed).
+    """
+
+    def __init__(self, host='api.pwnagotchi.ai', port=443, timeout=10, interval=30, min_backoff=5,
+                 max_backoff=300):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.interval = interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.connected = False
+        self.checked_at = None
+        self.changed_at = None
+        self._listeners = []
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def check_now(self):
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, name='connectivity', daemon=True)
+            self._thread.start()
+        return self
+
+    def _notify(self, connected, changed):
+        for callback in self._listeners:
+            try:
+                callback(connected, changed)
+            except Exception as e:
+                logging.error("[connectivity] error in listener %s: %s" % (callback, e))
+
+    def _worker(self):
+        backoff = self.min_backoff
+        while True:
+            connected = check_connectivity(self.host, self.port, self.timeout)
+            changed = connected != self.connected or self.changed_at is None
+
+            self.checked_at = time.time()
+            if changed:
+                self.connected = connected
+                self.changed_at = self.checked_at
+                logging.info("[connectivity] %s" % ('online' if connected else 'offline'))
+
+            self._notify(connected, changed)
+
+            if connected:
+                backoff = self.min_backoff
+                wait = self.interval
+            else:
+                wait = backoff
+                backoff = min(backoff * 2, self.max_backoff)
+
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+
+_monitor = None
+
+
+def start_monitor(config):
+    global _monitor
+
+    if _monitor is None:
+        cfg = config['main']['connectivity']
+        _monitor = ConnectivityMonitor(host=cfg['host'], port=cfg['port'], timeout=cfg['timeout'],
+                                       interval=cfg['interval'], min_backoff=cfg['min_backoff'],
+                                       max_backoff=cfg['max_backoff']).start()
+    return _monitor
+
+
+def is_connected():
+    if _monitor is not None:
+        return _monitor.connected
+    return check_connectivity()
+
+
+class APIError(Exception):
+    def __init__(self, status, text):
+        super().__init__("(status %d) %s" % (status, text))
+        self.status = status
+        self.text = text
+
+
+class Client(object):
+    """
+    Keep-alive client for the local pwngrid-peer api.
+
+    Advertisement data is not posted right away: set_advertisement() only records the wanted
+    state, a background thread posts the fields that changed since the last successful update
+    at most once every adv_interval seconds. pwngrid-peer merges the posted fields into what it
+    has, the whole advertisement is sent again every adv_refresh seconds and after errors in
+    case it has been restarted in the meantime.
+    """
+
+    def __init__(self, address=API_ADDRESS, timeout=(30.0, 60.0), adv_interval=5.0, adv_refresh=300.0):
+        self.address = address
+        self.timeout = timeout
+        self.adv_interval = adv_interval
+        self.adv_refresh = adv_refresh
+        self.stats = {
+            'calls': 0,
+            'errors': 0,
+            'bytes_sent': 0,
+            'bytes_received': 0,
+            'adv_requested': 0,
+            'adv_posted': 0,
+        }
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._adv_lock = threading.Lock()
+        self._adv_wanted = None
+        self._adv_sent = {}
+        self._adv_sent_at = 0
+        self._adv_event = threading.Event()
+        self._adv_thread = None
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.stats[name] += delta
+
+    def call(self, path, obj=None):
+        url = '%s%s' % (self.address, path)
+        if obj is None:
+            method, body, headers = 'GET', None, None
+        elif isinstance(obj, dict):
+            method, body, headers = 'POST', json.dumps(obj).encode('utf-8'), {'Content-Type': 'application/json'}
+        else:
+            method, body, headers = 'POST', obj, None
+
+        try:
+            r = self._session.request(method, url, data=body, headers=headers, timeout=self.timeout)
+        except Exception:
+            self._count(calls=1, errors=1)
+            raise
+
+        self._count(calls=1, bytes_sent=len(body) if body else 0, bytes_received=len(r.content))
+        if r.status_code != 200:
+            self._count(errors=1)
+            raise APIError(r.status_code, r.text)
+        return r.json()
+
+    def set_advertisement(self, data):
+        with self._adv_lock:
+            self._adv_wanted = dict(data)
+            self.stats['adv_requested'] += 1
+            if self._adv_thread is None:
+                self._adv_thread = threading.Thread(target=self._adv_worker, name='grid-adv', daemon=True)
+                self._adv_thread.start()
+        self._adv_event.set()
+
+    def _adv_delta(self):
+        with self._adv_lock:
+            if time.time() - self._adv_sent_at >= self.adv_refresh:
+                self._adv_sent = {}
+            return {k: v for k, v in self._adv_wanted.items() if k not in self._adv_sent or self._adv_sent[k] != v}
+
+    def _adv_worker(self):
+        while True:
+            self._adv_event.wait()
+            self._adv_event.clear()
+
+            delta = self._adv_delta()
+            if delta:
+                try:
+                    self.call("/mesh/data", obj=delta)
+                    with self._adv_lock:
+                        if not self._adv_sent:
+                            self._adv_sent_at = time.time()
+                        self._adv_sent.update(delta)
+                        self.stats['adv_posted'] += 1
+                except Exception as e:
+                    logging.debug("[grid] can't update advertisement: %s" % e)
+                    with self._adv_lock:
+                        self._adv_sent = {}
+                    # try again at the next interval even if nothing changes
+                    self._adv_event.set()
+
+            time.sleep(self.adv_interval)
+
+
+_client = Client()
+
+
+def client():
+    return _client
 
-    if r.status_code != 200:
-        raise Exception("(status %d) %s" % (r.status_code, r.text))
-    return r.json()
+
+def call(path, obj=None):
+    return _client.call(path, obj)
 
 
 def advertise(enabled=True):
-    return call("/mesh/%s" % 'true' if enabled else 'false')
+    return call("/mesh/%s" % ('true' if enabled else 'false'))
 
 
 def set_advertisement_data(data):
-    return call("/mesh/data", obj=data)
+    _client.set_advertisement(data)
 
 
 def get_advertisement_data():
@@ -63,6 +258,11 @@ def closest_peer():
 
 
 def update_data(last_session):
+    try:
+        last_session.refresh()
+    except Exception as e:
+        logging.debug("can't refresh session stats: %s" % e)
+
     brain = {}
     try:
         with open('/root/brain.json') as fp:
@@ -89,10 +289,43 @@ def update_data(last_session):
     }
 
     logging.debug("updating grid data: %s" % data)
+    logging.debug("grid client stats: %s" % _client.stats)
 
     call("/data", data)
 
 
+def parse_pcap(filename):
+    logging.debug("grid: parsing %s ..." % filename)
+
+    net_id = os.path.basename(filename).replace('.pcap', '')
+
+    if '_' in net_id:
+        # /root/handshakes/ESSID_BSSID.pcap
+        essid, bssid = net_id.split('_')
+    else:
+        # /root/handshakes/BSSID.pcap
+        essid, bssid = '', net_id
+
+    mac_re = re.compile('[0-9a-fA-F]{12}')
+    if not mac_re.match(bssid):
+        return '', ''
+
+    it = iter(bssid)
+    bssid = ':'.join([a + b for a, b in zip(it, it)])
+
+    info = {
+        WifiInfo.ESSID: essid,
+        WifiInfo.BSSID: bssid,
+    }
+
+    try:
+        info = extract_from_pcap(filename, [WifiInfo.BSSID, WifiInfo.ESSID])
+    except Exception as e:
+        logging.error("grid: %s" % e)
+
+    return info[WifiInfo.ESSID], info[WifiInfo.BSSID]
+
+
 def report_ap(essid, bssid):
     try:
         call("/report/ap", {
@@ -0,0 +1,120 @@
+import os
+import time
+import json
+import gzip
+import atexit
+import logging
+import threading
+
+# record types
+SESSION = 'session'
+EPOCH = 'epoch'
+DEAUTH = 'deauth'
+ASSOCIATION = 'association'
+HANDSHAKE = 'handshake'
+PEER = 'peer'
+TRAINING = 'training'
+
+_journal = None
+
+
+class Journal(object):
+    """
+    Structured, json-lines twin of the text log.
+
+    Records are kept in memory and written in batches: the buffer is flushed on every epoch
+    record or when it's full, and fsync'ed at most every fsync_interval seconds.
+    """
+
+    def __init__(self, path, max_buffer=64, fsync_interval=30):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._synced_at = time.time()
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self._fp = open(path, 'at')
+
+    def record(self, type, **fields):
+        fields['type'] = type
+        fields['time'] = time.time()
+        line = json.dumps(fields)
+
+        with self._lock:
+            self._buffer.append(line)
+            must_flush = type in (SESSION, EPOCH) or len(self._buffer) >= self.max_buffer
+
+        if must_flush:
+            self.flush()
+
+    def flush(self, sync=False):
+        with self._lock:
+            if self._buffer:
+                self._fp.write("\n".join(self._buffer) + "\n")
+                self._fp.flush()
+                self._buffer = []
+
+            now = time.time()
+            if sync or now - self._synced_at >= self.fsync_interval:
+                os.fsync(self._fp.fileno())
+                self._synced_at = now
+
+        from pwnagotchi.log import session_catalog
+        session_catalog(self.path, structured=True).update(wait=False, checkpoint=False)
+
+    def close(self):
+        self.flush(sync=True)
+        with self._lock:
+            self._fp.close()
+
+
+def read(path, offset=0):
+    """
+    Yields (offset, record) for every complete record found in path after offset
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as fp:
+        fp.seek(offset)
+        for raw in fp:
+            if not raw.endswith(b'\n'):
+                break
+            try:
+                yield offset, json.loads(raw.decode('utf-8'))
+            except ValueError as e:
+                logging.debug("skipping corrupted journal record at %s:%d (%s)" % (path, offset, e))
+            offset += len(raw)
+
+
+def setup(config):
+    global _journal
+
+    cfg = config['main']['log']['journal']
+    if not cfg['enabled']:
+        return None
+
+    _journal = Journal(cfg['path'], max_buffer=cfg['buffer'], fsync_interval=cfg['fsync_interval'])
+    atexit.register(_journal.close)
+    return _journal
+
+
+def path(config):
+    cfg = config['main']['log']['journal']
+    return cfg['path'] if cfg['enabled'] else None
+
+
+def record(type, **fields):
+    if _journal is not None:
+        try:
+            _journal.record(type, **fields)
+        except Exception as e:
+            logging.debug("error while writing journal record: %s" % e)
+
+
+def flush(sync=False):
+    if _journal is not None:
+        _journal.flush(sync=sync)
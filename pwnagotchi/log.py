@@ -2,17 +2,501 @@ import hashlib
 import time
 import re
 import os
+import glob
+import json
 import logging
-import shutil
 import gzip
+import threading
+import queue
+import atexit
+import logging.handlers
 import warnings
 from datetime import datetime
 
+import pwnagotchi.journal as journal
 from pwnagotchi.voice import Voice
 from pwnagotchi.mesh.peer import Peer
-from file_read_backwards import FileReadBackwards
 
 LAST_SESSION_FILE = '/root/.pwnagotchi-last-session'
+# how often the catalog checkpoint gets rewritten while the log grows
+CATALOG_CHECKPOINT_INTERVAL = 60
+
+
+def _parse_datetime(dt):
+    dt = dt.split('.')[0]
+    dt = dt.split(',')[0]
+    dt = datetime.strptime(dt.split('.')[0], '%Y-%m-%d %H:%M:%S')
+    return time.mktime(dt.timetuple())
+
+
+class SessionSummary(object):
+    """
+    Running statistics of a single session, built one log line at a time
+    """
+    PEER_PARSER = re.compile(
+        r'detected unit (.+)@(.+) \(v.+\) on channel \d+ \(([\d\-]+) dBm\) \[sid:(.+) pwnd_tot:(\d+) uptime:(\d+)\]')
+
+    def __init__(self, offset=0, first_line=''):
+        # position of the first line of the session in the (uncompressed) log
+        self.offset = offset
+        self.id = hashlib.md5(first_line.encode()).hexdigest()
+        self.started_at = None
+        self.stopped_at = None
+        self.deauthed = 0
+        self.associated = 0
+        self.handshakes = 0
+        self.epochs = 0
+        self.train_epochs = 0
+        self.peers = 0
+        self.last_peer = None
+        self.min_reward = 1000
+        self.max_reward = -1000
+        self.tot_reward = 0
+        # digests of the lines already counted, to skip duplicates
+        self._seen = set()
+        # peers met during the session, by identity
+        self._met = {}
+
+    def _seen_before(self, line):
+        digest = hashlib.md5(line.encode()).hexdigest()[:16]
+        if digest in self._seen:
+            return True
+        self._seen.add(digest)
+        return False
+
+    def _on_reward(self, reward):
+        self.tot_reward += reward
+        if reward < self.min_reward:
+            self.min_reward = reward
+
+        elif reward > self.max_reward:
+            self.max_reward = reward
+
+    def _on_peer(self, name, pubkey, rssi, sid, pwnd_tot):
+        if pubkey not in self._met:
+            self.last_peer = {
+                'session_id': sid,
+                'channel': 1,
+                'rssi': int(rssi),
+                'identity': pubkey,
+                'advertisement': {
+                    'name': name,
+                    'pwnd_tot': int(pwnd_tot)
+                }}
+            self.peers += 1
+            self._met[pubkey] = self.last_peer
+        else:
+            self._met[pubkey]['advertisement']['pwnd_tot'] = pwnd_tot
+
+    def feed_record(self, record):
+        """
+        Same as feed, but for a structured journal record
+        """
+        try:
+            type = record['type']
+            self.stopped_at = record['time']
+            if self.started_at is None:
+                self.started_at = self.stopped_at
+
+            if type == journal.DEAUTH:
+                if not self._seen_before('deauth %s %s' % (record['sta'], record['ap'])):
+                    self.deauthed += 1
+
+            elif type == journal.ASSOCIATION:
+                if not self._seen_before('assoc %s' % record['ap']):
+                    self.associated += 1
+
+            elif type == journal.HANDSHAKE:
+                if not self._seen_before('handshake %s %s' % (record['sta'], record['ap'])):
+                    self.handshakes += 1
+
+            elif type == journal.TRAINING:
+                self.train_epochs += 1
+
+            elif type == journal.EPOCH:
+                self.epochs += 1
+                self._on_reward(float(record['reward']))
+
+            elif type == journal.PEER:
+                self._on_peer(record['name'], record['identity'], record['rssi'], record['session_id'],
+                              record['pwnd_tot'])
+        except Exception as e:
+            logging.error("error parsing record '%s': %s" % (record, e))
+
+    def feed(self, line):
+        parts = line.split(']')
+        if len(parts) < 2:
+            return
+
+        try:
+            line_timestamp = parts[0].strip('[')
+            line = ']'.join(parts[1:])
+            self.stopped_at = _parse_datetime(line_timestamp)
+            if self.started_at is None:
+                self.started_at = self.stopped_at
+
+            if LastSession.DEAUTH_TOKEN in line:
+                if not self._seen_before(line):
+                    self.deauthed += 1
+
+            elif LastSession.ASSOC_TOKEN in line:
+                if not self._seen_before(line):
+                    self.associated += 1
+
+            elif LastSession.HANDSHAKE_TOKEN in line:
+                if not self._seen_before(line):
+                    self.handshakes += 1
+
+            elif LastSession.TRAINING_TOKEN in line:
+                self.train_epochs += 1
+
+            elif LastSession.EPOCH_TOKEN in line:
+                self.epochs += 1
+                m = LastSession.EPOCH_PARSER.findall(line)
+                if m:
+                    epoch_num, epoch_data = m[0]
+                    m = LastSession.EPOCH_DATA_PARSER.findall(epoch_data)
+                    for key, value in m:
+                        if key == 'reward':
+                            self._on_reward(float(value))
+
+            elif LastSession.PEER_TOKEN in line:
+                m = SessionSummary.PEER_PARSER.findall(line)
+                if m:
+                    name, pubkey, rssi, sid, pwnd_tot, uptime = m[0]
+                    self._on_peer(name, pubkey, rssi, sid, pwnd_tot)
+        except Exception as e:
+            logging.error("error parsing line '%s': %s" % (line, e))
+
+    def duration(self):
+        if self.started_at is None:
+            return 0
+        return self.stopped_at - self.started_at
+
+    def avg_reward(self):
+        return self.tot_reward / (self.epochs if self.epochs else 1)
+
+    def to_dict(self, with_state=False):
+        obj = {
+            'id': self.id,
+            'offset': self.offset,
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at,
+            'deauthed': self.deauthed,
+            'associated': self.associated,
+            'handshakes': self.handshakes,
+            'epochs': self.epochs,
+            'train_epochs': self.train_epochs,
+            'peers': self.peers,
+            'last_peer': self.last_peer,
+            'min_reward': self.min_reward,
+            'max_reward': self.max_reward,
+            'tot_reward': self.tot_reward,
+        }
+        if with_state:
+            obj['seen'] = list(self._seen)
+            obj['met'] = self._met
+        return obj
+
+    @staticmethod
+    def from_dict(obj):
+        summary = SessionSummary(offset=obj['offset'])
+        for key, value in obj.items():
+            if key == 'seen':
+                summary._seen = set(value)
+            elif key == 'met':
+                summary._met = value
+            else:
+                setattr(summary, key, value)
+        # keep last_peer and the met entry it comes from the same object
+        if summary.last_peer is not None:
+            summary.last_peer = summary._met.get(summary.last_peer['identity'], summary.last_peer)
+        return summary
+
+
+class SessionCatalog(object):
+    """
+    Sidecar index of the sessions contained in a log file (or in the event journal when
+    structured is True).
+
+    Closed sessions are appended as json lines to <log>.idx, while the position reached in the
+    log and the state of the session still being written go to <log>.ckpt, so each update only
+    reads what has been logged since the previous one.
+    """
+
+    def __init__(self, path, structured=False):
+        self.path = path
+        self.structured = structured
+        self.index_path = "%s.idx" % path
+        self.checkpoint_path = "%s.ckpt" % path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._sessions = []
+        self._current = None
+        self._offset = 0
+        self._inode = None
+        self._saved_at = 0
+
+    def _open(self):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, 'rb')
+        return open(self.path, 'rb')
+
+    def _load(self):
+        self._loaded = True
+        self._sessions = []
+        self._current = None
+        self._offset = 0
+        self._inode = None
+
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'rt') as fp:
+                    for line in fp:
+                        line = line.strip()
+                        if line:
+                            self._sessions.append(SessionSummary.from_dict(json.loads(line)))
+
+            if os.path.exists(self.checkpoint_path):
+                with open(self.checkpoint_path, 'rt') as fp:
+                    obj = json.load(fp)
+                self._offset = obj['offset']
+                self._inode = obj['inode']
+                if obj['current'] is not None:
+                    self._current = SessionSummary.from_dict(obj['current'])
+            elif self._sessions and self.path.endswith('.gz'):
+                # sealed archive index, nothing left to read
+                self._offset = None
+            elif self._sessions:
+                # index without checkpoint, can't know where to resume from
+                self._reset()
+        except Exception as e:
+            logging.warning("can't load session catalog %s, rebuilding: %s" % (self.index_path, e))
+            self._reset()
+
+    def _reset(self):
+        self._sessions = []
+        self._current = None
+        self._offset = 0
+        self._inode = None
+        for path in (self.index_path, self.checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _save_checkpoint(self):
+        from pwnagotchi.fs import ensure_write
+        with ensure_write(self.checkpoint_path, 'w') as fp:
+            json.dump({
+                'offset': self._offset,
+                'inode': self._inode,
+                'current': self._current.to_dict(with_state=True) if self._current else None,
+            }, fp)
+        self._saved_at = time.time()
+
+    def _close_current(self):
+        if self._current is None:
+            return
+        with open(self.index_path, 'at') as fp:
+            fp.write(json.dumps(self._current.to_dict()) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._sessions.append(self._current)
+        self._current = None
+
+    def _feed(self, line, offset):
+        # skip multiline messages such as stack traces
+        if line == '' or line[0] != '[':
+            return
+
+        if LastSession.START_TOKEN in line:
+            self._close_current()
+
+        if self._current is None:
+            self._current = SessionSummary(offset, line)
+
+        self._current.feed(line)
+
+    def _feed_record(self, line, offset):
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            logging.debug("skipping corrupted journal record at %s:%d (%s)" % (self.path, offset, e))
+            return
+
+        if record.get('type') == journal.SESSION:
+            self._close_current()
+
+        if self._current is None:
+            self._current = SessionSummary(offset, line)
+
+        self._current.feed_record(record)
+
+    def update(self, progress=None, wait=True, checkpoint=True):
+        """
+        Indexes whatever has been appended to the log since the last update
+        """
+        if not self._lock.acquire(blocking=wait):
+            return False
+
+        try:
+            if not self._loaded:
+                self._load()
+
+            if self._offset is None or not os.path.exists(self.path):
+                return True
+
+            stats = os.stat(self.path)
+            if self._inode is not None and (stats.st_ino != self._inode or stats.st_size < self._offset):
+                logging.debug("%s has been replaced, rebuilding its session catalog" % self.path)
+                self._reset()
+
+            self._inode = stats.st_ino
+            if stats.st_size == self._offset:
+                return True
+
+            lines = 0
+            with self._open() as fp:
+                fp.seek(self._offset)
+                for raw in fp:
+                    # incomplete line still being written, pick it up next time
+                    if not raw.endswith(b'\n'):
+                        break
+
+                    offset = self._offset
+                    self._offset += len(raw)
+                    line = raw.decode('utf-8', errors='replace').strip()
+                    if self.structured:
+                        self._feed_record(line, offset)
+                    else:
+                        self._feed(line, offset)
+
+                    lines += 1
+                    if progress is not None and lines % 100 == 0:
+                        progress(lines)
+
+            if checkpoint or time.time() - self._saved_at >= CATALOG_CHECKPOINT_INTERVAL:
+                self._save_checkpoint()
+
+            return True
+        finally:
+            self._lock.release()
+
+    def seal(self, index_path=None, carry=False):
+        """
+        Indexes the whole log, closes the last session and moves the index to index_path,
+        to be called right before the log gets archived. With carry, the last session is
+        left open and continues in the new log instead.
+        """
+        self.update(checkpoint=False)
+        with self._lock:
+            current = self._current
+            if carry:
+                self._current = None
+            else:
+                self._close_current()
+
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+            if index_path is not None and os.path.exists(self.index_path):
+                os.replace(self.index_path, index_path)
+
+            self._sessions = []
+            self._offset = 0
+            self._inode = None
+            if carry and current is not None:
+                current.offset = 0
+                self._current = current
+                self._loaded = True
+            else:
+                self._loaded = False
+
+    def sessions(self):
+        with self._lock:
+            return self._sessions + ([self._current] if self._current else [])
+
+    def last(self):
+        sessions = self.sessions()
+        return sessions[-1] if sessions else None
+
+    def archives(self):
+        base_path = os.path.dirname(self.path)
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        expr = re.compile(r'^%s(-\d+)?\.gz$' % re.escape(name))
+        # archives still being compressed in background are already indexed
+        found = set(path for path in glob.glob(os.path.join(base_path, "%s*.gz" % name))
+                    if expr.match(os.path.basename(path)))
+        found.update(path[:-len('.idx')] for path in glob.glob(os.path.join(base_path, "%s*.gz.idx" % name))
+                     if expr.match(os.path.basename(path)[:-len('.idx')]))
+        return sorted(found, key=lambda path: os.path.getmtime(path if os.path.exists(path) else "%s.idx" % path))
+
+    def records(self, summary):
+        """
+        Yields the journal records of a session of this catalog
+        """
+        if not self.structured:
+            raise Exception("%s is not a journal" % self.path)
+
+        first = True
+        for _, record in journal.read(self.path, summary.offset):
+            if record.get('type') == journal.SESSION and not first:
+                break
+            first = False
+            yield record
+
+    def catalogs(self):
+        """
+        Returns the up to date catalogs of the rotated archives followed by this one, oldest first
+        """
+        found = []
+        for archive in self.archives():
+            catalog = session_catalog(archive, self.structured)
+            if not os.path.exists(catalog.index_path):
+                logging.info("indexing sessions of %s ..." % archive)
+                catalog.seal()
+            catalog.update()
+            found.append(catalog)
+
+        self.update()
+        return found + [self]
+
+    def history(self):
+        """
+        Returns the sessions found in the rotated archives and in the current log, oldest first
+        """
+        return [session for catalog in self.catalogs() for session in catalog.sessions()]
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def session_catalog(path, structured=False):
+    with _catalogs_lock:
+        if path not in _catalogs:
+            _catalogs[path] = SessionCatalog(path, structured)
+        return _catalogs[path]
+
+
+class SessionCatalogHandler(logging.Handler):
+    """
+    Keeps the session catalog of the log up to date as epochs get logged
+    """
+
+    def __init__(self, catalog, flush=None):
+        super(SessionCatalogHandler, self).__init__()
+        self.catalog = catalog
+        # makes sure buffered lines are on disk before the catalog reads them
+        self.flush_log = flush
+
+    def emit(self, record):
+        try:
+            if LastSession.EPOCH_TOKEN in record.getMessage():
+                if self.flush_log is not None:
+                    self.flush_log()
+                # never block (nor recurse) if an update is already running
+                self.catalog.update(wait=False, checkpoint=False)
+        except Exception:
+            self.handleError(record)
 
 
 class LastSession(object):
@@ -30,7 +514,12 @@ class LastSession(object):
         self.config = config
         self.voice = Voice(lang=config['main']['lang'])
         self.path = config['main']['log']['path']
-        self.last_session = []
+        # prefer the event journal when there's one, it doesn't depend on the wording of log messages
+        journal_path = journal.path(config)
+        if journal_path and os.path.exists(journal_path):
+            self.catalog = session_catalog(journal_path, structured=True)
+        else:
+            self.catalog = session_catalog(self.path)
         self.last_session_id = ''
         self.last_saved_session_id = ''
         self.duration = ''
@@ -45,8 +534,6 @@ class LastSession(object):
         self.min_reward = 1000
         self.max_reward = -1000
         self.avg_reward = 0
-        self._peer_parser = re.compile(
-            'detected unit (.+)@(.+) \(v.+\) on channel \d+ \(([\d\-]+) dBm\) \[sid:(.+) pwnd_tot:(\d+) uptime:(\d+)\]')
         self.parsed = False
 
     def _get_last_saved_session_id(self):
@@ -64,99 +551,36 @@ class LastSession(object):
             self.last_saved_session_id = self.last_session_id
 
     def _parse_datetime(self, dt):
-        dt = dt.split('.')[0]
-        dt = dt.split(',')[0]
-        dt = datetime.strptime(dt.split('.')[0], '%Y-%m-%d %H:%M:%S')
-        return time.mktime(dt.timetuple())
-
-    def _parse_stats(self):
-        self.duration = ''
-        self.duration_human = ''
-        self.deauthed = 0
-        self.associated = 0
-        self.handshakes = 0
-        self.epochs = 0
-        self.train_epochs = 0
-        self.peers = 0
-        self.last_peer = None
-        self.min_reward = 1000
-        self.max_reward = -1000
-        self.avg_reward = 0
+        return _parse_datetime(dt)
 
-        started_at = None
-        stopped_at = None
-        cache = {}
+    def _last_summary(self, progress=None):
+        self.catalog.update(progress=progress)
+        summary = self.catalog.last()
+        if summary is None:
+            # the log has just been rotated, the last session is in the newest archive
+            archives = self.catalog.archives()
+            if archives:
+                archived = session_catalog(archives[-1], self.catalog.structured)
+                if not os.path.exists(archived.index_path):
+                    archived.seal()
+                archived.update()
+                summary = archived.last()
+        return summary
 
-        for line in self.last_session:
-            parts = line.split(']')
-            if len(parts) < 2:
-                continue
-
-            try:
-                line_timestamp = parts[0].strip('[')
-                line = ']'.join(parts[1:])
-                stopped_at = self._parse_datetime(line_timestamp)
-                if started_at is None:
-                    started_at = stopped_at
+    def _load_stats(self, summary):
+        self.deauthed = summary.deauthed
+        self.associated = summary.associated
+        self.handshakes = summary.handshakes
+        self.epochs = summary.epochs
+        self.train_epochs = summary.train_epochs
+        self.peers = summary.peers
+        self.last_peer = Peer(summary.last_peer) if summary.last_peer is not None else None
+        self.min_reward = summary.min_reward
+        self.max_reward = summary.max_reward
+        self.avg_reward = summary.avg_reward()
 
-                if LastSession.DEAUTH_TOKEN in line and line not in cache:
-                    self.deauthed += 1
-                    cache[line] = 1
-
-                elif LastSession.ASSOC_TOKEN in line and line not in cache:
-                    self.associated += 1
-                    cache[line] = 1
-
-                elif LastSession.HANDSHAKE_TOKEN in line and line not in cache:
-                    self.handshakes += 1
-                    cache[line] = 1
-
-                elif LastSession.TRAINING_TOKEN in line:
-                    self.train_epochs += 1
-
-                elif LastSession.EPOCH_TOKEN in line:
-                    self.epochs += 1
-                    m = LastSession.EPOCH_PARSER.findall(line)
-                    if m:
-                        epoch_num, epoch_data = m[0]
-                        m = LastSession.EPOCH_DATA_PARSER.findall(epoch_data)
-                        for key, value in m:
-                            if key == 'reward':
-                                reward = float(value)
-                                self.avg_reward += reward
-                                if reward < self.min_reward:
-                                    self.min_reward = reward
-
-                                elif reward > self.max_reward:
-                                    self.max_reward = reward
-
-                elif LastSession.PEER_TOKEN in line:
-                    m = self._peer_parser.findall(line)
-                    if m:
-                        name, pubkey, rssi, sid, pwnd_tot, uptime = m[0]
-                        if pubkey not in cache:
-                            self.last_peer = Peer({
-                                'session_id': sid,
-                                'channel': 1,
-                                'rssi': int(rssi),
-                                'identity': pubkey,
-                                'advertisement': {
-                                    'name': name,
-                                    'pwnd_tot': int(pwnd_tot)
-                                }})
-                            self.peers += 1
-                            cache[pubkey] = self.last_peer
-                        else:
-                            cache[pubkey].adv['pwnd_tot'] = pwnd_tot
-            except Exception as e:
-                logging.error("error parsing line '%s': %s" % (line, e))
-
-        if started_at is not None:
-            self.duration = stopped_at - started_at
-            mins, secs = divmod(self.duration, 60)
-            hours, mins = divmod(mins, 60)
-        else:
-            hours = mins = secs = 0
+        mins, secs = divmod(summary.duration(), 60)
+        hours, mins = divmod(mins, 60)
 
         self.duration = '%02d:%02d:%02d' % (hours, mins, secs)
         self.duration_human = []
@@ -168,7 +592,6 @@ class LastSession(object):
             self.duration_human.append('%d %s' % (secs, self.voice.hhmmss(secs, 's')))
 
         self.duration_human = ', '.join(self.duration_human)
-        self.avg_reward /= (self.epochs if self.epochs else 1)
 
     def parse(self, ui, skip=False):
         if skip:
@@ -178,38 +601,28 @@ class LastSession(object):
 
             ui.on_reading_logs()
 
-            lines = []
-
-            if os.path.exists(self.path):
-                with FileReadBackwards(self.path, encoding="utf-8") as fp:
-                    for line in fp:
-                        line = line.strip()
-                        if line != "" and line[0] != '[':
-                            continue
-                        lines.append(line)
-                        if LastSession.START_TOKEN in line:
-                            break
-
-                        lines_so_far = len(lines)
-                        if lines_so_far % 100 == 0:
-                            ui.on_reading_logs(lines_so_far)
-
-                lines.reverse()
-
-            if len(lines) == 0:
-                lines.append("Initial Session");
+            summary = self._last_summary(progress=ui.on_reading_logs)
+            if summary is None:
+                summary = SessionSummary(first_line="Initial Session")
 
             ui.on_reading_logs()
 
-            self.last_session = lines
-            self.last_session_id = hashlib.md5(lines[0].encode()).hexdigest()
+            self.last_session_id = summary.id
             self.last_saved_session_id = self._get_last_saved_session_id()
 
-            logging.debug("parsing last session logs (%d lines) ..." % len(lines))
+            logging.debug("loading last session stats (session at offset %d) ..." % summary.offset)
 
-            self._parse_stats()
+            self._load_stats(summary)
         self.parsed = True
 
+    def refresh(self):
+        """
+        Reloads the stats of the last (or current, in auto mode) session from the catalog
+        """
+        summary = self._last_summary()
+        if summary is not None:
+            self._load_stats(summary)
+
     def is_new(self):
         return self.last_session_id != self.last_saved_session_id
 
@@ -223,18 +636,43 @@ def setup_logging(args, config):
 
     root.setLevel(logging.DEBUG if args.debug else logging.INFO)
 
+    # with the async pipeline, handlers run on the writer thread instead of the caller's one
+    use_async = cfg['async']['enabled']
+    handlers = []
+
     if filename:
         # since python default log rotation might break session data in different files,
         # we need to do log rotation ourselves
         log_rotation(filename, cfg)
 
-        file_handler = logging.FileHandler(filename)
+        if cfg['rotation']['enabled']:
+            file_handler = SessionRotatingFileHandler(filename, cfg)
+        else:
+            file_handler = BufferedFileHandler(filename)
+        file_handler.buffered = use_async
         file_handler.setFormatter(formatter)
-        root.addHandler(file_handler)
+        handlers.append(file_handler)
+
+        # must come after the file handler, so the epoch line is on disk when it runs
+        handlers.append(SessionCatalogHandler(session_catalog(filename),
+                                              flush=file_handler.sync if use_async else None))
+
+    journal_path = journal.path(config)
+    if journal_path:
+        log_rotation(journal_path, cfg, structured=True)
+        journal.setup(config)
 
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    root.addHandler(console_handler)
+    handlers.append(console_handler)
+
+    if use_async:
+        global _writer
+        _writer = LogWriter(handlers, cfg['async'])
+        root.addHandler(_writer.handler)
+    else:
+        for handler in handlers:
+            root.addHandler(handler)
 
     if not args.debug:
         # disable scapy and tensorflow logging
@@ -250,19 +688,22 @@ def setup_logging(args, config):
         requests_log.prpagate = False
 
 
-def log_rotation(filename, cfg):
+def log_rotation(filename, cfg, structured=False):
     rotation = cfg['rotation']
     if not rotation['enabled']:
         return
     elif not os.path.isfile(filename):
         return
 
+    # finish whatever the previous run didn't have time to compress
+    archiver().resume(filename, rotation)
+
     stats = os.stat(filename)
     # specify a maximum size to rotate ( format is 10/10B, 10K, 10M 10G )
     if rotation['size']:
         max_size = parse_max_size(rotation['size'])
         if stats.st_size >= max_size:
-            do_rotate(filename, stats, cfg)
+            do_rotate(filename, stats, cfg, structured)
     else:
         raise Exception("log rotation is enabled but log.rotation.size was not specified")
 
@@ -286,26 +727,358 @@ def parse_max_size(s):
         return num
 
 
-def do_rotate(filename, stats, cfg):
+def next_archive_filename(filename):
     base_path = os.path.dirname(filename)
     name = os.path.splitext(os.path.basename(filename))[0]
     archive_filename = os.path.join(base_path, "%s.gz" % name)
     counter = 2
 
-    while os.path.exists(archive_filename):
+    # an archive name is taken as soon as its index exists, even if it's still being compressed
+    while os.path.exists(archive_filename) or os.path.exists("%s.idx" % archive_filename) or \
+            os.path.exists("%s.pending" % archive_filename):
         archive_filename = os.path.join(base_path, "%s-%d.gz" % (name, counter))
         counter += 1
 
-    log_filename = archive_filename.replace('gz', 'log')
+    return archive_filename
+
+
+def do_rotate(filename, stats, cfg, structured=False, carry_session=False):
+    archive_filename = next_archive_filename(filename)
+    pending_filename = "%s.pending" % archive_filename
+
+    print("%s is %d bytes big, rotating to %s ..." % (filename, stats.st_size, pending_filename))
+
+    # the session index follows the log into the archive
+    session_catalog(filename, structured).seal("%s.idx" % archive_filename, carry=carry_session)
+
+    # same filesystem, this is just a rename
+    os.replace(filename, pending_filename)
+
+    archiver().enqueue(pending_filename, archive_filename, cfg['rotation'])
+
 
-    print("%s is %d bytes big, rotating to %s ..." % (filename, stats.st_size, log_filename))
+class Archiver(object):
+    """
+    Compresses rotated logs on a low priority background thread, a chunk at a time, then
+    drops the oldest archives beyond the configured retention.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='log-archiver', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, pending_filename, archive_filename, rotation):
+        self._start()
+        self._queue.put((pending_filename, archive_filename, rotation))
+
+    def resume(self, filename, rotation):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        # same names archives() looks for, pwnagotchi.log must not pick pwnagotchi-journal.jsonl archives up
+        expr = re.compile(r'^%s(-\d+)?\.gz\.pending$' % re.escape(name))
+        pending = glob.glob(os.path.join(os.path.dirname(filename), "%s*.gz.pending" % name))
+        for pending_filename in [path for path in pending if expr.match(os.path.basename(path))]:
+            archive_filename = pending_filename[:-len('.pending')]
+            logging.debug("resuming compression of %s" % pending_filename)
+            self.enqueue(pending_filename, archive_filename, rotation)
+
+    def wait(self):
+        self._queue.join()
+
+    def _compress(self, pending_filename, archive_filename):
+        temp = "%s.part" % archive_filename
+        with open(pending_filename, 'rb') as src:
+            with gzip.open(temp, 'wb') as dst:
+                while True:
+                    chunk = src.read(Archiver.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    # let the interaction loop have the cpu
+                    time.sleep(0)
+        os.replace(temp, archive_filename)
+        os.remove(pending_filename)
+
+    def _enforce_retention(self, archive_filename, rotation):
+        keep = rotation.get('keep', 0)
+        max_total = parse_max_size(rotation['max_total']) if rotation.get('max_total') else 0
+        if not keep and not max_total:
+            return
+
+        base_path = os.path.dirname(archive_filename)
+        name = re.sub(r'(-\d+)?\.gz$', '', os.path.basename(archive_filename))
+        expr = re.compile(r'^%s(-\d+)?\.gz$' % re.escape(name))
+        archives = sorted((path for path in glob.glob(os.path.join(base_path, "%s*.gz" % name))
+                           if expr.match(os.path.basename(path))), key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in archives)
+
+        # never remove the archive that has just been created
+        while len(archives) > 1 and ((keep and len(archives) > keep) or (max_total and total > max_total)):
+            oldest = archives.pop(0)
+            total -= os.path.getsize(oldest)
+            logging.info("removing old log archive %s" % oldest)
+            os.remove(oldest)
+            if os.path.exists("%s.idx" % oldest):
+                os.remove("%s.idx" % oldest)
+
+    def _worker(self):
+        try:
+            # on linux this only affects the calling thread
+            os.nice(19)
+        except Exception:
+            pass
+
+        while True:
+            pending_filename, archive_filename, rotation = self._queue.get()
+            try:
+                logging.debug("compressing %s to %s ..." % (pending_filename, archive_filename))
+                started = time.time()
+                self._compress(pending_filename, archive_filename)
+                logging.debug("%s compressed in %.2fs" % (archive_filename, time.time() - started))
+                self._enforce_retention(archive_filename, rotation)
+            except Exception as e:
+                logging.error("error while compressing %s: %s" % (pending_filename, e))
+            finally:
+                self._queue.task_done()
+
+
+_archiver = None
+
+
+def archiver():
+    global _archiver
+    if _archiver is None:
+        _archiver = Archiver()
+    return _archiver
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """
+    FileHandler that, once buffered is set, only writes to disk when sync is called
+    """
+
+    def __init__(self, filename, mode='a', encoding=None, delay=False):
+        super(BufferedFileHandler, self).__init__(filename, mode=mode, encoding=encoding, delay=delay)
+        self.buffered = False
+
+    def flush(self):
+        if not self.buffered:
+            super(BufferedFileHandler, self).flush()
+
+    def sync(self):
+        super(BufferedFileHandler, self).flush()
+
+
+class SessionRotatingFileHandler(BufferedFileHandler):
+    """
+    Rotates the log by size or age, but only when a new session starts, so that sessions are
+    never split across files. A session that outgrows twice the maximum size or age is rotated
+    at the end of an epoch instead, and carried over to the new file by the session catalog.
+    The age is the one of the first record in the file, so it survives restarts.
+    """
+
+    def __init__(self, filename, cfg, encoding=None):
+        super(SessionRotatingFileHandler, self).__init__(filename, encoding=encoding)
+        self.cfg = cfg
+        rotation = cfg['rotation']
+        self.max_size = parse_max_size(rotation['size'])
+        self.max_age = rotation.get('max_hours', 0) * 3600
+        self.started_at = self._started_at()
+
+    def _size(self):
+        return os.path.getsize(self.baseFilename) if os.path.exists(self.baseFilename) else 0
+
+    def _started_at(self):
+        # timestamp of the first record, or when the file was last changed if it can't be parsed
+        try:
+            with open(self.baseFilename, 'rt', encoding='utf-8', errors='replace') as fp:
+                first_line = fp.readline()
+            if first_line.startswith('['):
+                return _parse_datetime(first_line[1:].split(']')[0])
+        except FileNotFoundError:
+            return time.time()
+        except Exception:
+            pass
+
+        try:
+            return os.stat(self.baseFilename).st_ctime
+        except OSError:
+            return time.time()
+
+    def _should_rotate(self, factor=1):
+        if self._size() >= self.max_size * factor:
+            return True
+        return self.max_age > 0 and time.time() - self.started_at >= self.max_age * factor
+
+    def _rotate(self, carry_session):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        do_rotate(self.baseFilename, os.stat(self.baseFilename), self.cfg, carry_session=carry_session)
+        self.started_at = time.time()
+
+        if not self.delay:
+            self.stream = self._open()
+
+    def emit(self, record):
+        message = record.getMessage()
+        try:
+            if LastSession.START_TOKEN in message and self._should_rotate():
+                self._rotate(carry_session=False)
+        except Exception:
+            self.handleError(record)
+
+        super(SessionRotatingFileHandler, self).emit(record)
+
+        try:
+            if LastSession.EPOCH_TOKEN in message and self._should_rotate(factor=2):
+                self._rotate(carry_session=True)
+        except Exception:
+            self.handleError(record)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller: when the queue is full the record is dropped
+    """
+
+    def __init__(self, queue):
+        super(DroppingQueueHandler, self).__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter(object):
+    """
+    Single thread writing the records queued by the DroppingQueueHandler to the real handlers,
+    in batches: buffers are flushed every `batch` records, every `flush_interval` seconds or
+    as soon as a record of level `flush_level` (or higher) is logged.
+    """
+    _STOP = object()
+
+    def __init__(self, handlers, cfg):
+        self.handlers = handlers
+        self.batch = cfg['batch']
+        self.flush_interval = cfg['flush_interval']
+        self.flush_level = logging.getLevelName(cfg['flush_level'].upper())
+        self.handler = DroppingQueueHandler(queue.Queue(maxsize=cfg['queue_size']))
+        self._reported_drops = 0
+        self._flushed = threading.Event()
+        self._thread = threading.Thread(target=self._worker, name='log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _dispatch(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _flush(self):
+        for handler in self.handlers:
+            if hasattr(handler, 'sync'):
+                handler.sync()
+            else:
+                handler.flush()
+
+    def _report_drops(self):
+        dropped = self.handler.dropped
+        if dropped > self._reported_drops:
+            self._dispatch(logging.makeLogRecord({
+                'name': 'pwnagotchi',
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': "log queue full, %d records dropped so far" % dropped,
+            }))
+            self._reported_drops = dropped
+
+    def _worker(self):
+        records = self.handler.queue
+        pending = 0
+        flushed_at = time.time()
+
+        while True:
+            record = None
+            try:
+                if pending:
+                    record = records.get(timeout=max(0.0, self.flush_interval - (time.time() - flushed_at)))
+                else:
+                    record = records.get()
+            except queue.Empty:
+                pass
+
+            if record is LogWriter._STOP:
+                records.task_done()
+                break
+
+            # flush() marker, everything queued before it has been dispatched already
+            flush_request = record if isinstance(record, threading.Event) else None
+            try:
+                if flush_request is None and record is not None:
+                    self._dispatch(record)
+                    pending += 1
+
+                self._report_drops()
+
+                now = time.time()
+                if flush_request is not None or (pending and (record is None or pending >= self.batch or
+                                                              record.levelno >= self.flush_level or
+                                                              now - flushed_at >= self.flush_interval)):
+                    self._flush()
+                    pending = 0
+                    flushed_at = now
+            except Exception as e:
+                print("error in log writer: %s" % e)
+            finally:
+                if record is not None:
+                    records.task_done()
+                    if flush_request is not None:
+                        flush_request.set()
+
+        self._flush()
+        self._flushed.set()
+
+    def flush(self, timeout=5.0):
+        """
+        Blocks until everything logged so far has been written out
+        """
+        if not self._thread.is_alive():
+            return
+        done = threading.Event()
+        try:
+            # unlike records this can't be dropped
+            self.handler.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def stop(self, timeout=5.0):
+        if self._thread.is_alive():
+            try:
+                self.handler.queue.put(LogWriter._STOP, timeout=timeout)
+                self._flushed.wait(timeout)
+            except queue.Full:
+                pass
 
-    shutil.move(filename, log_filename)
 
-    print("compressing to %s ..." % archive_filename)
+_writer = None
 
-    with open(log_filename, 'rb') as src:
-        with gzip.open(archive_filename, 'wb') as dst:
-            dst.writelines(src)
 
-    os.remove(log_filename)
+def flush():
+    """
+    Writes out whatever the async logging pipeline is still holding in memory
+    """
+    if _writer is not None:
+        _writer.flush()
@@ -16,10 +16,11 @@ class Peer(object):
         now = time.time()
         just_met = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
 
+        self._stamps = (obj.get('met_at', just_met), obj.get('detected_at', just_met), obj.get('prev_seen_at', just_met))
         try:
-            self.first_met = parse_rfc3339(obj.get('met_at', just_met))
-            self.first_seen = parse_rfc3339(obj.get('detected_at', just_met))
-            self.prev_seen = parse_rfc3339(obj.get('prev_seen_at', just_met))
+            self.first_met = parse_rfc3339(self._stamps[0])
+            self.first_seen = parse_rfc3339(self._stamps[1])
+            self.prev_seen = parse_rfc3339(self._stamps[2])
         except Exception as e:
             logging.warning("error while parsing peer timestamps: %s" % e)
             logging.debug(e, exc_info=True)
@@ -49,6 +50,38 @@ class Peer(object):
         self.first_met = new.first_met
         self.encounters = new.encounters
 
+    def apply(self, obj):
+        """
+        Same as update() but from the raw pwngrid-peer object, only parsing the timestamps that changed
+        """
+        self.last_seen = time.time()
+
+        adv = obj.get('advertisement', {})
+        name = adv.get('name', '???')
+        if self.name() != name:
+            logging.info("peer %s changed name: %s -> %s" % (self.full_name(), self.name(), name))
+
+        session_id = obj.get('session_id', '')
+        if self.session_id != session_id:
+            logging.info("peer %s changed session id: %s -> %s" % (self.full_name(), self.session_id, session_id))
+
+        met_at = obj.get('met_at', self._stamps[0])
+        prev_seen_at = obj.get('prev_seen_at', self._stamps[2])
+        try:
+            if met_at != self._stamps[0]:
+                self.first_met = parse_rfc3339(met_at)
+            if prev_seen_at != self._stamps[2]:
+                self.prev_seen = parse_rfc3339(prev_seen_at)
+        except Exception as e:
+            logging.warning("error while parsing peer timestamps: %s" % e)
+            logging.debug(e, exc_info=True)
+        self._stamps = (met_at, self._stamps[1], prev_seen_at)
+
+        self.adv = adv
+        self.rssi = obj.get('rssi', 0)
+        self.session_id = session_id
+        self.encounters = obj.get('encounters', 0)
+
     def inactive_for(self):
         return time.time() - self.last_seen
 
@@ -90,3 +123,55 @@ class Peer(object):
 
     def is_closer(self, other):
         return self.rssi > other.rssi
+
+
+class PeerRegistry(object):
+    """
+    Keeps the Peer objects across pwngrid-peer polls, creating new ones only for new peers.
+
+    pwngrid-peer can't push peer updates, so the poll interval adapts instead: it goes back to
+    min_interval whenever a peer appears or goes away and grows by backoff while the set is stable.
+    """
+
+    def __init__(self, min_interval=3.0, max_interval=30.0, backoff=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.peers = {}
+        self.closest = None
+
+    def apply(self, objs):
+        """
+        Applies a pwngrid-peer peers list, returns the (new, lost) peers
+        """
+        seen = set()
+        new = []
+        closest = None
+
+        for obj in objs:
+            ident = obj.get('advertisement', {}).get('identity', '???')
+            seen.add(ident)
+
+            peer = self.peers.get(ident)
+            if peer is None:
+                peer = Peer(obj)
+                self.peers[ident] = peer
+                new.append(peer)
+            else:
+                peer.apply(obj)
+
+            if closest is None:
+                closest = peer
+
+        lost = []
+        for ident in [ident for ident in self.peers if ident not in seen]:
+            lost.append(self.peers.pop(ident))
+
+        self.closest = closest
+        if new or lost:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+
+        return new, lost
@@ -7,7 +7,8 @@ import pwnagotchi.utils as utils
 import pwnagotchi.ui.faces as faces
 import pwnagotchi.plugins as plugins
 import pwnagotchi.grid as grid
-from pwnagotchi.mesh.peer import Peer
+import pwnagotchi.journal as journal
+from pwnagotchi.mesh.peer import PeerRegistry
 
 
 class AsyncAdvertiser(object):
@@ -26,7 +27,8 @@ class AsyncAdvertiser(object):
             'epoch': 0,
             'policy': self._config['personality']
         }
-        self._peers = {}
+        self._registry = PeerRegistry()
+        self._peers = self._registry.peers
         self._closest_peer = None
 
     def fingerprint(self):
@@ -58,6 +60,9 @@ class AsyncAdvertiser(object):
 
     def _on_new_peer(self, peer):
         logging.info("new peer %s detected (%d encounters)" % (peer.full_name(), peer.encounters))
+        journal.record(journal.PEER, identity=peer.identity(), name=peer.name(), session_id=peer.session_id,
+                       channel=peer.last_channel, rssi=peer.rssi, pwnd_tot=peer.pwnd_total(),
+                       encounters=peer.encounters)
         self._view.on_new_peer(peer)
         plugins.on('peer_detected', self, peer)
 
@@ -74,37 +79,17 @@ class AsyncAdvertiser(object):
             try:
                 logging.debug("polling pwngrid-peer for peers ...")
 
-                grid_peers = grid.peers()
-                new_peers = {}
-
-                self._closest_peer = None
-                for obj in grid_peers:
-                    peer = Peer(obj)
-                    new_peers[peer.identity()] = peer
-                    if self._closest_peer is None:
-                        self._closest_peer = peer
-
-                # check who's gone
-                to_delete = []
-                for ident, peer in self._peers.items():
-                    if ident not in new_peers:
-                        to_delete.append(ident)
-
-                for ident in to_delete:
-                    self._on_lost_peer(self._peers[ident])
-                    del self._peers[ident]
-
-                for ident, peer in new_peers.items():
-                    # check who's new
-                    if ident not in self._peers:
-                        self._peers[ident] = peer
-                        self._on_new_peer(peer)
-                    # update the rest
-                    else:
-                        self._peers[ident].update(peer)
+                new_peers, lost_peers = self._registry.apply(grid.peers())
+                self._closest_peer = self._registry.closest
+
+                for peer in lost_peers:
+                    self._on_lost_peer(peer)
+
+                for peer in new_peers:
+                    self._on_new_peer(peer)
 
             except Exception as e:
                 logging.warning("error while polling pwngrid-peer: %s" % e)
                 logging.debug(e, exc_info=True)
 
-            time.sleep(3)
+            time.sleep(self._registry.interval)
@@ -5,6 +5,8 @@ import threading
 import importlib, importlib.util
 import logging
 
+import pwnagotchi.profiler as profiler
+
 
 
 default_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "default")
@@ -48,6 +50,8 @@ def toggle_plugin(name, enable=True):
             pwnagotchi.config['main']['plugins'][name] = dict()
         pwnagotchi.config['main']['plugins'][name]['enabled'] = enable
         save_config(pwnagotchi.config, '/etc/pwnagotchi/config.toml')
+        if pwnagotchi.loaded_config:
+            pwnagotchi.loaded_config['main']['plugins'].setdefault(name, dict())['enabled'] = enable
 
     if not enable and name in loaded:
         if getattr(loaded[name], 'on_unload', None):
@@ -119,7 +123,8 @@ def load_from_path(path, enabled=()):
         database[plugin_name] = filename
         if plugin_name in enabled:
             try:
-                load_from_file(filename)
+                with profiler.phase(plugin_name):
+                    load_from_file(filename)
             except Exception as e:
                 logging.warning("error while loading %s: %s" % (filename, e))
                 logging.debug(e, exc_info=True)
@@ -14,11 +14,12 @@ SAVE_DIR = '/usr/local/share/pwnagotchi/availaible-plugins/'
 DEFAULT_INSTALL_PATH = '/usr/local/share/pwnagotchi/installed-plugins/'
 
 
-def add_parsers(parser):
+def add_parsers(parser, subparsers=None):
     """
     Adds the plugins subcommand to a given argparse.ArgumentParser
     """
-    subparsers = parser.add_subparsers()
+    if subparsers is None:
+        subparsers = parser.add_subparsers()
     ## pwnagotchi plugins
     parser_plugins = subparsers.add_parser('plugins')
     plugin_subparsers = parser_plugins.add_subparsers(dest='plugincmd')
@@ -33,6 +33,10 @@ class Example(plugins.Plugin):
     def on_internet_available(self, agent):
         pass
 
+    # called when the unit goes online or offline
+    def on_internet_changed(self, agent, connected):
+        pass
+
     # called to setup the ui elements
     def on_ui_setup(self, ui):
         # add custom UI elements
@@ -144,6 +148,10 @@ class Example(plugins.Plugin):
     def on_handshake(self, agent, filename, access_point, client_station):
         pass
 
+    # called when the password of a handshake has been found and saved to filename (the .pcap.cracked file)
+    def on_cracked(self, agent, filename):
+        pass
+
     # called when an epoch is over (where an epoch is a single loop of the main algorithm)
     def on_epoch(self, agent, epoch, epoch_data):
         pass
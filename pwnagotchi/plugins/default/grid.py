@@ -1,47 +1,15 @@
 import os
 import logging
-import time
 import glob
-import re
+import multiprocessing
 
 import pwnagotchi.grid as grid
 import pwnagotchi.plugins as plugins
-from pwnagotchi.utils import StatusFile, WifiInfo, extract_from_pcap
+from pwnagotchi.utils import StatusFile, RateLimiter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from threading import Lock
 
 
-def parse_pcap(filename):
-    logging.info("grid: parsing %s ..." % filename)
-
-    net_id = os.path.basename(filename).replace('.pcap', '')
-
-    if '_' in net_id:
-        # /root/handshakes/ESSID_BSSID.pcap
-        essid, bssid = net_id.split('_')
-    else:
-        # /root/handshakes/BSSID.pcap
-        essid, bssid = '', net_id
-
-    mac_re = re.compile('[0-9a-fA-F]{12}')
-    if not mac_re.match(bssid):
-        return '', ''
-
-    it = iter(bssid)
-    bssid = ':'.join([a + b for a, b in zip(it, it)])
-
-    info = {
-        WifiInfo.ESSID: essid,
-        WifiInfo.BSSID: bssid,
-    }
-
-    try:
-        info = extract_from_pcap(filename, [WifiInfo.BSSID, WifiInfo.ESSID])
-    except Exception as e:
-        logging.error("grid: %s" % e)
-
-    return info[WifiInfo.ESSID], info[WifiInfo.BSSID]
-
-
 class Grid(plugins.Plugin):
     __author__ = 'evilsocket@gmail.com'
     __version__ = '1.0.1'
@@ -51,7 +19,7 @@ class Grid(plugins.Plugin):
 
     def __init__(self):
         self.options = dict()
-        self.report = StatusFile('/root/.api-report.json', data_format='json')
+        self.report = StatusFile('/root/.api-report.json', data_format='json', journal=True)
 
         self.unread_messages = 0
         self.total_messages = 0
@@ -68,10 +36,63 @@ class Grid(plugins.Plugin):
     def on_loaded(self):
         logging.info("grid plugin loaded.")
 
-    def set_reported(self, reported, net_id):
-        if net_id not in reported:
-            reported.append(net_id)
-        self.report.update(data={'reported': reported})
+    @staticmethod
+    def net_id(pcap_file):
+        return os.path.basename(pcap_file).replace('.pcap', '')
+
+    def report_networks(self, pcap_files):
+        """
+        Reports pcap_files in batches: metadata is extracted by a pool of worker processes, reports are
+        sent by concurrency threads at most rate_limit per second and the batch is marked as reported
+        with a single write.
+        """
+        batch_size = self.options.get('batch_size', 50)
+        workers = self.options.get('workers', 2)
+        limiter = RateLimiter(self.options.get('rate_limit', 2.0))
+
+        def send(essid, bssid):
+            limiter.wait()
+            return grid.report_ap(essid, bssid)
+
+        # forking the multithreaded agent can deadlock the children on inherited locks
+        parsers = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) \
+            if workers > 0 else None
+        try:
+            with ThreadPoolExecutor(max_workers=self.options.get('concurrency', 4)) as senders:
+                num_reported = 0
+                for start in range(0, len(pcap_files), batch_size):
+                    batch = pcap_files[start:start + batch_size]
+                    done = []
+                    to_parse = []
+                    for pcap_file in batch:
+                        if self.is_excluded(self.net_id(pcap_file)):
+                            logging.debug("skipping %s due to exclusion filter" % pcap_file)
+                            done.append(self.net_id(pcap_file))
+                        else:
+                            to_parse.append(pcap_file)
+
+                    parsed = parsers.map(grid.parse_pcap, to_parse) if parsers else map(grid.parse_pcap, to_parse)
+                    sending = {}
+                    for pcap_file, (essid, bssid) in zip(to_parse, parsed):
+                        if not bssid:
+                            logging.warning("no bssid found in %s ?!" % pcap_file)
+                        elif self.is_excluded(essid) or self.is_excluded(bssid):
+                            logging.debug("not reporting %s due to exclusion filter" % pcap_file)
+                            done.append(self.net_id(pcap_file))
+                        else:
+                            sending[senders.submit(send, essid, bssid)] = pcap_file
+
+                    for future in as_completed(sending):
+                        if future.result():
+                            done.append(self.net_id(sending[future]))
+                            num_reported += 1
+
+                    self.report.add('reported', *done)
+                    logging.info("grid: %d/%d networks processed, %d reported" % (
+                        min(start + batch_size, len(pcap_files)), len(pcap_files), num_reported))
+        finally:
+            if parsers:
+                parsers.shutdown()
 
     def check_inbox(self, agent):
         logging.debug("checking mailbox ...")
@@ -99,25 +120,8 @@ class Grid(plugins.Plugin):
                 logging.debug("self.options: %s" % self.options)
                 logging.debug("  exclude: %s" % self.options['exclude'])
 
-                for pcap_file in pcap_files:
-                    net_id = os.path.basename(pcap_file).replace('.pcap', '')
-                    if net_id not in reported:
-                        if self.is_excluded(net_id):
-                            logging.debug("skipping %s due to exclusion filter" % pcap_file)
-                            self.set_reported(reported, net_id)
-                            continue
-
-                        essid, bssid = parse_pcap(pcap_file)
-                        if bssid:
-                            if self.is_excluded(essid) or self.is_excluded(bssid):
-                                logging.debug("not reporting %s due to exclusion filter" % pcap_file)
-                                self.set_reported(reported, net_id)
-                            else:
-                                if grid.report_ap(essid, bssid):
-                                    self.set_reported(reported, net_id)
-                                time.sleep(1.5)
-                        else:
-                            logging.warning("no bssid found?!")
+                self.report_networks([pcap_file for pcap_file in pcap_files
+                                      if not self.report.contains('reported', self.net_id(pcap_file))])
             else:
                 logging.debug("grid: reporting disabled")
 
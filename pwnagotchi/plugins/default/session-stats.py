@@ -4,6 +4,8 @@ import threading
 from time import sleep
 from datetime import datetime,timedelta
 from pwnagotchi import plugins
+from pwnagotchi import journal
+from pwnagotchi.log import session_catalog
 from pwnagotchi.utils import StatusFile
 from flask import render_template_string
 from flask import jsonify
@@ -186,6 +188,7 @@ class SessionStats(plugins.Plugin):
         self.options = dict()
         self.stats = dict()
         self.clock = GhettoClock()
+        self.journal_path = None
 
     def on_loaded(self):
         """
@@ -200,13 +203,41 @@ class SessionStats(plugins.Plugin):
                                   data_format='json')
         logging.info("Session-stats plugin loaded.")
 
+    def on_config_changed(self, config):
+        self.journal_path = journal.path(config)
+
     def on_epoch(self, agent, epoch, epoch_data):
         """
         Save the epoch_data to self.stats
         """
         with self.lock:
             self.stats[self.clock.now().strftime("%H:%M:%S")] = epoch_data
-            self.session.update(data={'data': self.stats})
+            # the journal already keeps every epoch on disk
+            if not self.journal_path:
+                self.session.update(data={'data': self.stats})
+
+    def journal_sessions(self):
+        """
+        Returns the sessions recorded in the event journal, by name
+        """
+        sessions = dict()
+        if self.journal_path and os.path.exists(self.journal_path):
+            for catalog in session_catalog(self.journal_path, structured=True).catalogs():
+                for summary in catalog.sessions():
+                    started_at = datetime.fromtimestamp(summary.started_at or 0)
+                    name = "journal_{}_{}".format(started_at.strftime("%Y_%m_%d_%H_%M"), summary.id[:8])
+                    sessions[name] = (catalog, summary)
+        return sessions
+
+    def journal_data(self, name):
+        data = dict()
+        found = self.journal_sessions().get(name)
+        if found is not None:
+            catalog, summary = found
+            for record in catalog.records(summary):
+                if record['type'] == journal.EPOCH:
+                    data[datetime.fromtimestamp(record['time']).strftime("%H:%M:%S")] = record
+        return data
 
     @staticmethod
     def extract_key_values(data, subkeys):
@@ -253,11 +284,13 @@ class SessionStats(plugins.Plugin):
                 'active_for_epochs',
             ]
         elif path == "session":
-            return jsonify({'files': os.listdir(self.options['save_directory'])})
+            return jsonify({'files': os.listdir(self.options['save_directory']) + list(self.journal_sessions())})
 
         with self.lock:
             data = self.stats
-            if session_param and session_param != 'Current':
+            if session_param and session_param.startswith('journal_'):
+                data = self.journal_data(session_param)
+            elif session_param and session_param != 'Current':
                 file_stats = StatusFile(os.path.join(self.options['save_directory'], session_param), data_format='json')
                 data = file_stats.data_field_or('data', default=dict())
             return jsonify(SessionStats.extract_key_values(data, extract_keys))
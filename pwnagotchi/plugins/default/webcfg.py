@@ -1,8 +1,8 @@
 import logging
 import json
 import toml
-import _thread
-from pwnagotchi import restart, plugins
+import pwnagotchi
+from pwnagotchi import plugins
 from pwnagotchi.utils import save_config
 from flask import abort
 from flask import render_template_string
@@ -180,7 +180,7 @@ INDEX = """
         <span><select id="selAddType"><option value="text">Text</option><option value="number">Number</option></select></span>
         <span><button id="btnAdd" type="button" onclick="addOption()">+</button></span>
     </div>
-    <button id="btnSave" type="button" onclick="saveConfig()">Save and restart</button>
+    <button id="btnSave" type="button" onclick="saveConfig()">Save and apply</button>
     <div id="content"></div>
 {% endblock %}
 
@@ -232,7 +232,14 @@ INDEX = """
                 sendJSON("webcfg/save-config", json, function(response) {
                     if (response) {
                         if (response.status == "200") {
-                            alert("Config got updated");
+                            var result = JSON.parse(response.responseText);
+                            if (result.restart) {
+                                alert("Config got updated, restarting ...");
+                            } else if (result.changed.length) {
+                                alert("Config got updated and applied: " + result.changed.join(", "));
+                            } else {
+                                alert("Config got saved, nothing changed");
+                            }
                         } else {
                             alert("Error while updating the config (err-code: " + response.status + ")");
                         }
@@ -508,8 +515,9 @@ class WebConfig(plugins.Plugin):
             if path == "save-config":
                 try:
                     save_config(request.get_json(), '/etc/pwnagotchi/config.toml') # test
-                    _thread.start_new_thread(restart, (self.mode,))
-                    return "success"
+                    # only restarts if some of the changes can't be applied live
+                    changed, restart = pwnagotchi.reload_config(self.mode)
+                    return json.dumps({'changed': changed, 'restart': restart})
                 except Exception as ex:
                     logging.error(ex)
                     return "config error", 500
@@ -3,9 +3,11 @@ import logging
 import os
 import json
 import re
+import time
 import datetime
+import threading
+import collections
 from flask import Response
-from functools import lru_cache
 from dateutil.parser import parse
 
 '''
@@ -29,16 +31,38 @@ class Webgpsmap(plugins.Plugin):
     __license__ = 'GPL3'
     __description__ = 'a plugin for pwnagotchi that shows a openstreetmap with positions of ap-handshakes in your webbrowser'
 
-    ALREADY_SENT = list()
-    SKIP = list()
+    INDEX_PATH = '/root/.webgpsmap_index.json'
+    # seconds between two updates of the files invalidated by events when serving map views
+    REFRESH_INTERVAL = 10
+    # seconds between two full handshakes directory scans
+    FULL_REFRESH_INTERVAL = 300
 
     def __init__(self):
         self.ready = False
+        self.index = None
 
     def on_config_changed(self, config):
         self.config = config
+        cache_size = self.options.get('cache_size', 1024 * 1024)
+        if self.index is None:
+            self.index = PositionIndex(self.INDEX_PATH, PositionCache(cache_size))
+        else:
+            self.index.cache.resize(cache_size)
         self.ready = True
 
+    def on_handshake(self, agent, filename, access_point, client_station):
+        if self.index is not None:
+            self.index.invalidate(filename)
+
+    def on_cracked(self, agent, filename):
+        if self.index is not None:
+            self.index.invalidate(filename)
+
+    def _refresh_index(self):
+        full = time.time() - self.index.scanned_at > self.FULL_REFRESH_INTERVAL
+        if full or time.time() - self.index.refreshed_at > self.REFRESH_INTERVAL:
+            self.index.refresh(self.config['bettercap']['handshakes'], full=full)
+
     def on_loaded(self):
         """
         Plugin got loaded
@@ -72,7 +96,6 @@ class Webgpsmap(plugins.Plugin):
             if request.method == "GET":
                 if path == '/' or not path:
                     # returns the html template
-                    self.ALREADY_SENT = list()
                     try:
                         response_data = bytes(self.get_html(), "utf-8")
                     except Exception as error:
@@ -84,7 +107,6 @@ class Webgpsmap(plugins.Plugin):
                 elif path.startswith('all'):
                     # returns all positions
                     try:
-                        self.ALREADY_SENT = list()
                         response_data = bytes(json.dumps(self.load_gps_from_dir(self.config['bettercap']['handshakes'])), "utf-8")
                         response_status = 200
                         response_mimetype = "application/json"
@@ -95,11 +117,8 @@ class Webgpsmap(plugins.Plugin):
                 elif path.startswith('offlinemap'):
                     # for download an all-in-one html file with positions.json inside
                     try:
-                        self.ALREADY_SENT = list()
-                        json_data = json.dumps(self.load_gps_from_dir(self.config['bettercap']['handshakes']))
-                        html_data = self.get_html()
-                        html_data = html_data.replace('var positions = [];', 'var positions = ' + json_data + ';positionsLoaded=true;drawPositions();')
-                        response_data = bytes(html_data, "utf-8")
+                        self.index.refresh(self.config['bettercap']['handshakes'])
+                        response_data = self.stream_offline_map()
                         response_status = 200
                         response_mimetype = "application/xhtml+xml"
                         response_header_contenttype = 'text/html'
@@ -107,12 +126,43 @@ class Webgpsmap(plugins.Plugin):
                     except Exception as error:
                         logging.error(f"[webgpsmap] on_webhook offlinemap: error: {error}")
                         return
-                # elif path.startswith('/newest'):
-                #     # returns all positions newer then timestamp
-                #     response_data = bytes(json.dumps(self.load_gps_from_dir(self.config['bettercap']['handshakes']), newest_only=True), "utf-8")
-                #     response_status = 200
-                #     response_mimetype = "application/json"
-                #     response_header_contenttype = 'application/json'
+                elif path.startswith('positions'):
+                    # returns the positions (or clusters of them) in view
+                    try:
+                        self._refresh_index()
+                        bbox = request.args.get('bbox', default=None)
+                        bbox = [float(v) for v in bbox.split(',')] if bbox else None
+                        zoom = request.args.get('zoom', default=None, type=int)
+                        tokens = request.args.get('filter', default='').lower().split()
+                        response_data = bytes(json.dumps(self.index.query(bbox, zoom, tokens)), "utf-8")
+                        response_status = 200
+                        response_mimetype = "application/json"
+                        response_header_contenttype = 'application/json'
+                    except Exception as error:
+                        logging.error(f"[webgpsmap] on_webhook positions error: {error}")
+                        return
+                elif path.startswith('newest'):
+                    # returns the positions added or updated after cursor, and the cursor to use next time
+                    try:
+                        self._refresh_index()
+                        cursor, positions = self.index.changes(request.args.get('cursor', default=0, type=int))
+                        response_data = bytes(json.dumps({'cursor': cursor, 'positions': positions}), "utf-8")
+                        response_status = 200
+                        response_mimetype = "application/json"
+                        response_header_contenttype = 'application/json'
+                    except Exception as error:
+                        logging.error(f"[webgpsmap] on_webhook newest error: {error}")
+                        return
+                elif path.startswith('stats'):
+                    # returns index and position cache statistics
+                    try:
+                        response_data = bytes(json.dumps(self.index.stats()), "utf-8")
+                        response_status = 200
+                        response_mimetype = "application/json"
+                        response_header_contenttype = 'application/json'
+                    except Exception as error:
+                        logging.error(f"[webgpsmap] on_webhook stats error: {error}")
+                        return
                 else:
                     # unknown GET path
                     response_data = bytes('''<html>
@@ -144,122 +194,451 @@ class Webgpsmap(plugins.Plugin):
             logging.error(f"[webgpsmap] on_webhook CREATING_RESPONSE error: {error}")
             return
 
-    # cache 2048 items
-    @lru_cache(maxsize=2048, typed=False)
-    def _get_pos_from_file(self, path):
-        return PositionFile(path)
+    def load_gps_from_dir(self, gpsdir):
+        """
+        Parses the gps-data from disk
+        """
+        logging.info(f"[webgpsmap] scanning {gpsdir}")
+        self.index.refresh(gpsdir)
+        gps_data = self.index.positions()
+        logging.info(f"[webgpsmap] loaded {len(gps_data)} positions")
+        return gps_data
+
+    def stream_offline_map(self, chunk=256):
+        """
+        Yields the html page with every position embedded, a few of them at a time
+        """
+        head, tail = self.get_html().split('var positions = [];', 1)
+        yield head.encode('utf-8')
 
+        parts = ['var positions = {']
+        for idx, (key, entry) in enumerate(self.index.positions().items()):
+            parts.append(('' if idx == 0 else ',') + json.dumps(key) + ':' + json.dumps(entry))
+            if len(parts) >= chunk:
+                yield ''.join(parts).encode('utf-8')
+                parts = []
+        parts.append('};positionsLoaded=true;drawPositions();')
+        yield ''.join(parts).encode('utf-8')
 
-    def load_gps_from_dir(self, gpsdir, newest_only=False):
+        yield tail.encode('utf-8')
+
+    def get_html(self):
         """
-        Parses the gps-data from disk
+        Returns the html page
         """
+        try:
+            template_file = os.path.dirname(os.path.realpath(__file__)) + "/" + "webgpsmap.html"
+            html_data = open(template_file, "r").read()
+        except Exception as error:
+            logging.error(f"[webgpsmap] error loading template file {template_file} - error: {error}")
+        return html_data
 
-        handshake_dir = gpsdir
-        gps_data = dict()
 
-        logging.info(f"[webgpsmap] scanning {handshake_dir}")
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
 
 
-        all_files = os.listdir(handshake_dir)
-        #print(all_files)
-        all_pcap_files = [os.path.join(handshake_dir, filename)
-                                for filename in all_files
-                                if filename.endswith('.pcap')
-                                ]
-        all_geo_or_gps_files = []
-        for filename_pcap in all_pcap_files:
-            filename_base = filename_pcap[:-5]  # remove ".pcap"
-            logging.debug(f"[webgpsmap] found: {filename_base}")
-            filename_position = None
+def geohash(lat, lng, precision=9):
+    """
+    Returns the geohash of lat/lng with precision characters
+    """
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    code = []
+    bits, value, even = 0, 0, True
+    while len(code) < precision:
+        rng, val = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if val >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            code.append(GEOHASH_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(code)
 
-            logging.debug("[webgpsmap] search for .gps.json")
-            check_for = os.path.basename(filename_base) + ".gps.json"
-            if check_for in all_files:
-                filename_position = str(os.path.join(handshake_dir, check_for))
 
-            logging.debug("[webgpsmap] search for .geo.json")
-            check_for = os.path.basename(filename_base) + ".geo.json"
-            if check_for in all_files:
-                filename_position = str(os.path.join(handshake_dir, check_for))
+def geohash_cell(precision):
+    """
+    Returns (height, width) in degrees of a geohash cell with precision characters
+    """
+    lat_bits = 5 * precision // 2
+    lng_bits = 5 * precision - lat_bits
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
 
-            logging.debug("[webgpsmap] search for .paw-gps.json")
-            check_for = os.path.basename(filename_base) + ".paw-gps.json"
-            if check_for in all_files:
-                filename_position = str(os.path.join(handshake_dir, check_for))
 
-            logging.debug(f"[webgpsmap] end search for position data files and use {filename_position}")
+def read_text(path):
+    with open(path) as fp:
+        return fp.read()
 
-            if filename_position is not None:
-                all_geo_or_gps_files.append(filename_position)
 
-    #    all_geo_or_gps_files = set(all_geo_or_gps_files) - set(SKIP)   # remove skipped networks? No!
+class PositionCache(object):
+    """
+    LRU cache of objects loaded from files, valid as long as the file (mtime, size) doesn't change.
 
-        if newest_only:
-            all_geo_or_gps_files = set(all_geo_or_gps_files) - set(self.ALREADY_SENT)
+    max_bytes caps the total size of the cached files, used as an estimate of the memory they take.
+    """
+    # rough per entry overhead
+    ENTRY_COST = 512
+
+    def __init__(self, max_bytes=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, loader):
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        value = loader(path)
+        cost = st.st_size + self.ENTRY_COST
+        with self._lock:
+            self._drop(path)
+            self._entries[path] = (key, value, cost)
+            self.size += cost
+            self._evict()
+        return value
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _drop(self, path):
+        cached = self._entries.pop(path, None)
+        if cached is not None:
+            self.size -= cached[2]
+
+    def invalidate(self, path):
+        with self._lock:
+            self._drop(path)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+class PositionIndex(object):
+    """
+    Geohash index of the positions found in the handshakes directory.
 
-        logging.info(f"[webgpsmap] Found {len(all_geo_or_gps_files)} position-data files from {len(all_pcap_files)} handshakes. Fetching positions ...")
+    Every position is bucketed by its geohash prefixes, so that a bounding box only looks at the
+    cells covering it, and clustered by a shorter prefix depending on the zoom level. The index is
+    persisted and only position files whose (mtime, size) changed are parsed again on refresh.
+    """
+    PRECISION = 9
+    # bucket precisions are 1 .. BUCKETS
+    BUCKETS = 6
+    MAX_CELLS = 64
+    # below this many results positions are sent as they are
+    MAX_UNCLUSTERED = 200
+    # roughly the size of a cluster on screen
+    CLUSTER_PIXELS = 80
+
+    POSITION_EXTS = ('.gps.json', '.geo.json', '.paw-gps.json')
+
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.cache = cache if cache is not None else PositionCache()
+        self.entries = {}
+        self.files = {}
+        # bumped for every position added or updated, stored in the entry as 'seq'
+        self.cursor = 0
+        self._buckets = [dict() for _ in range(self.BUCKETS + 1)]
+        self._lock = threading.Lock()
+        self.refreshed_at = 0
+        self.scanned_at = 0
+        self._dirty = set()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+            self.cursor = data.get('cursor', 0)
+            for pos_file, (signature, key) in data['files'].items():
+                self.files[pos_file] = [signature, key]
+                if key is not None:
+                    self._add(key, data['entries'][key])
+        except Exception as error:
+            logging.warning(f"[webgpsmap] can't load index {self.path}, rebuilding it: {error}")
+            self.entries = {}
+            self.files = {}
+            self.cursor = 0
+            self._buckets = [dict() for _ in range(self.BUCKETS + 1)]
+
+    def save(self):
+        from pwnagotchi.fs import ensure_write
+        with ensure_write(self.path, 'w') as fp:
+            json.dump({'cursor': self.cursor, 'files': self.files, 'entries': self.entries}, fp)
+
+    def _add(self, key, entry):
+        self.entries[key] = entry
+        for precision in range(1, self.BUCKETS + 1):
+            self._buckets[precision].setdefault(entry['hash'][:precision], set()).add(key)
+
+    def _remove(self, pos_file):
+        known = self.files.pop(pos_file, None)
+        if known is None or known[1] not in self.entries:
+            return
+        entry = self.entries.pop(known[1])
+        for precision in range(1, self.BUCKETS + 1):
+            bucket = self._buckets[precision].get(entry['hash'][:precision])
+            if bucket is not None:
+                bucket.discard(known[1])
+                if not bucket:
+                    del self._buckets[precision][entry['hash'][:precision]]
+
+    @staticmethod
+    def _signature(pos_file, cracked_file):
+        st = os.stat(pos_file)
+        cracked = os.stat(cracked_file).st_mtime_ns if cracked_file else 0
+        return [st.st_mtime_ns, st.st_size, cracked]
+
+    def _parse(self, pos_file, cracked_file):
+        pos = self.cache.get(pos_file, PositionFile)
+        ssid, mac = pos.ssid(), pos.mac()
+        ssid = "unknown" if not ssid else ssid
+        # invalid mac is strange and should abort; ssid is ok
+        if not mac:
+            raise ValueError("Mac can't be parsed from filename")
+
+        pos_type = {PositionFile.GPS: 'gps', PositionFile.GEO: 'geo', PositionFile.PAWGPS: 'paw'}.get(pos.type(), 'unknown')
+        lat, lng = pos.lat(), pos.lng()
+        entry = {
+            'ssid': ssid,
+            'mac': mac,
+            'type': pos_type,
+            'lng': lng,
+            'lat': lat,
+            'acc': pos.accuracy(),
+            'ts_first': pos.timestamp_first(),
+            'ts_last': pos.timestamp_last(),
+            'hash': geohash(lat, lng, PositionIndex.PRECISION),
+        }
+        # get ap password if exist
+        if cracked_file:
+            entry['pass'] = self.cache.get(cracked_file, read_text)
+
+        return ssid + "_" + mac, entry
+
+    def invalidate(self, filename):
+        """
+        Marks the position of a pcap (or any of its sidecar files) to be checked at the next refresh
+        """
+        name = os.path.basename(filename)
+        for ext in self.POSITION_EXTS + ('.pcap.cracked', '.pcap'):
+            if name.endswith(ext):
+                base = name[:-len(ext)]
+                with self._lock:
+                    self._dirty.add(base)
+                # the sidecars are checked against their mtime and size anyway
+                self.cache.invalidate(filename)
+                return
 
-        for pos_file in all_geo_or_gps_files:
-            try:
-                pos = self._get_pos_from_file(pos_file)
-                if not pos.type() == PositionFile.GPS and not pos.type() == PositionFile.GEO and not pos.type() == PositionFile.PAWGPS:
+    def _wanted(self, handshake_dir, bases, names):
+        wanted = {}
+        for base in bases:
+            pos_name = None
+            # same preference as before: paw-gps over geo over gps
+            for ext in self.POSITION_EXTS:
+                if base + ext in names:
+                    pos_name = base + ext
+            if pos_name is not None:
+                cracked = base + '.pcap.cracked'
+                wanted[os.path.join(handshake_dir, pos_name)] = \
+                    os.path.join(handshake_dir, cracked) if cracked in names else None
+        return wanted
+
+    def refresh(self, handshake_dir, full=True):
+        """
+        Brings the index up to date with handshake_dir, or only with the files invalidated since the last
+        refresh if full is not set, returns True if anything changed
+        """
+        with self._lock:
+            if full:
+                names = set(os.listdir(handshake_dir))
+                bases = [name[:-5] for name in names if name.endswith('.pcap')]
+                wanted = self._wanted(handshake_dir, bases, names)
+                stale = [f for f in self.files if f not in wanted]
+            else:
+                bases = self._dirty
+                candidates = [os.path.join(handshake_dir, base + ext) for base in bases
+                              for ext in self.POSITION_EXTS + ('.pcap', '.pcap.cracked')]
+                names = set(os.path.basename(f) for f in candidates if os.path.exists(f))
+                wanted = self._wanted(handshake_dir, bases, names)
+                stale = [f for f in candidates if f in self.files and f not in wanted]
+            self._dirty = set()
+
+            changed = False
+            for pos_file in stale:
+                self._remove(pos_file)
+                changed = True
+
+            for pos_file, cracked_file in wanted.items():
+                try:
+                    signature = self._signature(pos_file, cracked_file)
+                except OSError:
                     continue
 
-                ssid, mac = pos.ssid(), pos.mac()
-                ssid = "unknown" if not ssid else ssid
-                # invalid mac is strange and should abort; ssid is ok
-                if not mac:
-                    raise ValueError("Mac can't be parsed from filename")
-                pos_type = 'unknown'
-                if pos.type() == PositionFile.GPS:
-                    pos_type = 'gps'
-                elif pos.type() == PositionFile.GEO:
-                    pos_type = 'geo'
-                elif pos.type() == PositionFile.PAWGPS:
-                    pos_type = 'paw'
-                gps_data[ssid+"_"+mac] = {
-                    'ssid': ssid,
-                    'mac': mac,
-                    'type': pos_type,
-                    'lng': pos.lng(),
-                    'lat': pos.lat(),
-                    'acc': pos.accuracy(),
-                    'ts_first': pos.timestamp_first(),
-                    'ts_last': pos.timestamp_last(),
-                    }
-
-                # get ap password if exist
-                check_for = os.path.basename(pos_file).split(".")[0] + ".pcap.cracked"
-                if check_for in all_files:
-                    gps_data[ssid + "_" + mac]["pass"] = pos.password()
-
-                self.ALREADY_SENT += pos_file
-            except json.JSONDecodeError as error:
-                self.SKIP += pos_file
-                logging.error(f"[webgpsmap] JSONDecodeError in: {pos_file} - error: {error}")
-                continue
-            except ValueError as error:
-                self.SKIP += pos_file
-                logging.error(f"[webgpsmap] ValueError: {pos_file} - error: {error}")
-                continue
-            except OSError as error:
-                self.SKIP += pos_file
-                logging.error(f"[webgpsmap] OSError: {pos_file} - error: {error}")
-                continue
-        logging.info(f"[webgpsmap] loaded {len(gps_data)} positions")
-        return gps_data
+                known = self.files.get(pos_file)
+                if known is not None and known[0] == signature:
+                    continue
 
-    def get_html(self):
+                self._remove(pos_file)
+                key = None
+                try:
+                    key, entry = self._parse(pos_file, cracked_file)
+                    self.cursor += 1
+                    entry['seq'] = self.cursor
+                    self._add(key, entry)
+                except (ValueError, TypeError, OSError) as error:
+                    # bad files are remembered and not parsed again until they change
+                    logging.error(f"[webgpsmap] can't load {pos_file} - error: {error}")
+                self.files[pos_file] = [signature, key]
+                changed = True
+
+            self.refreshed_at = time.time()
+            if full:
+                self.scanned_at = self.refreshed_at
+            if changed:
+                logging.info(f"[webgpsmap] indexed {len(self.entries)} positions from {len(self.files)} position files")
+                self.save()
+            return changed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'positions': len(self.entries),
+                'files': len(self.files),
+                'cursor': self.cursor,
+                'refreshed_at': self.refreshed_at,
+                'scanned_at': self.scanned_at,
+                'cache': self.cache.stats(),
+            }
+
+    @staticmethod
+    def matches(entry, tokens):
+        if not tokens:
+            return True
+        pattern = "%s %s %s " % (entry['ssid'], ':'.join(entry['mac'][i:i + 2] for i in range(0, 12, 2)), entry['mac'])
+        pattern += (entry['pass'] + ' #cracked') if 'pass' in entry else ' #notcracked'
+        pattern = pattern.lower()
+        return all(token in pattern for token in tokens)
+
+    def _cells(self, south, west, north, east):
+        for precision in range(self.BUCKETS, 0, -1):
+            height, width = geohash_cell(precision)
+            if ((north - south) / height + 2) * ((east - west) / width + 2) <= self.MAX_CELLS:
+                break
+
+        cells = set()
+        lat = south
+        while True:
+            lng = west
+            while True:
+                cells.add(geohash(min(lat, north), min(lng, east), precision))
+                if lng >= east:
+                    break
+                lng += width
+            if lat >= north:
+                break
+            lat += height
+        return precision, cells
+
+    def query(self, bbox=None, zoom=None, tokens=()):
         """
-        Returns the html page
+        Returns the positions inside bbox (south, west, north, east) matching every filter token,
+        clustered by geohash if there are too many of them for zoom
         """
-        try:
-            template_file = os.path.dirname(os.path.realpath(__file__)) + "/" + "webgpsmap.html"
-            html_data = open(template_file, "r").read()
-        except Exception as error:
-            logging.error(f"[webgpsmap] error loading template file {template_file} - error: {error}")
-        return html_data
+        south, west, north, east = bbox if bbox else (-90.0, -180.0, 90.0, 180.0)
+        south, north = max(south, -90.0), min(north, 90.0)
+        west, east = max(west, -180.0), min(east, 180.0)
+
+        with self._lock:
+            precision, cells = self._cells(south, west, north, east)
+            keys = set()
+            for cell in cells:
+                keys.update(self._buckets[precision].get(cell, ()))
+
+            inside = [self.entries[key] for key in keys
+                      if south <= self.entries[key]['lat'] <= north and west <= self.entries[key]['lng'] <= east
+                      and self.matches(self.entries[key], tokens)]
+
+        result = {'total': len(inside), 'positions': {}, 'clusters': [], 'bounds': None, 'cursor': self.cursor}
+        if inside:
+            result['bounds'] = [[min(e['lat'] for e in inside), min(e['lng'] for e in inside)],
+                                [max(e['lat'] for e in inside), max(e['lng'] for e in inside)]]
+
+        groups = {}
+        if zoom is not None and len(inside) > self.MAX_UNCLUSTERED:
+            # the cluster cell should be about CLUSTER_PIXELS wide at this zoom level (256px tiles)
+            degrees = 360.0 / (1 << max(0, int(zoom))) * self.CLUSTER_PIXELS / 256
+            cluster_precision = 1
+            while cluster_precision < self.PRECISION and geohash_cell(cluster_precision)[1] > degrees:
+                cluster_precision += 1
+            for entry in inside:
+                groups.setdefault(entry['hash'][:cluster_precision], []).append(entry)
+        else:
+            groups = {entry['ssid'] + "_" + entry['mac']: [entry] for entry in inside}
+
+        for cell, entries in groups.items():
+            if len(entries) == 1:
+                entry = entries[0]
+                result['positions'][entry['ssid'] + "_" + entry['mac']] = entry
+            else:
+                result['clusters'].append({
+                    'hash': cell,
+                    'count': len(entries),
+                    'cracked': sum(1 for e in entries if 'pass' in e),
+                    'lat': sum(e['lat'] for e in entries) / len(entries),
+                    'lng': sum(e['lng'] for e in entries) / len(entries),
+                })
+        return result
+
+    def changes(self, since):
+        """
+        Returns the current cursor and the positions added or updated after the since cursor
+        """
+        with self._lock:
+            if since > self.cursor:
+                # the index has been rebuilt, start over
+                since = 0
+            return self.cursor, {key: entry for key, entry in self.entries.items() if entry.get('seq', 0) > since}
+
+    def positions(self):
+        with self._lock:
+            return {key: entry for key, entry in self.entries.items()}
 
 
 class PositionFile:
@@ -4,11 +4,11 @@ import json
 import csv
 import requests
 
-from io import StringIO
 from datetime import datetime
-from pwnagotchi.utils import WifiInfo, FieldNotFoundError, extract_from_pcap, StatusFile, remove_whitelisted
+from pwnagotchi.utils import WifiInfo, FieldNotFoundError, extract_from_pcap, remove_whitelisted
 from threading import Lock
 from pwnagotchi import plugins
+from pwnagotchi import uploader
 from pwnagotchi._version import __version__ as __pwnagotchi_version__
 
 
@@ -41,19 +41,18 @@ def _format_auth(data):
     return out
 
 
-def _transform_wigle_entry(gps_data, pcap_data, plugin_version):
+def _wigle_header(plugin_version):
+    # kismet header
+    return "WigleWifi-1.4,appRelease={},model=pwnagotchi,release={},device=pwnagotchi,display=kismet,board=kismet,brand=pwnagotchi\n" \
+           "MAC,SSID,AuthMode,FirstSeen,Channel,RSSI,CurrentLatitude,CurrentLongitude,AltitudeMeters,AccuracyMeters,Type\n".format(
+               plugin_version, __pwnagotchi_version__)
+
+
+def _transform_wigle_entry(gps_data, pcap_data):
     """
-    Transform to wigle entry in file
+    Transform to wigle csv row
     """
-    dummy = StringIO()
-    # write kismet header
-    dummy.write(
-        "WigleWifi-1.4,appRelease={},model=pwnagotchi,release={},device=pwnagotchi,display=kismet,board=kismet,brand=pwnagotchi\n".format(plugin_version, __pwnagotchi_version__))
-    dummy.write(
-        "MAC,SSID,AuthMode,FirstSeen,Channel,RSSI,CurrentLatitude,CurrentLongitude,AltitudeMeters,AccuracyMeters,Type")
-
-    writer = csv.writer(dummy, delimiter=",", quoting=csv.QUOTE_NONE, escapechar="\\")
-    writer.writerow([
+    return [
         pcap_data[WifiInfo.BSSID],
         pcap_data[WifiInfo.ESSID],
         _format_auth(pcap_data[WifiInfo.ENCRYPTION]),
@@ -65,37 +64,38 @@ def _transform_wigle_entry(gps_data, pcap_data, plugin_version):
         gps_data['Longitude'],
         gps_data['Altitude'],
         0,  # accuracy?
-        'WIFI'])
-    return dummy.getvalue()
+        'WIFI']
 
 
-def _send_to_wigle(lines, api_key, donate=True, timeout=30):
+def _send_to_wigle(session, rows, api_key, plugin_version, donate=True, max_size=1024 * 1024, timeout=30):
     """
-    Uploads the file to wigle-net
+    Uploads the rows to wigle-net, in as many files of at most max_size bytes as needed. If one of
+    them fails, the rows of the files already accepted are reported with uploader.PartialUpload so
+    that they are not uploaded again.
     """
-
-    dummy = StringIO()
-
-    for line in lines:
-        dummy.write(f"{line}")
-
-    dummy.seek(0)
-
     headers = {'Authorization': f"Basic {api_key}",
                'Accept': 'application/json'}
-    data = {'donate': 'on' if donate else 'false'}
-    payload = {'file': dummy, 'type': 'text/csv'}
-    try:
-        res = requests.post('https://api.wigle.net/api/v2/file/upload',
-                            data=data,
-                            headers=headers,
-                            files=payload,
-                            timeout=timeout)
-        json_res = res.json()
-        if not json_res['success']:
-            raise requests.exceptions.RequestException(json_res['message'])
-    except requests.exceptions.RequestException as re_e:
-        raise re_e
+    fields = {'donate': 'on' if donate else 'false'}
+
+    chunks = uploader.csv_chunks(_wigle_header(plugin_version), rows, max_size,
+                                 delimiter=",", quoting=csv.QUOTE_NONE, escapechar="\\")
+    uploaded = 0
+    for num_rows, chunk in chunks:
+        try:
+            with uploader.MultipartBody('file', 'pwnagotchi.csv', content=chunk, fields=fields,
+                                        content_type='text/csv') as body:
+                res = session.post('https://api.wigle.net/api/v2/file/upload',
+                                   data=body,
+                                   headers=dict(headers, **{'Content-Type': body.content_type}),
+                                   timeout=timeout)
+            json_res = res.json()
+            if not json_res['success']:
+                raise requests.exceptions.RequestException(json_res['message'])
+        except Exception as e:
+            if not uploaded:
+                raise
+            raise uploader.PartialUpload(uploaded, e)
+        uploaded += num_rows
 
 
 class Wigle(plugins.Plugin):
@@ -106,8 +106,8 @@ class Wigle(plugins.Plugin):
 
     def __init__(self):
         self.ready = False
-        self.report = StatusFile('/root/.wigle_uploads', data_format='json')
-        self.skip = list()
+        self.uploads = uploader.register('wigle', '/root/.wigle_uploads', self._upload, encode=self._encode,
+                                         batch_size=500, concurrency=1)
         self.lock = Lock()
 
     def on_loaded(self):
@@ -124,6 +124,46 @@ class Wigle(plugins.Plugin):
         self.ready = True
         logging.info("WIGLE: ready")
 
+    def _encode(self, gps_file):
+        """
+        Turns a gps file into its wigle csv entry
+        """
+        from scapy.all import Scapy_Exception
+
+        if gps_file.endswith('.gps.json'):
+            pcap_filename = gps_file.replace('.gps.json', '.pcap')
+        if gps_file.endswith('.paw-gps.json'):
+            pcap_filename = gps_file.replace('.paw-gps.json', '.pcap')
+        if gps_file.endswith('.geo.json'):
+            pcap_filename = gps_file.replace('.geo.json', '.pcap')
+        if not os.path.exists(pcap_filename):
+            raise uploader.PermanentError("can't find pcap for %s" % gps_file)
+
+        try:
+            gps_data = _extract_gps_data(gps_file)
+        except (OSError, json.JSONDecodeError) as err:
+            raise uploader.PermanentError(err)
+
+        if gps_data['Latitude'] == 0 and gps_data['Longitude'] == 0:
+            raise ValueError("not enough gps-information for %s, trying again later" % gps_file)
+
+        try:
+            pcap_data = extract_from_pcap(pcap_filename, [WifiInfo.BSSID,
+                                                          WifiInfo.ESSID,
+                                                          WifiInfo.ENCRYPTION,
+                                                          WifiInfo.CHANNEL,
+                                                          WifiInfo.RSSI])
+        except FieldNotFoundError:
+            raise uploader.PermanentError("could not extract all information from %s" % pcap_filename)
+        except Scapy_Exception as sc_e:
+            raise uploader.PermanentError(sc_e)
+
+        return _transform_wigle_entry(gps_data, pcap_data)
+
+    def _upload(self, session, rows):
+        _send_to_wigle(session, rows, self.options['api_key'], self.__version__, donate=self.options['donate'],
+                       max_size=self.options.get('max_upload_size', 1024 * 1024))
+
     def on_internet_available(self, agent):
         """
         Called in manual mode when there's internet connectivity
@@ -131,78 +171,20 @@ class Wigle(plugins.Plugin):
         if not self.ready or self.lock.locked():
             return
 
-        from scapy.all import Scapy_Exception
-
-        config = agent.config()
-        display = agent.view()
-        reported = self.report.data_field_or('reported', default=list())
-        handshake_dir = config['bettercap']['handshakes']
-        all_files = os.listdir(handshake_dir)
-        all_gps_files = [os.path.join(handshake_dir, filename)
-                         for filename in all_files
-                         if filename.endswith('.gps.json') or filename.endswith('.paw-gps.json') or filename.endswith('.geo.json')]
-
-        all_gps_files = remove_whitelisted(all_gps_files, self.options['whitelist'])
-        new_gps_files = set(all_gps_files) - set(reported) - set(self.skip)
-        if new_gps_files:
-            logging.info("WIGLE: Internet connectivity detected. Uploading new handshakes to wigle.net")
-            csv_entries = list()
-            no_err_entries = list()
-            for gps_file in new_gps_files:
-                if gps_file.endswith('.gps.json'):
-                    pcap_filename = gps_file.replace('.gps.json', '.pcap')
-                if gps_file.endswith('.paw-gps.json'):
-                    pcap_filename = gps_file.replace('.paw-gps.json', '.pcap')
-                if gps_file.endswith('.geo.json'):
-                    pcap_filename = gps_file.replace('.geo.json', '.pcap')
-                if not os.path.exists(pcap_filename):
-                    logging.debug("WIGLE: Can't find pcap for %s", gps_file)
-                    self.skip.append(gps_file)
-                    continue
-                try:
-                    gps_data = _extract_gps_data(gps_file)
-                except OSError as os_err:
-                    logging.debug("WIGLE: %s", os_err)
-                    self.skip.append(gps_file)
-                    continue
-                except json.JSONDecodeError as json_err:
-                    logging.debug("WIGLE: %s", json_err)
-                    self.skip.append(gps_file)
-                    continue
-                if gps_data['Latitude'] == 0 and gps_data['Longitude'] == 0:
-                    logging.debug("WIGLE: Not enough gps-information for %s. Trying again next time.", gps_file)
-                    self.skip.append(gps_file)
-                    continue
-                try:
-                    pcap_data = extract_from_pcap(pcap_filename, [WifiInfo.BSSID,
-                                                                  WifiInfo.ESSID,
-                                                                  WifiInfo.ENCRYPTION,
-                                                                  WifiInfo.CHANNEL,
-                                                                  WifiInfo.RSSI])
-                except FieldNotFoundError:
-                    logging.debug("WIGLE: Could not extract all information. Skip %s", gps_file)
-                    self.skip.append(gps_file)
-                    continue
-                except Scapy_Exception as sc_e:
-                    logging.debug("WIGLE: %s", sc_e)
-                    self.skip.append(gps_file)
-                    continue
-                new_entry = _transform_wigle_entry(gps_data, pcap_data, self.__version__)
-                csv_entries.append(new_entry)
-                no_err_entries.append(gps_file)
-            if csv_entries:
-                display.on_uploading('wigle.net')
+        with self.lock:
+            config = agent.config()
+            display = agent.view()
+            handshake_dir = config['bettercap']['handshakes']
+            all_files = os.listdir(handshake_dir)
+            all_gps_files = [os.path.join(handshake_dir, filename)
+                             for filename in all_files
+                             if filename.endswith('.gps.json') or filename.endswith('.paw-gps.json') or filename.endswith('.geo.json')]
 
-                try:
-                    _send_to_wigle(csv_entries, self.options['api_key'], donate=self.options['donate'])
-                    reported += no_err_entries
-                    self.report.update(data={'reported': reported})
-                    logging.info("WIGLE: Successfully uploaded %d files", len(no_err_entries))
-                except requests.exceptions.RequestException as re_e:
-                    self.skip += no_err_entries
-                    logging.debug("WIGLE: Got an exception while uploading %s", re_e)
-                except OSError as os_e:
-                    self.skip += no_err_entries
-                    logging.debug("WIGLE: Got the following error: %s", os_e)
+            all_gps_files = remove_whitelisted(all_gps_files, self.options['whitelist'])
+            self.uploads.enqueue(*all_gps_files)
 
+            if self.uploads.pending():
+                logging.info("WIGLE: Internet connectivity detected. Uploading new handshakes to wigle.net")
+                display.on_uploading('wigle.net')
+                self.uploads.process()
                 display.on_normal()
@@ -3,9 +3,9 @@ import logging
 import requests
 from datetime import datetime
 from threading import Lock
-from pwnagotchi.utils import StatusFile, remove_whitelisted
+from pwnagotchi.utils import remove_whitelisted
 from pwnagotchi import plugins
-from json.decoder import JSONDecodeError
+from pwnagotchi import uploader
 
 
 class WpaSec(plugins.Plugin):
@@ -17,31 +17,32 @@ class WpaSec(plugins.Plugin):
     def __init__(self):
         self.ready = False
         self.lock = Lock()
-        try:
-            self.report = StatusFile('/root/.wpa_sec_uploads', data_format='json')
-        except JSONDecodeError:
-            os.remove("/root/.wpa_sec_uploads")
-            self.report = StatusFile('/root/.wpa_sec_uploads', data_format='json')
+        self.uploads = uploader.register('wpa-sec', '/root/.wpa_sec_uploads', self._upload_to_wpasec,
+                                         encode=self._check_handshake)
         self.options = dict()
-        self.skip = list()
 
-    def _upload_to_wpasec(self, path, timeout=30):
+    @staticmethod
+    def _check_handshake(path):
+        if not os.path.exists(path):
+            raise uploader.PermanentError("%s does not exist anymore" % path)
+        return path
+
+    def _upload_to_wpasec(self, session, paths, timeout=30):
         """
         Uploads the file to https://wpa-sec.stanev.org, or another endpoint.
         """
-        with open(path, 'rb') as file_to_upload:
-            cookie = {'key': self.options['api_key']}
-            payload = {'file': file_to_upload}
-
-            try:
-                result = requests.post(self.options['api_url'],
-                                       cookies=cookie,
-                                       files=payload,
-                                       timeout=timeout)
+        for path in paths:
+            with uploader.MultipartBody('file', os.path.basename(path), path=path) as body:
+                cookie = {'key': self.options['api_key']}
+
+                result = session.post(self.options['api_url'],
+                                      cookies=cookie,
+                                      data=body,
+                                      headers={'Content-Type': body.content_type},
+                                      timeout=timeout)
+                result.raise_for_status()
                 if ' already submitted' in result.text:
                     logging.debug("%s was already submitted.", path)
-            except requests.exceptions.RequestException as req_e:
-                raise req_e
 
 
     def _download_from_wpasec(self, output, timeout=30):
@@ -100,32 +101,17 @@ class WpaSec(plugins.Plugin):
         with self.lock:
             config = agent.config()
             display = agent.view()
-            reported = self.report.data_field_or('reported', default=list())
             handshake_dir = config['bettercap']['handshakes']
             handshake_filenames = os.listdir(handshake_dir)
             handshake_paths = [os.path.join(handshake_dir, filename) for filename in handshake_filenames if
                                filename.endswith('.pcap')]
             handshake_paths = remove_whitelisted(handshake_paths, self.options['whitelist'])
-            handshake_new = set(handshake_paths) - set(reported) - set(self.skip)
+            self.uploads.enqueue(*handshake_paths)
 
-            if handshake_new:
+            if self.uploads.pending():
                 logging.info("WPA_SEC: Internet connectivity detected. Uploading new handshakes to wpa-sec.stanev.org")
-                for idx, handshake in enumerate(handshake_new):
-                    display.on_uploading(f"wpa-sec.stanev.org ({idx + 1}/{len(handshake_new)})")
-
-                    try:
-                        self._upload_to_wpasec(handshake)
-                        reported.append(handshake)
-                        self.report.update(data={'reported': reported})
-                        logging.debug("WPA_SEC: Successfully uploaded %s", handshake)
-                    except requests.exceptions.RequestException as req_e:
-                        self.skip.append(handshake)
-                        logging.debug("WPA_SEC: %s", req_e)
-                        continue
-                    except OSError as os_e:
-                        logging.debug("WPA_SEC: %s", os_e)
-                        continue
-
+                self.uploads.process(
+                    progress=lambda done, total: display.on_uploading(f"wpa-sec.stanev.org ({done}/{total})"))
                 display.on_normal()
 
             if 'download_results' in self.options and self.options['download_results']:
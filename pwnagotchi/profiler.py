@@ -0,0 +1,185 @@
+import os
+import sys
+import time
+import json
+import logging
+import threading
+import contextlib
+
+DefaultReportPath = '/var/tmp/pwnagotchi/startup.json'
+
+_timeline = None
+
+
+class _TimedLoader(object):
+    """
+    Proxy of a module loader timing how long the module takes to execute
+    """
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self._profiler.timing(module.__name__):
+            self._loader.exec_module(module)
+
+
+class ImportProfiler(object):
+    """
+    Meta path finder recording, for every module imported while installed, its cumulative
+    import time and the time spent in the module itself (excluding the modules it imports),
+    the same numbers python -X importtime reports.
+    """
+
+    def __init__(self):
+        self.imports = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if getattr(self._local, 'finding', False):
+            return None
+
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    @contextlib.contextmanager
+    def timing(self, name):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        # [name, started, time spent importing other modules]
+        entry = [name, time.time(), 0.0]
+        stack.append(entry)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.time() - entry[1]
+            if stack:
+                stack[-1][2] += elapsed
+            with self._lock:
+                self.imports.append({
+                    'module': name,
+                    'self': elapsed - entry[2],
+                    'cumulative': elapsed,
+                    'depth': len(stack),
+                })
+
+
+class Timeline(object):
+    """
+    Wall time of the startup phases, nested phases are recorded with their depth
+    """
+
+    def __init__(self, imports=True):
+        self.started_at = time.time()
+        self.phases = []
+        self.profiler = ImportProfiler() if imports else None
+        self._depth = 0
+
+        if self.profiler is not None:
+            self.profiler.install()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        entry = {'name': name, 'start': time.time() - self.started_at, 'duration': None, 'depth': self._depth}
+        self.phases.append(entry)
+        self._depth += 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            entry['duration'] = time.time() - start
+
+    def to_dict(self):
+        return {
+            'started_at': self.started_at,
+            'total': time.time() - self.started_at,
+            'phases': self.phases,
+            'imports': self.profiler.imports if self.profiler is not None else [],
+        }
+
+    def report(self, path=None, top=15):
+        if self.profiler is not None:
+            self.profiler.uninstall()
+
+        data = self.to_dict()
+        logging.info("startup took %.2fs:" % data['total'])
+        for phase in data['phases']:
+            logging.info("  %s%-*s %7.3fs (at %.3fs)" % ('  ' * phase['depth'], 30 - 2 * phase['depth'],
+                                                       phase['name'], phase['duration'] or 0.0, phase['start']))
+
+        if data['imports']:
+            total = sum(i['self'] for i in data['imports'])
+            logging.info("%d modules imported in %.2fs, slowest ones:" % (len(data['imports']), total))
+            for imp in sorted(data['imports'], key=lambda i: i['self'], reverse=True)[:top]:
+                logging.info("  %-40s %7.3fs (cumulative %.3fs)" % (imp['module'], imp['self'], imp['cumulative']))
+
+        if path:
+            try:
+                dirname = os.path.dirname(path)
+                if dirname and not os.path.exists(dirname):
+                    os.makedirs(dirname)
+                temp = "%s.tmp" % path
+                with open(temp, 'wt') as fp:
+                    json.dump(data, fp, indent=2)
+                os.replace(temp, path)
+                logging.info("startup profile saved to %s" % path)
+            except Exception as e:
+                logging.error("error while saving the startup profile to %s: %s" % (path, e))
+
+        return data
+
+
+def start(imports=True):
+    global _timeline
+    _timeline = Timeline(imports=imports)
+    return _timeline
+
+
+def phase(name):
+    """
+    Records name as a startup phase if the profiler is running, does nothing otherwise
+    """
+    if _timeline is None:
+        return contextlib.nullcontext()
+    return _timeline.phase(name)
+
+
+def report(path=DefaultReportPath):
+    global _timeline
+    if _timeline is None:
+        return None
+    timeline, _timeline = _timeline, None
+    return timeline.report(path)
@@ -3,6 +3,7 @@ import logging
 import threading
 
 import pwnagotchi.plugins as plugins
+import pwnagotchi.profiler as profiler
 import pwnagotchi.ui.hw as hw
 from pwnagotchi.ui.view import View
 
@@ -81,7 +82,8 @@ class Display(View):
 
     def init_display(self):
         if self._enabled:
-            self._implementation.initialize()
+            with profiler.phase('%s.initialize' % self._implementation.name):
+                self._implementation.initialize()
             plugins.on('display_setup', self._implementation)
         else:
             logging.warning("display module is disabled")
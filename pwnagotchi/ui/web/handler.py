@@ -37,6 +37,9 @@ class Handler:
         self._app.add_url_rule('/reboot', 'reboot', self.with_auth(self.reboot), methods=['POST'])
         self._app.add_url_rule('/restart', 'restart', self.with_auth(self.restart), methods=['POST'])
 
+        # ai loading state
+        self._app.add_url_rule('/ai', 'ai', self.with_auth(self.ai))
+
         # inbox
         self._app.add_url_rule('/inbox', 'inbox', self.with_auth(self.inbox))
         self._app.add_url_rule('/inbox/profile', 'inbox_profile', self.with_auth(self.inbox_profile))
@@ -194,6 +197,9 @@ class Handler:
         else:
             abort(404)
 
+    def ai(self):
+        return jsonify(self._agent.ai_status())
+
     # serve a message and shuts down the unit
     def shutdown(self):
         try:
@@ -0,0 +1,268 @@
+import io
+import os
+import csv
+import time
+import uuid
+import logging
+import threading
+
+import requests
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from json.decoder import JSONDecodeError
+from pwnagotchi.utils import StatusFile
+
+_destinations = {}
+
+
+class PermanentError(Exception):
+    """
+    Raised by encoders and senders when an item can't ever be uploaded, it goes straight to the dead letters
+    """
+    pass
+
+
+class PartialUpload(Exception):
+    """
+    Raised by senders when only the first `done` payloads of a batch were uploaded, the rest is retried
+    """
+
+    def __init__(self, done, cause):
+        super(PartialUpload, self).__init__(cause)
+        self.done = done
+
+
+class MultipartBody(object):
+    """
+    multipart/form-data body with a single file part, read in blocks while it's being sent.
+
+    The file content comes either from path or from content bytes; since the total length is known
+    requests sends it with a Content-Length header instead of building the whole body in memory.
+    """
+
+    def __init__(self, name, filename, path=None, content=None, fields=None, content_type='application/octet-stream'):
+        boundary = uuid.uuid4().hex
+        head = ''
+        for field, value in (fields or {}).items():
+            head += '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (boundary, field, value)
+        head += '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\nContent-Type: %s\r\n\r\n' % (
+            boundary, name, filename, content_type)
+        tail = '\r\n--%s--\r\n' % boundary
+
+        if path is not None:
+            body, body_len = open(path, 'rb'), os.path.getsize(path)
+        else:
+            body, body_len = io.BytesIO(content), len(content)
+
+        head, tail = head.encode('utf-8'), tail.encode('utf-8')
+        self._parts = [io.BytesIO(head), body, io.BytesIO(tail)]
+        self.len = len(head) + body_len + len(tail)
+        self.content_type = 'multipart/form-data; boundary=%s' % boundary
+
+    def read(self, size=-1):
+        data = b''
+        while self._parts and (size < 0 or len(data) < size):
+            block = self._parts[0].read(size - len(data) if size >= 0 else -1)
+            if block:
+                data += block
+            else:
+                self._parts.pop(0).close()
+        return data
+
+    def close(self):
+        for part in self._parts:
+            part.close()
+        self._parts = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *unused):
+        self.close()
+
+
+def csv_chunks(header, rows, max_size, **fmtparams):
+    """
+    Writes rows as csv and yields (number of rows, bytes) chunks of at most max_size bytes (unless
+    a single row is bigger than that), each one starting with header
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf, **fmtparams)
+    header = header.encode('utf-8')
+    chunk = [header]
+    size = len(header)
+
+    for row in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        line = buf.getvalue().encode('utf-8')
+
+        if size + len(line) > max_size and len(chunk) > 1:
+            yield len(chunk) - 1, b''.join(chunk)
+            chunk = [header]
+            size = len(header)
+
+        chunk.append(line)
+        size += len(line)
+
+    if len(chunk) > 1:
+        yield len(chunk) - 1, b''.join(chunk)
+
+
+class Destination(object):
+    """
+    Persistent upload queue for a single service.
+
+    Items (usually file paths) are enqueued once and kept in the status file at path together with
+    the 'reported' and 'dead' lists, so the queue survives restarts. process() encodes the ready
+    items with encode(item), groups them in batches of batch_size and hands every batch to
+    send(session, payloads) from up to concurrency threads sharing one keep-alive session.
+    Failed items are retried with exponential backoff capped at max_backoff for as long as it
+    takes, only a PermanentError moves them to the dead letters. Uploaded and dead items leave
+    the queue.
+    """
+
+    def __init__(self, name, path, send, encode=None, batch_size=1, concurrency=2, backoff=60.0,
+                 max_backoff=3600.0):
+        self.name = name
+        self.send = send
+        self.encode = encode
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._retries = {}
+
+        try:
+            self.status = StatusFile(path, data_format='json', journal=True)
+        except JSONDecodeError:
+            logging.warning("[%s] corrupted upload status file %s, starting over" % (name, path))
+            os.remove(path)
+            self.status = StatusFile(path, data_format='json', journal=True)
+
+        # queues written before uploaded items were removed from them
+        done = [item for item in self.status.data_field_or('queued', default=[])
+                if self.status.contains('reported', item) or self.status.contains('dead', item)]
+        if done:
+            self.status.remove('queued', *done)
+
+    def is_known(self, item):
+        return self.status.contains('reported', item) or self.status.contains('dead', item) or \
+               self.status.contains('queued', item)
+
+    def enqueue(self, *items):
+        items = [item for item in items if not self.is_known(item)]
+        if items:
+            self.status.add('queued', *items)
+        return len(items)
+
+    def reported(self):
+        return self.status.data_field_or('reported', default=[])
+
+    def dead_letters(self):
+        return self.status.data_field_or('dead', default=[])
+
+    def pending(self):
+        now = time.time()
+        with self._lock:
+            return [item for item in self.status.data_field_or('queued', default=[])
+                    if self._retries.get(item, (0, 0))[1] <= now]
+
+    def _upload(self, batch):
+        """
+        Returns (uploaded, failed, dead) for a batch of items
+        """
+        payloads = []
+        encoded = []
+        failed = []
+        dead = []
+        for item in batch:
+            try:
+                payloads.append(self.encode(item) if self.encode else item)
+                encoded.append(item)
+            except PermanentError as e:
+                logging.warning("[%s] can't upload %s: %s" % (self.name, item, e))
+                dead.append(item)
+            except Exception as e:
+                logging.debug("[%s] can't encode %s: %s" % (self.name, item, e))
+                failed.append(item)
+
+        if not encoded:
+            return [], failed, dead
+
+        try:
+            self.send(self.session, payloads)
+        except PermanentError as e:
+            logging.warning("[%s] upload rejected: %s" % (self.name, e))
+            return [], failed, dead + encoded
+        except PartialUpload as e:
+            logging.debug("[%s] error while uploading, %d/%d items uploaded: %s" % (
+                self.name, e.done, len(encoded), e))
+            return encoded[:e.done], failed + encoded[e.done:], dead
+        except Exception as e:
+            logging.debug("[%s] error while uploading: %s" % (self.name, e))
+            return [], failed + encoded, dead
+
+        return encoded, failed, dead
+
+    def _failed(self, items):
+        now = time.time()
+        with self._lock:
+            for item in items:
+                attempts = self._retries.get(item, (0, 0))[0] + 1
+                # don't let 2 ** attempts grow forever during long outages
+                delay = min(self.backoff * (2 ** min(attempts - 1, 32)), self.max_backoff)
+                self._retries[item] = (attempts, now + delay)
+
+    def process(self, progress=None):
+        """
+        Uploads every ready item, calls progress(done, total) after each batch and returns the number of uploaded items
+        """
+        items = self.pending()
+        if not items:
+            return 0
+
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        num_done = 0
+        num_uploaded = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {pool.submit(self._upload, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                uploaded, failed, dead = future.result()
+                self._failed(failed)
+                with self._lock:
+                    for item in uploaded:
+                        self._retries.pop(item, None)
+
+                with self.status.batch():
+                    self.status.add('reported', *uploaded)
+                    self.status.add('dead', *dead)
+                    self.status.remove('queued', *(uploaded + dead))
+
+                num_done += len(futures[future])
+                num_uploaded += len(uploaded)
+                if progress is not None:
+                    progress(num_done, len(items))
+
+        logging.info("[%s] uploaded %d/%d items (%d dead letters)" % (
+            self.name, num_uploaded, len(items), len(self.dead_letters())))
+
+        return num_uploaded
+
+
+def register(name, path, send, encode=None, **kwargs):
+    if name not in _destinations:
+        _destinations[name] = Destination(name, path, send, encode=encode, **kwargs)
+    else:
+        # plugin reloaded, keep the queue but use the new callbacks
+        _destinations[name].send = send
+        _destinations[name].encode = encode
+    return _destinations[name]
+
+
+def destination(name):
+    return _destinations.get(name)
@@ -1,6 +1,8 @@
 
 import logging
 import glob
+import contextlib
+import threading
 import os
 import time
 import subprocess
@@ -129,6 +131,46 @@ def merge_config(user, default):
                 user[k] = merge_config(user[k], v)
     return user
 
+
+def flatten_config(config, prefix=''):
+    """
+    Returns the configuration as a dictionary of dotted keys, like the ones used in the toml files
+    """
+    flat = {}
+    for key, value in config.items():
+        name = prefix + str(key)
+        if isinstance(value, dict) and value:
+            flat.update(flatten_config(value, name + '.'))
+        else:
+            flat[name] = value
+    return flat
+
+
+def diff_config(old, new):
+    """
+    Returns the sorted dotted keys that were added, removed or changed from old to new
+    """
+    missing = object()
+    old, new = flatten_config(old), flatten_config(new)
+    return sorted(key for key in set(old) | set(new) if old.get(key, missing) != new.get(key, missing))
+
+
+def update_config(config, new):
+    """
+    Updates config in place to match new, so that everything holding a reference to it or
+    to one of its sections sees the new values
+    """
+    for key in list(config.keys()):
+        if key not in new:
+            del config[key]
+
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            update_config(config[key], value)
+        else:
+            config[key] = value
+    return config
+
 def keys_to_str(data):
     if isinstance(data,list):
         converted_list = list()
@@ -153,6 +195,130 @@ def save_config(config, target):
         fp.write(toml.dumps(config, encoder=DottedTomlEncoder()))
     return True
 
+# aliases of the supported display types, load_config normalizes them so we don't need dozens of if/elif around
+DISPLAY_TYPES = {
+    'inky': 'inky', 'inkyphat': 'inky',
+    'papirus': 'papirus', 'papi': 'papirus',
+    'oledhat': 'oledhat',
+    'ws_1': 'waveshare_1', 'ws1': 'waveshare_1', 'waveshare_1': 'waveshare_1', 'waveshare1': 'waveshare_1',
+    'ws_2': 'waveshare_2', 'ws2': 'waveshare_2', 'waveshare_2': 'waveshare_2', 'waveshare2': 'waveshare_2',
+    'ws_3': 'waveshare_3', 'ws3': 'waveshare_3', 'waveshare_3': 'waveshare_3', 'waveshare3': 'waveshare_3',
+    'ws_27inch': 'waveshare27inch', 'ws27inch': 'waveshare27inch', 'waveshare_27inch': 'waveshare27inch',
+    'waveshare27inch': 'waveshare27inch',
+    'ws_29inch': 'waveshare29inch', 'ws29inch': 'waveshare29inch', 'waveshare_29inch': 'waveshare29inch',
+    'waveshare29inch': 'waveshare29inch',
+    'lcdhat': 'lcdhat',
+    'dfrobot_1': 'dfrobot_1', 'df1': 'dfrobot_1',
+    'dfrobot_2': 'dfrobot_2', 'df2': 'dfrobot_2',
+    'ws_154inch': 'waveshare154inch', 'ws154inch': 'waveshare154inch', 'waveshare_154inch': 'waveshare154inch',
+    'waveshare154inch': 'waveshare154inch',
+    'waveshare144lcd': 'waveshare144lcd', 'ws_144inch': 'waveshare144lcd', 'ws144inch': 'waveshare144lcd',
+    'waveshare_144inch': 'waveshare144lcd', 'waveshare144inch': 'waveshare144lcd',
+    'ws_213d': 'waveshare213d', 'ws213d': 'waveshare213d', 'waveshare_213d': 'waveshare213d',
+    'waveshare213d': 'waveshare213d',
+    'ws_213bc': 'waveshare213bc', 'ws213bc': 'waveshare213bc', 'waveshare_213bc': 'waveshare213bc',
+    'waveshare213bc': 'waveshare213bc',
+    'waveshare35lcd': 'waveshare35lcd',
+    'spotpear24inch': 'spotpear24inch',
+}
+
+# bump when the way the configuration is merged or normalized changes
+CONFIG_CACHE_VERSION = 1
+
+
+def _dropin_pattern(config):
+    dropin = config['main']['confd']
+    if not dropin:
+        return None
+    # even if the directory doesn't exist (yet), the cache checks this against the drop-ins found next time;
+    # only toml here; yaml is no more
+    return dropin + ('*.toml' if dropin.endswith('/') else '/*.toml')
+
+
+def _source_fingerprint(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, md5(path)
+
+
+def _config_cache_path(args):
+    return os.path.join(os.path.dirname(args.config), '.config.cache')
+
+
+def _load_cached_config(args, ref_defaults_file):
+    """
+    Returns the merged configuration saved by _save_cached_config if none of its sources changed, None otherwise
+    """
+    import pickle
+    import pwnagotchi
+
+    try:
+        with open(_config_cache_path(args), 'rb') as fp:
+            cache = pickle.load(fp)
+    except Exception:
+        return None
+
+    if cache.get('version') != (CONFIG_CACHE_VERSION, pwnagotchi.__version__) or \
+            cache['files'] != (ref_defaults_file, args.config, args.user_config):
+        return None
+
+    dropins = glob.glob(cache['dropin']) if cache['dropin'] else []
+    if sorted(dropins) != sorted(cache['dropins']):
+        return None
+
+    changed = False
+    for path, cached in cache['sources'].items():
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+
+        if st is None or cached is None:
+            if st is not cached:
+                return None
+        elif (st.st_mtime_ns, st.st_size) != cached[:2]:
+            # touched but maybe not changed
+            if st.st_size != cached[1] or md5(path) != cached[2]:
+                return None
+            cache['sources'][path] = (st.st_mtime_ns, st.st_size, cached[2])
+            changed = True
+
+    if changed:
+        _write_config_cache(args, cache)
+
+    return cache['config']
+
+
+def _save_cached_config(args, ref_defaults_file, config, dropin, dropins):
+    import pwnagotchi
+
+    sources = [ref_defaults_file, args.config, args.user_config] + dropins
+    _write_config_cache(args, {
+        'version': (CONFIG_CACHE_VERSION, pwnagotchi.__version__),
+        'files': (ref_defaults_file, args.config, args.user_config),
+        'dropin': dropin,
+        'dropins': dropins,
+        'sources': {path: _source_fingerprint(path) for path in sources},
+        'config': config,
+    })
+
+
+def _write_config_cache(args, cache):
+    import pickle
+
+    path = _config_cache_path(args)
+    temp = "%s.tmp" % path
+    try:
+        with open(temp, 'wb') as fp:
+            pickle.dump(cache, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+    except Exception as e:
+        # logging not configured here yet, not being able to cache is not an error anyway
+        logging.debug("can't save the configuration cache to %s: %s" % (path, e))
+
+
 def load_config(args):
     default_config_path = os.path.dirname(args.config)
     if not os.path.exists(default_config_path):
@@ -177,6 +343,11 @@ def load_config(args):
         shutil.rmtree('/etc/pwnagotchi', ignore_errors=True)
         shutil.move('/boot/pwnagotchi', '/etc/')
 
+    # if none of the files below changed since the last time, we're done
+    config = _load_cached_config(args, ref_defaults_file)
+    if config is not None:
+        return config
+
     # if not config is found, copy the defaults
     if not os.path.exists(args.config):
         print("copying %s to %s ..." % (ref_defaults_file, args.config))
@@ -224,70 +395,21 @@ def load_config(args):
         sys.exit(1)
 
     # dropins
-    dropin = config['main']['confd']
-    if dropin and os.path.isdir(dropin):
-        dropin += '*.toml' if dropin.endswith('/') else '/*.toml' # only toml here; yaml is no more
-        for conf in glob.glob(dropin):
-            with open(conf) as toml_file:
-                additional_config = toml.load(toml_file)
-                config = merge_config(additional_config, config)
-
-    # the very first step is to normalize the display name so we don't need dozens of if/elif around
-    if config['ui']['display']['type'] in ('inky', 'inkyphat'):
-        config['ui']['display']['type'] = 'inky'
-
-    elif config['ui']['display']['type'] in ('papirus', 'papi'):
-        config['ui']['display']['type'] = 'papirus'
-
-    elif config['ui']['display']['type'] in ('oledhat',):
-        config['ui']['display']['type'] = 'oledhat'
-
-    elif config['ui']['display']['type'] in ('ws_1', 'ws1', 'waveshare_1', 'waveshare1'):
-        config['ui']['display']['type'] = 'waveshare_1'
-
-    elif config['ui']['display']['type'] in ('ws_2', 'ws2', 'waveshare_2', 'waveshare2'):
-        config['ui']['display']['type'] = 'waveshare_2'
-
-    elif config['ui']['display']['type'] in ('ws_3', 'ws3', 'waveshare_3', 'waveshare3'):
-        config['ui']['display']['type'] = 'waveshare_3'
-
-    elif config['ui']['display']['type'] in ('ws_27inch', 'ws27inch', 'waveshare_27inch', 'waveshare27inch'):
-        config['ui']['display']['type'] = 'waveshare27inch'
-
-    elif config['ui']['display']['type'] in ('ws_29inch', 'ws29inch', 'waveshare_29inch', 'waveshare29inch'):
-        config['ui']['display']['type'] = 'waveshare29inch'
-
-    elif config['ui']['display']['type'] in ('lcdhat',):
-        config['ui']['display']['type'] = 'lcdhat'
-
-    elif config['ui']['display']['type'] in ('dfrobot_1', 'df1'):
-        config['ui']['display']['type'] = 'dfrobot_1'
-
-    elif config['ui']['display']['type'] in ('dfrobot_2', 'df2'):
-        config['ui']['display']['type'] = 'dfrobot_2'
-
-    elif config['ui']['display']['type'] in ('ws_154inch', 'ws154inch', 'waveshare_154inch', 'waveshare154inch'):
-        config['ui']['display']['type'] = 'waveshare154inch'
-
-    elif config['ui']['display']['type'] in ('waveshare144lcd', 'ws_144inch', 'ws144inch', 'waveshare_144inch', 'waveshare144inch'):
-        config['ui']['display']['type'] = 'waveshare144lcd'
-
-    elif config['ui']['display']['type'] in ('ws_213d', 'ws213d', 'waveshare_213d', 'waveshare213d'):
-        config['ui']['display']['type'] = 'waveshare213d'
-
-    elif config['ui']['display']['type'] in ('ws_213bc', 'ws213bc', 'waveshare_213bc', 'waveshare213bc'):
-        config['ui']['display']['type'] = 'waveshare213bc'
-
-    elif config['ui']['display']['type'] in ('waveshare35lcd'):
-        config['ui']['display']['type'] = 'waveshare35lcd'
-
-    elif config['ui']['display']['type'] in ('spotpear24inch'):
-        config['ui']['display']['type'] = 'spotpear24inch'
-
-    else:
-        print("unsupported display type %s" % config['ui']['display']['type'])
+    dropin = _dropin_pattern(config)
+    dropins = glob.glob(dropin) if dropin else []
+    for conf in dropins:
+        with open(conf) as toml_file:
+            additional_config = toml.load(toml_file)
+            config = merge_config(additional_config, config)
+
+    # the very first step is to normalize the display name
+    display_type = config['ui']['display']['type']
+    if display_type not in DISPLAY_TYPES:
+        print("unsupported display type %s" % display_type)
         sys.exit(1)
+    config['ui']['display']['type'] = DISPLAY_TYPES[display_type]
 
+    _save_cached_config(args, ref_defaults_file, config, dropin, dropins)
     return config
 
 
@@ -435,11 +557,45 @@ def extract_from_pcap(path, fields):
 
     return results
 
+class RateLimiter(object):
+    """
+    Spaces out wait() returns so that at most rate of them happen per second, across threads
+    """
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            at = max(now, self._next)
+            self._next = at + self._interval
+
+        if at > now:
+            time.sleep(at - now)
+
+
 class StatusFile(object):
-    def __init__(self, path, data_format='raw'):
+    """
+    Small persistent status, either raw or json.
+
+    With journal=True (json only) additions to list fields made through add() and removals made
+    through remove() are appended to <path>.journal instead of rewriting the whole file, and folded
+    back into it once the journal grows bigger than the file itself (and at least compact_size bytes).
+    """
+
+    def __init__(self, path, data_format='raw', journal=False, compact_size=64 * 1024):
         self._path = path
         self._updated = None
         self._format = data_format
+        self._journal = "%s.journal" % path if journal else None
+        self._compact_size = compact_size
+        self._lock = threading.RLock()
+        self._sets = {}
+        self._pending = None
+        self._depth = 0
         self.data = None
 
         if os.path.exists(path):
@@ -450,11 +606,154 @@ class StatusFile(object):
                 else:
                     self.data = fp.read()
 
+        if self._journal and os.path.exists(self._journal):
+            self._replay()
+
+    def _replay(self):
+        if self.data is None:
+            self.data = {}
+
+        torn = False
+        with open(self._journal) as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn write, the items it carried were not acknowledged anyway
+                    torn = True
+                    continue
+                for name, items in entry.items():
+                    if name.startswith('-'):
+                        self._discard(name[1:], items)
+                    else:
+                        self._apply(name, items)
+
+        self._updated = datetime.fromtimestamp(os.path.getmtime(self._journal))
+        if torn:
+            # don't append after a partial line
+            self.compact()
+
+    def _set(self, name):
+        if name not in self._sets:
+            self._sets[name] = set(self.data_field_or(name, default=[]))
+        return self._sets[name]
+
+    def _apply(self, name, items):
+        seen = self._set(name)
+        field = self.data.setdefault(name, [])
+        added = []
+        for item in items:
+            if item not in seen:
+                seen.add(item)
+                field.append(item)
+                added.append(item)
+        return added
+
+    def _discard(self, name, items):
+        seen = self._set(name)
+        gone = set(item for item in items if item in seen)
+        if gone:
+            seen.difference_update(gone)
+            self.data[name] = [item for item in self.data.get(name, []) if item not in gone]
+        return list(gone)
+
+    def _append(self, entry):
+        if self._journal is None:
+            self._write()
+            return
+
+        with open(self._journal, 'a') as fp:
+            fp.write(json.dumps(entry) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+            journal_size = fp.tell()
+
+        base_size = os.path.getsize(self._path) if os.path.exists(self._path) else 0
+        if journal_size >= max(self._compact_size, base_size):
+            self.compact()
+
+    def _write(self):
+        from pwnagotchi.fs import ensure_write
+        with ensure_write(self._path, 'w') as fp:
+            if self.data is None:
+                fp.write(str(self._updated))
+
+            elif self._format == 'json':
+                json.dump(self.data, fp)
+
+            else:
+                fp.write(self.data)
+
     def data_field_or(self, name, default=""):
         if self.data is not None and name in self.data:
             return self.data[name]
         return default
 
+    def contains(self, name, item):
+        with self._lock:
+            return self.data is not None and item in self._set(name)
+
+    def add(self, name, *items):
+        """
+        Appends the items not already there to the list field name and persists only them
+        """
+        with self._lock:
+            if self.data is None:
+                self.data = {}
+
+            added = self._apply(name, items)
+            if not added:
+                return
+
+            self._updated = datetime.now()
+            if self._pending is not None:
+                self._pending.setdefault(name, []).extend(added)
+            else:
+                self._append({name: added})
+
+    def remove(self, name, *items):
+        """
+        Removes the items from the list field name, journaled as a '-name' entry
+        """
+        with self._lock:
+            if self.data is None:
+                return
+
+            removed = self._discard(name, items)
+            if not removed:
+                return
+
+            self._updated = datetime.now()
+            if self._pending is not None:
+                self._pending.setdefault('-%s' % name, []).extend(removed)
+            else:
+                self._append({'-%s' % name: removed})
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Coalesces every add() done inside the block into a single write
+        """
+        with self._lock:
+            self._depth += 1
+            if self._pending is None:
+                self._pending = {}
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if self._depth == 0:
+                    pending, self._pending = self._pending, None
+                    if pending:
+                        self._append(pending)
+
+    def compact(self):
+        with self._lock:
+            self._write()
+            if self._journal and os.path.exists(self._journal):
+                os.remove(self._journal)
+
     def newer_then_minutes(self, minutes):
         return self._updated is not None and ((datetime.now() - self._updated).seconds / 60) < minutes
 
@@ -465,15 +764,8 @@ class StatusFile(object):
         return self._updated is not None and (datetime.now() - self._updated).days < days
 
     def update(self, data=None):
-        from pwnagotchi.fs import ensure_write
-        self._updated = datetime.now()
-        self.data = data
-        with ensure_write(self._path, 'w') as fp:
-            if data is None:
-                fp.write(str(self._updated))
-
-            elif self._format == 'json':
-                json.dump(self.data, fp)
-
-            else:
-                fp.write(data)
+        with self._lock:
+            self._updated = datetime.now()
+            self.data = data
+            self._sets = {}
+            self.compact()